@@ -1,11 +1,15 @@
 # agendador_pro.py
 
-import os, sys, json, subprocess, traceback, time, smtplib, ssl, threading, shlex
-from email.mime.text import MIMEText
-from email.utils import formatdate
+import os, sys, json, subprocess, time, threading, bisect
 from datetime import datetime
 from pathlib import Path
 import re
+
+# Modo headless: não importa tkinter/PIL/sv_ttk
+if __name__ == "__main__" and "--daemon" in sys.argv[1:]:
+    from agendador_core import run_daemon
+    sys.exit(run_daemon())
+
 from tkinter import ttk, filedialog, messagebox, simpledialog
 icon=['Logo.ico'],
 
@@ -114,6 +118,7 @@ def _apply_update_and_restart(new_exe: Path):
     si.wShowWindow = 0  # SW_HIDE
 
     subprocess.Popen(["cmd", "/c", str(updater)], creationflags=flags, startupinfo=si)
+    flush_data()  # os._exit pula o atexit
     os._exit(0)
 
 
@@ -202,374 +207,36 @@ except Exception:
 
 import tkinter as tk
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.interval import IntervalTrigger
-
 # Logos/ícones (opcional)
 try:
     from PIL import Image, ImageTk  # pip install pillow
 except Exception:
     Image = ImageTk = None
 
-# Para checar processos em execução (opcional, mas recomendado)
-try:
- import psutil  # pip install psutil
-except Exception:
-    psutil = None
-
-# ======================================================================================
-#  Caminhos / Pastas (resistente a Program Files)
-# ======================================================================================
-
-APP_NAME = "Agendador-Bravo"
-APP_BASENAME = "AgendadorBravo"  # nome de pasta em ProgramData
-
-def resource_path(*parts):
-    """Retorna caminho para recurso empacotado (PyInstaller) ou ao lado do .py.
-    Tolerante quando __file__ não existe (p.ex. durante shutdown)."""
-    try:
-        base = Path(getattr(sys, "_MEIPASS", Path(__file__).parent))
-    except NameError:
-        base = Path.cwd()
-    return base.joinpath(*parts)
-
-def pick_base_dir():
-    """Escolhe uma pasta gravável do usuário/sistema (ProgramData > LocalAppData > AppData > Home)."""
-    for env in ("PROGRAMDATA", "LOCALAPPDATA", "APPDATA"):
-        base = os.environ.get(env)
-        if base:
-            p = Path(base) / APP_BASENAME
-            try:
-                p.mkdir(parents=True, exist_ok=True)
-                return p
-            except Exception:
-                pass
-    p = Path.home() / APP_BASENAME
-    p.mkdir(parents=True, exist_ok=True)
-    return p
-
-APP_DIR = pick_base_dir()            # ex.: C:\ProgramData\AgendadorBravo
-DATA_FILE = APP_DIR / "config.json"  # config.json gravável
-LOG_DIR  = APP_DIR / "logs"          # logs graváveis
-WA_DIR   = APP_DIR / "wa"            # cache do WhatsApp WebJS (gravável)
-PID_DIR  = APP_DIR / "pids"          # pids para modo spawn/watchdog
-
-def ensure_dirs():
-    for d in (APP_DIR, LOG_DIR, WA_DIR, PID_DIR):
-        d.mkdir(parents=True, exist_ok=True)
-
-def _safe_name(name: str) -> str:
-    return "".join(ch if ch.isalnum() else "_" for ch in name)
-
-# ======================================================================================
-#  Utilitários / Persistência
-# ======================================================================================
-
-def now_str():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-def format_days_bool(days_list):
-    labels = ["seg","ter","qua","qui","sex","sab","dom"]
-    return ",".join([labels[i] for i,v in enumerate(days_list) if v])
-
-def load_data():
-    """Carrega config.json; cria defaults se não existir/corrompido."""
-    ensure_dirs()
-    if DATA_FILE.exists():
-        try:
-            return json.loads(DATA_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {
-        "settings": {
-            "pdi_home": r"C:\Pentaho\data-integration",
-            "email": {
-                "enabled": False, "smtp_host": "smtp.gmail.com", "smtp_port": 587,
-                "username": "", "password": "", "from_email": "", "to_emails": []
-            },
-            "whatsapp": {
-                "enabled": False,
-                "mode": "webjs",
-                "node_path": r"C:\Program Files\nodejs\node.exe",
-                "webjs_script": str(resource_path("wa", "wa_send.js")),
-                "to_targets": [],
-                "my_number": ""
-            }
-        },
-        "tasks": [],
-        "history": {}
-    }
-
-def save_data(data):
-    ensure_dirs()
-    DATA_FILE.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
-
-def append_history(data, task_name, rc, dur):
-    hist = data.setdefault("history", {}).setdefault(task_name, [])
-    hist.append({"ts": now_str(), "rc": int(rc), "dur": float(dur)})
-    if len(hist) > 50:
-        del hist[:-50]
-    save_data(data)
-
-# ======================================================================================
-#  Notificações
-# ======================================================================================
-
-def send_email(settings, subject, body):
-    cfg = settings.get("email", {})
-    if not cfg.get("enabled"):
-        return
-    to_emails = cfg.get("to_emails", [])
-    if isinstance(to_emails, str):
-        to_emails = [e.strip() for e in to_emails.split(",") if e.strip()]
-    if not to_emails:
-        return
-
-    msg = MIMEText(body, _charset="utf-8")
-    msg["Subject"] = subject
-    msg["From"] = cfg["from_email"] or cfg["username"]
-    msg["To"] = ", ".join(to_emails)
-    msg["Date"] = formatdate(localtime=True)
-
-    context = ssl.create_default_context()
-    with smtplib.SMTP(cfg["smtp_host"], int(cfg.get("smtp_port", 587)), timeout=30) as server:
-        server.ehlo()
-        server.starttls(context=context)
-        server.login(cfg["username"], cfg["password"])
-        server.sendmail(msg["From"], to_emails, msg.as_string())
-
-def send_whatsapp(settings, subject, body, timeout_sec=45):
-    cfg = settings.get("whatsapp", {})
-    if not cfg.get("enabled"):
-        return
-
-    mode = cfg.get("mode", "webjs")
-    if mode == "twilio":
-        try:
-            from twilio.rest import Client
-        except Exception:
-            return
-        client = Client(cfg.get("account_sid",""), cfg.get("auth_token",""))
-        to_numbers = cfg.get("to_numbers") or cfg.get("to_targets") or []
-        if isinstance(to_numbers, str):
-            to_numbers = [n.strip() for n in to_numbers.split(",") if n.strip()]
-        text = f"{subject}\n\n{body[:1500]}"
-        for to in to_numbers:
-            client.messages.create(from_=cfg.get("from_number",""), to=to, body=text)
-        return
-
-    # WebJS (QR)
-    node   = cfg.get("node_path", r"C:\Program Files\nodejs\node.exe")
-    script = cfg.get("webjs_script", str(resource_path("wa", "wa_send.js")))
-    tos    = cfg.get("to_targets", [])
-    if isinstance(tos, str):
-        tos = [t.strip() for t in tos.split(",") if t.strip()]
-
-    if not tos or not os.path.exists(node) or not os.path.exists(script):
-        raise RuntimeError("WhatsApp (QR) não configurado corretamente.")
-
-    ensure_dirs()
-    msg = f"{subject}\n\n{body}"
-    cmd = [node, script, "--to", ",".join(tos), "--message", msg]
-
-    proc = subprocess.run(
-    cmd,
-    cwd=str(WA_DIR),
-    stdout=subprocess.PIPE,
-    stderr=subprocess.STDOUT,
-    text=True,
-    encoding="utf-8",
-    errors="ignore",   # <— evita UnicodeDecodeError
-    timeout=timeout_sec
+from agendador_core import (
+    APP_NAME, APP_BASENAME, APP_DIR, LOG_DIR, WA_DIR,
+    resource_path, ensure_dirs, now_str, format_days_bool, parse_times,
+    load_data, save_data, flush_data, append_history, history_store, history_tail, history_columns,
+    downsample_runs, send_email, send_whatsapp, close_whatsapp_sender, run_task,
+    SchedulerEngine, acquire_engine_lock, release_engine_lock, engine_host, DEFAULT_POOLS, executor_settings, format_pool_stats, format_spawn_status,
+    history_settings, stagger_settings, alert_settings, notifier,
+    history_usage, history_dispatch, export_history_csv, fmt_bytes, metrics_settings,
+    warm_settings, WARM_MAX_SIZE, pdi_settings, pdi_steps, history_steps, format_pdi_steps,
+    task_deps, dependency_cycle,
 )
 
-    out = (proc.stdout or "")[-800:]
-    if proc.returncode != 0:
-        raise RuntimeError(f"wa_send.js RC={proc.returncode}\n{out}")
-
-# ======================================================================================
-#  Execução de tarefas / logs
-# ======================================================================================
-
-def build_command(task, pdi_home):
-    path = task["path"]
-    args = task.get("args","").strip()
-    arg_list = shlex.split(args, posix=False) if args else []
-    ext = Path(path).suffix.lower()
-
-    if ext == ".exe":
-        return [path] + arg_list
-    if ext in (".bat", ".cmd"):
-        return ["cmd", "/c", path] + arg_list
-    if ext == ".ps1":
-        return ["powershell", "-ExecutionPolicy", "Bypass", "-File", path] + arg_list
-    if ext == ".py":
-        py = sys.executable
-        return [py, path] + arg_list
-    if ext == ".ktr":
-        return [str(Path(pdi_home)/"Pan.bat"), f"/file:{path}"] + arg_list
-    if ext == ".kjb":
-        return [str(Path(pdi_home)/"Kitchen.bat"), f"/file:{path}"] + arg_list
-    return [path] + arg_list
-
-def _pid_alive(pid: int) -> bool:
-    if pid <= 0:
-        return False
-    if psutil:
-        try:
-            return psutil.pid_exists(pid)
-        except Exception:
-            pass
-    # Fallback simples no Windows via tasklist
-    if os.name == "nt":
-        try:
-            res = subprocess.run(
-    ["cmd", "/c", f'tasklist /FI "PID eq {pid}"'],
-    capture_output=True, text=True, encoding="utf-8",
-    errors="ignore",   # <— evita UnicodeDecodeError
-    timeout=5
-)
-            out = (res.stdout or "")
-            return "INFO: No tasks" not in out and str(pid) in out
-        except Exception:
-            return False
-    return False
-
-def _already_running_by_pidfile(task) -> bool:
-    """Usa arquivo PID para verificar se o processo anterior (spawn) ainda vive."""
-    pidfile = PID_DIR / (_safe_name(task["name"]) + ".pid")
-    if not pidfile.exists():
-        return False
-    try:
-        pid = int(pidfile.read_text(encoding="utf-8").strip())
-    except Exception:
-        return False
-    alive = _pid_alive(pid)
-    if not alive:
-        # limpa pid antigo
-        try: pidfile.unlink(missing_ok=True)
-        except Exception: pass
-    return alive
-
-def _write_pid(task, pid: int):
-    try:
-        (PID_DIR / (_safe_name(task["name"]) + ".pid")).write_text(str(pid), encoding="utf-8")
-    except Exception:
-        pass
-
-def run_task(task, settings, progress_cb=None):
-    ensure_dirs()
-    name = task["name"]
-    log_file = LOG_DIR / f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    pdi_home = settings.get("pdi_home", r"C:\Pentaho\data-integration")
-    cmd = build_command(task, pdi_home)
-    workdir = task.get("working_dir") or str(Path(task["path"]).parent)
-    timeout = int(task.get("timeout", "0") or 0) or None
-    spawn = bool(task.get("spawn", False))
-
-    # força UTF-8 no filho Python
-    env = os.environ.copy()
-    env.setdefault("PYTHONIOENCODING", "utf-8")
-    env.setdefault("PYTHONUTF8", "1")
-
-    # se for spawn e já tem processo vivo, só loga e sai
-    if spawn and _already_running_by_pidfile(task):
-        try:
-            with open(log_file, "a", encoding="utf-8", errors="ignore") as f:
-                f.write(f"# {name} @ {now_str()} (spawn)\n")
-                f.write("Processo já está em execução. Nada a fazer.\n")
-        except Exception:
-            pass
-        return 0, 0.0, str(log_file)
-
-    start = time.time()
-
-    if spawn:
-        # inicia DETACHED escrevendo direto no log e retorna
-        try:
-            log_fh = open(log_file, "a", encoding="utf-8", errors="ignore")
-            log_fh.write(f"# {name} @ {now_str()} (spawn)\nCMD: {' '.join(cmd)}\n\n")
-
-            popen_kwargs = dict(cwd=workdir, stdout=log_fh, stderr=subprocess.STDOUT, env=env)
-            if os.name == "nt":
-                CREATE_NEW_PROCESS_GROUP = 0x00000200
-                DETACHED_PROCESS = 0x00000008
-                CREATE_NO_WINDOW = 0x08000000
-                popen_kwargs["creationflags"] = (CREATE_NEW_PROCESS_GROUP |
-                                                 DETACHED_PROCESS | CREATE_NO_WINDOW)
-            else:
-                import os as _os
-                popen_kwargs["preexec_fn"] = _os.setpgrp
-
-            proc = subprocess.Popen(cmd, **popen_kwargs)
-            _write_pid(task, proc.pid)
-            try:
-                log_fh.flush(); log_fh.close()
-            except Exception:
-                pass
-            return 0, time.time() - start, str(log_file)
-        except Exception as e:
-            with open(log_file, "a", encoding="utf-8", errors="ignore") as f:
-                f.write("\n### ERRO ao iniciar em modo spawn:\n" + "".join(traceback.format_exception(e)))
-            return -1, time.time() - start, str(log_file)
-
-    # modo tradicional: stream da saída para o log, aguardando terminar
-    with open(log_file, "w", encoding="utf-8", errors="ignore") as f:
-        f.write(f"# {name} @ {now_str()}\nCMD: {' '.join(cmd)}\n\n")
-        try:
-            proc = subprocess.Popen(
-                cmd, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                text=True, encoding="utf-8", errors="ignore", bufsize=1, env=env
-            )
-            while True:
-                line = proc.stdout.readline()
-                if not line and proc.poll() is not None:
-                    break
-                if line:
-                    f.write(line)
-                    if progress_cb:
-                        progress_cb(line.strip()[:140])
-            if timeout and (time.time() - start) > timeout:
-                try: proc.kill()
-                except Exception: pass
-                rc = -9
-                f.write("\n### TIMEOUT atingido.\n")
-            else:
-                rc = proc.returncode
-        except Exception as e:
-            rc = -1
-            f.write("\n### ERRO ao iniciar/executar:\n" + "".join(traceback.format_exception(e)))
-
-    return rc, time.time() - start, str(log_file)
-
 # ======================================================================================
 #  Diálogos
 # ======================================================================================
 
-def parse_times(text: str):
-    """
-    Converte '13:30, 14:16;18:00' -> ['13:30','14:16','18:00'].
-    Aceita separadores: vírgula, ponto e vírgula ou espaços.
-    """
-    parts = [p for p in re.split(r"[,\s;]+", text.strip()) if p]
-    out = []
-    for p in parts:
-        h, m = p.split(":")
-        h = int(h); m = int(m)
-        assert 0 <= h <= 23 and 0 <= m <= 59
-        norm = f"{h:02d}:{m:02d}"
-        if norm not in out:
-            out.append(norm)
-    return out or ["06:00"]
-
-
 class TaskDialog(tk.Toplevel):
     """
     Dialogo de tarefa com botão 'Horários...' que abre um editor de horários.
     - No modo 'Horário fixo' (cron): é obrigatório ter >= 1 horário.
     - No modo 'Intervalo': o botão de horários é desabilitado e
       usam-se os campos 'A cada N minutes/hours'.
+    - 'Depois de': tarefas anteriores do fluxo; no modo 'Após outras tarefas'
+      a tarefa só roda quando elas terminam.
     """
     def __init__(self, master, task=None):
         super().__init__(master)
@@ -601,6 +268,24 @@ class TaskDialog(tk.Toplevel):
         self.var_every_val = tk.StringVar(value=str((task or {}).get("every_value", "30")))
         self.var_every_unit = tk.StringVar(value=(task or {}).get("every_unit", "minutes"))
         self.var_spawn = tk.BooleanVar(value=(task or {}).get("spawn", True))
+        self.var_warm = tk.BooleanVar(value=(task or {}).get("warm", False))
+        self.var_jvm = tk.StringVar(value=(task or {}).get("jvm_opts", ""))
+        self.var_pdi_batch = tk.BooleanVar(value=(task or {}).get("pdi_batch", False))
+        self.var_pool = tk.StringVar(value=(task or {}).get("pool", ""))
+        self.var_restart = tk.StringVar(value=RESTART_LABELS.get((task or {}).get("restart", "never"),
+                                                                 RESTART_LABELS["never"]))
+        try:
+            pool_names = list(executor_settings(master.data.get("settings", {}))["pools"])
+        except Exception:
+            pool_names = list(DEFAULT_POOLS)
+        self._orig_name = (task or {}).get("name")
+        deps = task_deps(task or {})
+        self.var_after = tk.StringVar(value=", ".join(u for u, _ in deps))
+        self.var_after_mode = tk.StringVar(value=DEP_MODE_LABELS[deps[0][1] if deps else "success"])
+        try:
+            self._other_tasks = [t for t in master.data.get("tasks", []) if t["name"] != self._orig_name]
+        except Exception:
+            self._other_tasks = []
 
         days = (task or {}).get("days", [True] * 7)
         self.days_vars = [tk.BooleanVar(value=days[i]) for i in range(7)]
@@ -635,6 +320,11 @@ class TaskDialog(tk.Toplevel):
             .grid(row=row, column=3, sticky="we")
         row += 1
 
+        ttk.Label(frm, text="Opções da JVM (Pentaho):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_jvm, width=42)\
+            .grid(row=row, column=1, columnspan=3, sticky="we")
+        row += 1
+
         # ---- Linha Horários + Timeout ----
         self.lbl_time_title = ttk.Label(frm, text="Horário(s):")
         self.lbl_time_title.grid(row=row, column=0, sticky="w")
@@ -654,6 +344,11 @@ class TaskDialog(tk.Toplevel):
             .grid(row=row, column=3, sticky="w")
         row += 1
 
+        ttk.Label(frm, text="Pool (vazio=automático):").grid(row=row, column=0, sticky="w")
+        ttk.Combobox(frm, textvariable=self.var_pool, values=[""] + pool_names, width=16)\
+            .grid(row=row, column=1, sticky="w", pady=(4, 0))
+        row += 1
+
         # ---- Dias da semana ----
         days_row = ttk.Frame(frm)
         days_row.grid(row=row, column=0, columnspan=4, sticky="w", pady=(4, 0))
@@ -672,6 +367,8 @@ class TaskDialog(tk.Toplevel):
                         variable=self.var_schedule).grid(row=0, column=0, padx=(0, 10))
         ttk.Radiobutton(type_row, text="Intervalo", value="interval",
                         variable=self.var_schedule).grid(row=0, column=1)
+        ttk.Radiobutton(type_row, text="Após outras tarefas", value="after",
+                        variable=self.var_schedule).grid(row=0, column=2, padx=(10, 0))
 
         self.int_row = ttk.Frame(sched)
         self.int_row.grid(row=1, column=0, columnspan=4, pady=(6, 0), sticky="w")
@@ -682,6 +379,14 @@ class TaskDialog(tk.Toplevel):
                      values=("minutes", "hours"), width=10, state="readonly")\
             .grid(row=0, column=2)
 
+        after_row = ttk.Frame(sched)
+        after_row.grid(row=2, column=0, columnspan=4, pady=(6, 0), sticky="w")
+        ttk.Label(after_row, text="Depois de:").grid(row=0, column=0, sticky="w")
+        ttk.Entry(after_row, textvariable=self.var_after, width=28)\
+            .grid(row=0, column=1, padx=(4, 6))
+        ttk.Combobox(after_row, textvariable=self.var_after_mode, values=list(DEP_MODE_LABELS.values()),
+                     state="readonly", width=22).grid(row=0, column=2)
+
         # alterna UI conforme o tipo
         self.var_schedule.trace_add("write", lambda *_: self._toggle_schedule_ui())
         self._toggle_schedule_ui()
@@ -697,6 +402,23 @@ class TaskDialog(tk.Toplevel):
             .grid(row=row, column=0, columnspan=4, sticky="w")
         row += 1
 
+        ttk.Checkbutton(frm,
+                        text="Interpretador pré-aquecido (.py, sem segundo plano)",
+                        variable=self.var_warm)\
+            .grid(row=row, column=0, columnspan=4, sticky="w")
+        row += 1
+
+        ttk.Checkbutton(frm,
+                        text="Agrupar com outras tarefas Pentaho no mesmo Kitchen (.ktr/.kjb)",
+                        variable=self.var_pdi_batch)\
+            .grid(row=row, column=0, columnspan=4, sticky="w")
+        row += 1
+
+        ttk.Label(frm, text="Se o processo (spawn) terminar:").grid(row=row, column=0, sticky="w")
+        ttk.Combobox(frm, textvariable=self.var_restart, values=list(RESTART_LABELS.values()),
+                     state="readonly", width=24).grid(row=row, column=1, sticky="w", pady=(4, 0))
+        row += 1
+
         # ---- Botões ----
         btns = ttk.Frame(frm)
         btns.grid(row=row, column=0, columnspan=4, pady=(10, 0))
@@ -714,12 +436,13 @@ class TaskDialog(tk.Toplevel):
     def _toggle_schedule_ui(self):
         mode = (self.var_schedule.get() or "cron").lower()
         is_interval = (mode == "interval")
-        # desabilita botão e "cinza" o label quando for intervalo
-        state = ("disabled" if is_interval else "normal")
+        no_times = mode != "cron"
+        # desabilita botão e "cinza" o label quando não for horário fixo
+        state = ("disabled" if no_times else "normal")
         try:
             self.btn_times.configure(state=state)
-            self.lbl_times.configure(foreground=("#888" if is_interval else ""))
-            self.lbl_time_title.configure(foreground=("#888" if is_interval else ""))
+            self.lbl_times.configure(foreground=("#888" if no_times else ""))
+            self.lbl_time_title.configure(foreground=("#888" if no_times else ""))
         except Exception:
             pass
         # mostra/oculta controles do intervalo
@@ -738,12 +461,31 @@ class TaskDialog(tk.Toplevel):
             messagebox.showerror("Erro", "Escolha o arquivo/comando.")
             return
 
+        after_names = list(dict.fromkeys(n.strip() for n in self.var_after.get().split(",") if n.strip()))
+        known = {t["name"] for t in self._other_tasks}
+        missing = [n for n in after_names if n not in known]
+        if missing:
+            messagebox.showerror("Erro", "Tarefa(s) anterior(es) inexistente(s): " + ", ".join(missing))
+            return
+        dep_mode = next((k for k, v in DEP_MODE_LABELS.items() if v == self.var_after_mode.get()), "success")
+        after = [{"task": n, "on": dep_mode} for n in after_names]
+        name = self.var_name.get().strip()
+        cycle = dependency_cycle(self._other_tasks + [{"name": name, "after": after}])
+        if cycle:
+            messagebox.showerror("Erro", "Dependência circular: " + " → ".join(cycle))
+            return
+
         mode = (self.var_schedule.get() or "cron").lower()
         if mode == "cron":
             if not self.times:
                 messagebox.showerror("Erro", "Adicione pelo menos um horário.")
                 return
             times_list = list(self.times)
+        elif mode == "after":
+            if not after:
+                messagebox.showerror("Erro", "Informe em 'Depois de' as tarefas anteriores.")
+                return
+            times_list = []
         else:
             try:
                 ev = int(self.var_every_val.get())
@@ -767,6 +509,12 @@ class TaskDialog(tk.Toplevel):
             "every_value": int(self.var_every_val.get() or 0),
             "every_unit": self.var_every_unit.get(),
             "spawn": self.var_spawn.get(),
+            "warm": self.var_warm.get(),
+            "jvm_opts": self.var_jvm.get().strip(),
+            "pdi_batch": self.var_pdi_batch.get(),
+            "pool": self.var_pool.get().strip(),
+            "restart": next((k for k, v in RESTART_LABELS.items() if v == self.var_restart.get()), "never"),
+            "after": after,
         }
         self.destroy()
 
@@ -894,6 +642,36 @@ class TaskDialog(tk.Toplevel):
 
 
 
+DEP_MODE_LABELS = {
+    "success": "se todas tiverem sucesso",
+    "completion": "ao terminarem (qualquer RC)",
+}
+
+RESTART_LABELS = {
+    "never": "Não reiniciar",
+    "on_failure": "Reiniciar se falhar",
+    "always": "Reiniciar sempre",
+}
+
+ALERT_MODES = {
+    "every": "Toda falha",
+    "change": "Só mudança de estado (1ª falha e recuperação)",
+}
+
+def _fmt_kv(d):
+    return ", ".join(f"{k}={v}" for k, v in d.items())
+
+def _parse_kv(text):
+    """'a=1, b=2' -> {'a': '1', 'b': '2'} (ignora itens sem '=')."""
+    out = {}
+    for part in text.split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            if k.strip() and v.strip():
+                out[k.strip()] = v.strip()
+    return out
+
+
 class SettingsDialog(tk.Toplevel):
     def __init__(self, master, settings, on_check_updates=None, current_version=APP_VERSION):
         self._on_check_updates = on_check_updates
@@ -903,6 +681,7 @@ class SettingsDialog(tk.Toplevel):
         self.title("Configurações")
         self.resizable(False, False)
         self.result = None
+        self._settings = settings  # chaves sem campo na tela são preservadas ao salvar
 
         # ----- PDI (Pentaho) -----
         self.var_pdi = tk.StringVar(value=settings.get("pdi_home", r"C:\Pentaho\data-integration"))
@@ -916,6 +695,7 @@ class SettingsDialog(tk.Toplevel):
         self.var_pass    = tk.StringVar(value=email.get("password", ""))
         self.var_from    = tk.StringVar(value=email.get("from_email", ""))
         self.var_to      = tk.StringVar(value=",".join(email.get("to_emails", [])))
+        self.var_digest  = tk.StringVar(value=str(email.get("digest_sec", 0)))
 
         # ----- WhatsApp (QR via wa_send.js) -----
         wa = settings.get("whatsapp", {})
@@ -924,6 +704,31 @@ class SettingsDialog(tk.Toplevel):
         self.var_script     = tk.StringVar(value=wa.get("webjs_script", str(resource_path("wa","wa_send.js"))))
         self.var_my_number  = tk.StringVar(value=wa.get("my_number", ""))
         self.var_to_targets = tk.StringVar(value=",".join(wa.get("to_targets", [])))
+        self.var_wa_resident = tk.BooleanVar(value=wa.get("resident", True))
+
+        # ----- Pools de execução -----
+        ex = executor_settings(settings)
+        self.var_pools   = tk.StringVar(value=_fmt_kv(ex["pools"]))
+        self.var_classes = tk.StringVar(value=_fmt_kv(ex["classes"]))
+        self.var_async   = tk.BooleanVar(value=(settings.get("runner", "thread") == "async"))
+        self._hist_cfg   = history_settings(settings)
+        stg = stagger_settings(settings)
+        alerts = alert_settings(settings)
+        self.var_alert_mode = tk.StringVar(value=ALERT_MODES[alerts["mode"]])
+        self.var_alert_task = tk.StringVar(value=str(alerts["per_task_per_hour"]))
+        self.var_alert_all  = tk.StringVar(value=str(alerts["global_per_hour"]))
+        self.var_stagger = tk.BooleanVar(value=stg["enabled"])
+        self.var_jitter  = tk.StringVar(value=str(stg["jitter_sec"]))
+        self.var_retention = tk.StringVar(value=str(self._hist_cfg["retention_days"]))
+        met = metrics_settings(settings)
+        self.var_metrics_on   = tk.BooleanVar(value=met["enabled"])
+        self.var_metrics_port = tk.StringVar(value=str(met["port"]))
+        self._warm_cfg = warm_settings(settings)
+        self.var_warm_preload = tk.StringVar(value=", ".join(self._warm_cfg["preload"]))
+        self.var_warm_size    = tk.StringVar(value=str(self._warm_cfg["size"]))
+        pdi = pdi_settings(settings)
+        self.var_pdi_batch_sec = tk.StringVar(value=f"{pdi['batch_sec']:g}")
+        self.var_pdi_runner    = tk.StringVar(value=pdi["runner"])
 
         # ---------- LAYOUT ----------
         frm = ttk.Frame(self, padding=10)
@@ -933,6 +738,10 @@ class SettingsDialog(tk.Toplevel):
         ttk.Label(frm, text="PDI Home (.ktr/.kjb):").grid(row=row, column=0, sticky="w")
         ttk.Entry(frm, textvariable=self.var_pdi, width=46).grid(row=row, column=1, sticky="we")
         ttk.Button(frm, text="Procurar...", command=self.pick_pdi).grid(row=row, column=2); row += 1
+        ttk.Label(frm, text="Lote Pentaho (janela s, 0=não):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_pdi_batch_sec, width=10).grid(row=row, column=1, sticky="w"); row += 1
+        ttk.Label(frm, text="Executor do lote (vazio=Kitchen):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_pdi_runner, width=46).grid(row=row, column=1, sticky="we"); row += 1
 
         ttk.Separator(frm).grid(row=row, column=0, columnspan=3, pady=8, sticky="we"); row += 1
 
@@ -946,6 +755,7 @@ class SettingsDialog(tk.Toplevel):
             ("Senha de app", self.var_pass),
             ("De (from)", self.var_from),
             ("Para (vírgula)", self.var_to),
+            ("Resumo de falhas (s, 0=não)", self.var_digest),
         ]:
             ttk.Label(frm, text=label + ":").grid(row=row, column=0, sticky="w")
             ttk.Entry(frm, textvariable=var, width=46, show="*" if "Senha" in label else "")\
@@ -977,9 +787,51 @@ class SettingsDialog(tk.Toplevel):
         ttk.Entry(frm, textvariable=self.var_to_targets, width=46)\
             .grid(row=row, column=1, columnspan=2, sticky="we"); row += 1
 
+        ttk.Checkbutton(frm, text="Manter WhatsApp conectado (um processo residente)", variable=self.var_wa_resident)\
+            .grid(row=row, column=1, columnspan=2, sticky="w"); row += 1
+
         ttk.Button(frm, text="Testar WhatsApp", command=self.test_whatsapp_qr)\
             .grid(row=row, column=1, sticky="w"); row += 1
 
+        ttk.Label(frm, text="Alertas:").grid(row=row, column=0, sticky="w")
+        ttk.Combobox(frm, textvariable=self.var_alert_mode, values=list(ALERT_MODES.values()),
+                     state="readonly", width=44).grid(row=row, column=1, columnspan=2, sticky="we"); row += 1
+        ttk.Label(frm, text="Máx. alertas/h (tarefa, total):").grid(row=row, column=0, sticky="w")
+        lim = ttk.Frame(frm)
+        lim.grid(row=row, column=1, columnspan=2, sticky="w"); row += 1
+        ttk.Entry(lim, textvariable=self.var_alert_task, width=6).pack(side="left")
+        ttk.Entry(lim, textvariable=self.var_alert_all, width=6).pack(side="left", padx=(6, 0))
+        ttk.Label(lim, text="(0 = sem limite)").pack(side="left", padx=(6, 0))
+
+        ttk.Separator(frm).grid(row=row, column=0, columnspan=3, pady=8, sticky="we"); row += 1
+
+        ttk.Label(frm, text="Pools (nome=threads):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_pools, width=46)\
+            .grid(row=row, column=1, columnspan=2, sticky="we"); row += 1
+        ttk.Label(frm, text="Pool por extensão:").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_classes, width=46)\
+            .grid(row=row, column=1, columnspan=2, sticky="we"); row += 1
+        ttk.Checkbutton(frm, text="Runner assíncrono (asyncio, para centenas de tarefas)", variable=self.var_async)\
+            .grid(row=row, column=0, columnspan=3, sticky="w"); row += 1
+        ttk.Checkbutton(frm, text="Espalhar tarefas de intervalo (deslocamento fixo por tarefa)", variable=self.var_stagger)\
+            .grid(row=row, column=0, columnspan=3, sticky="w"); row += 1
+        ttk.Label(frm, text="Jitter (s, 0=nenhum):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_jitter, width=10)\
+            .grid(row=row, column=1, sticky="w"); row += 1
+        ttk.Label(frm, text="Histórico (dias, 0=sempre):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_retention, width=10)\
+            .grid(row=row, column=1, sticky="w"); row += 1
+        ttk.Checkbutton(frm, text="Métricas (Prometheus) em localhost, porta:", variable=self.var_metrics_on)\
+            .grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_metrics_port, width=10)\
+            .grid(row=row, column=1, sticky="w"); row += 1
+        ttk.Label(frm, text="Pré-carregar (.py aquecido):").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_warm_preload, width=46)\
+            .grid(row=row, column=1, columnspan=2, sticky="we"); row += 1
+        ttk.Label(frm, text="Interpretadores de reserva:").grid(row=row, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.var_warm_size, width=10)\
+            .grid(row=row, column=1, sticky="w"); row += 1
+
         ttk.Separator(frm).grid(row=row, column=0, columnspan=3, pady=8, sticky="we"); row += 1
 
         up = ttk.LabelFrame(frm, text="Atualizações", padding=(6,6))
@@ -1143,6 +995,7 @@ class SettingsDialog(tk.Toplevel):
 
         try:
             ensure_dirs()
+            close_whatsapp_sender()  # o residente segura a sessão; o teste precisa dela para o QR
             creationflags = getattr(subprocess, "CREATE_NEW_CONSOLE", 0x00000010)
             subprocess.Popen([node, script, "--to", tos, "--message", msg],
                              creationflags=creationflags, cwd=str(WA_DIR))
@@ -1159,9 +1012,48 @@ class SettingsDialog(tk.Toplevel):
             port = int(self.var_port.get())
         except Exception:
             port = 587
+        try:
+            retention = max(0, int(self.var_retention.get()))
+        except Exception:
+            retention = self._hist_cfg["retention_days"]
+        try:
+            digest = max(0, int(self.var_digest.get() or 0))
+        except Exception:
+            digest = 0
+        try:
+            jitter = max(0, int(self.var_jitter.get() or 0))
+        except Exception:
+            jitter = 0
+        try:
+            metrics_port = min(65535, max(1, int(self.var_metrics_port.get())))
+        except Exception:
+            metrics_port = 9464
+        try:
+            warm_size = min(WARM_MAX_SIZE, max(0, int(self.var_warm_size.get())))
+        except Exception:
+            warm_size = self._warm_cfg["size"]
+        try:
+            pdi_batch_sec = max(0.0, float(self.var_pdi_batch_sec.get().replace(",", ".")))
+        except Exception:
+            pdi_batch_sec = pdi_settings(self._settings)["batch_sec"]
+        alert_limits = []
+        for var in (self.var_alert_task, self.var_alert_all):
+            try:
+                alert_limits.append(max(0, int(var.get() or 0)))
+            except Exception:
+                alert_limits.append(0)
+        alert_mode = next((k for k, v in ALERT_MODES.items() if v == self.var_alert_mode.get()), "every")
+        pools = {}
+        for k, v in _parse_kv(self.var_pools.get()).items():
+            try:
+                pools[k] = max(1, int(v))
+            except Exception:
+                pass
         return {
+            **self._settings,
             "pdi_home": self.var_pdi.get().strip(),
             "email": {
+                **self._settings.get("email", {}),
                 "enabled": self.var_mail_on.get(),
                 "smtp_host": self.var_host.get().strip(),
                 "smtp_port": port,
@@ -1169,6 +1061,7 @@ class SettingsDialog(tk.Toplevel):
                 "password": self.var_pass.get(),
                 "from_email": self.var_from.get().strip(),
                 "to_emails": [e.strip() for e in self.var_to.get().split(",") if e.strip()],
+                "digest_sec": digest,
             },
             "whatsapp": {
                 "enabled": self.var_wa_on.get(),
@@ -1177,6 +1070,19 @@ class SettingsDialog(tk.Toplevel):
                 "webjs_script": self.var_script.get().strip(),
                 "my_number": self.var_my_number.get().strip(),
                 "to_targets": [n.strip() for n in self.var_to_targets.get().split(",") if n.strip()],
+                "resident": self.var_wa_resident.get(),
+            },
+            "runner": "async" if self.var_async.get() else "thread",
+            "history": {**self._hist_cfg, "retention_days": retention},
+            "stagger": {"enabled": self.var_stagger.get(), "jitter_sec": jitter},
+            "alerts": {"mode": alert_mode, "per_task_per_hour": alert_limits[0], "global_per_hour": alert_limits[1]},
+            "metrics": {"enabled": self.var_metrics_on.get(), "port": metrics_port},
+            "warm": {"preload": [m.strip() for m in self.var_warm_preload.get().split(",") if m.strip()],
+                     "size": warm_size},
+            "pentaho": {"batch_sec": pdi_batch_sec, "runner": self.var_pdi_runner.get().strip()},
+            "executors": {
+                "pools": pools or dict(DEFAULT_POOLS),
+                "classes": {k.lower(): v for k, v in _parse_kv(self.var_classes.get()).items()},
             },
         }
 
@@ -1243,6 +1149,16 @@ class SettingsDialog(tk.Toplevel):
 #  Aplicação principal (GUI)
 # ======================================================================================
 
+# Janelas do gráfico de histórico: rótulo -> ("tail", N) | ("since", segundos) | ("all", None)
+CHART_WINDOWS = {
+    "Últimas 30": ("tail", 30),
+    "Últimas 500": ("tail", 500),
+    "24 horas": ("since", 86400),
+    "7 dias": ("since", 7 * 86400),
+    "30 dias": ("since", 30 * 86400),
+    "Tudo": ("all", None),
+}
+
 class App(tk.Tk):
 
      # ===== Conectividade / Fila de updates =====
@@ -1251,6 +1167,7 @@ class App(tk.Tk):
             return
         self.net_online = online
         self.update_net_indicator()
+        notifier().set_online(online, self.data["settings"])  # sem rede: alertas vão para a caixa de saída
         if online:
             self.set_status_line("Conexão restaurada. Processando fila de atualizações…")
             self.process_update_queue()
@@ -1342,9 +1259,12 @@ class App(tk.Tk):
         self.attributes("-alpha", 0.0)  # fade-in
         ensure_dirs()
         self.data = load_data()
-        # Deixa explícito (1 instância por job, coalesce)
-        self.scheduler = BackgroundScheduler(job_defaults={"max_instances": 1, "coalesce": True})
-        self.jobs = {}
+        # Motor de agendamento (o mesmo do modo --daemon). Se outro processo (daemon ou
+        # outra GUI) já hospeda o motor, esta vira só cliente: edita o config.json e mostra o histórico.
+        self.client_mode = not acquire_engine_lock("gui")
+        self.engine = SchedulerEngine(self.data, on_run_done=self._on_job_done)
+        self.scheduler = self.engine.scheduler
+        self.jobs = self.engine.jobs
         # Estado de rede / fila de updates
         self.net_online = is_online()
         self._update_processing = False
@@ -1479,7 +1399,7 @@ class App(tk.Tk):
         left.rowconfigure(0, weight=1)
         left.columnconfigure(0, weight=1)
 
-        cols = ("Nome","Hora","Dias","Arquivo","NotificarFalha","Timeout")
+        cols = ("Nome","Hora","Dias","Arquivo","NotificarFalha","Timeout","Fluxo")
         self.tree = ttk.Treeview(left, columns=cols, show="headings", selectmode="browse")
         for c in cols:
             self.tree.heading(c, text=c)
@@ -1496,12 +1416,25 @@ class App(tk.Tk):
         right = ttk.Frame(paned)
         right.rowconfigure(0, weight=1)
         right.columnconfigure(0, weight=1)
-        hist = ttk.LabelFrame(right, text="Histórico (últimas execuções)", padding=6)
+        hist = ttk.LabelFrame(right, text="Histórico", padding=6)
         hist.grid(row=0, column=0, sticky="nsew")
-        hist.rowconfigure(0, weight=1); hist.columnconfigure(0, weight=1)
+        hist.rowconfigure(1, weight=1); hist.columnconfigure(0, weight=1)
+        hist_top = ttk.Frame(hist); hist_top.grid(row=0, column=0, sticky="we", pady=(0, 4))
+        ttk.Label(hist_top, text="Janela:").pack(side="left")
+        self.var_chart_window = tk.StringVar(value="Últimas 30")
+        cb_window = ttk.Combobox(hist_top, textvariable=self.var_chart_window, values=list(CHART_WINDOWS),
+                                 state="readonly", width=12)
+        cb_window.pack(side="left", padx=4)
+        cb_window.bind("<<ComboboxSelected>>", lambda e: self.draw_chart())
+        ttk.Button(hist_top, text="Exportar CSV", command=self.export_history).pack(side="right")
         self.canvas = tk.Canvas(hist, bg="#ffffff", height=400)
-        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.canvas.grid(row=1, column=0, sticky="nsew")
         self.canvas.bind("<Configure>", lambda e: self.draw_chart())
+        # gráfico incremental: itens do canvas reaproveitados entre redesenhos
+        self._chart_items = {}
+        self._chart_used = set()
+        self._chart_key = None
+        self._chart_pending = False
 
         paned.add(left, weight=3)
         paned.add(right, weight=2)
@@ -1514,8 +1447,11 @@ class App(tk.Tk):
         self.lbl_mail = ttk.Label(status, text="E-mail ●"); self.lbl_mail.pack(side="right", padx=(0,12))
         self.lbl_wa   = ttk.Label(status, text="WhatsApp ●"); self.lbl_wa.pack(side="right", padx=(0,12))
         self.pbar = ttk.Progressbar(status, mode="indeterminate", length=160); self.pbar.pack(side="right")
+        self.lbl_pools = ttk.Label(status, text=""); self.lbl_pools.pack(side="right", padx=(0,12))
 
         # Dados / agendamento
+        self._row_cache = {}   # nome -> (campos exibidos, valores da linha)
+        self._row_shown = {}   # nome -> valores atualmente na Treeview
         self.refresh_table()
         self.reschedule_all()
         self.update_status_indicators()
@@ -1523,6 +1459,13 @@ class App(tk.Tk):
         self._apply_theme(False)
         self._fade_in()
         self._pulse_status()
+        self._refresh_pool_status()
+        if self.client_mode:
+            host = engine_host()
+            who = "pela outra janela do Agendador" if host and host[1] == "gui" else "pelo agendador em modo daemon"
+            self.set_status_line(f"Modo cliente: as tarefas são executadas {who}.")
+            self._hist_last_id = None
+            self._poll_daemon_history()
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     # ===== Tema / animações =====
@@ -1565,6 +1508,19 @@ class App(tk.Tk):
         )
         return em_ok, wa_ok
 
+    def _refresh_pool_status(self):
+        """Mostra ocupação/fila/espera de cada pool de execução na barra de status."""
+        if not self.client_mode:
+            try:
+                text = format_pool_stats(self.engine.pool_stats.snapshot())
+                spawns = format_spawn_status(self.engine.spawns.status())
+                self.lbl_pools.config(text=" · ".join(x for x in (text, spawns) if x))
+                if self.engine.dag.active:
+                    self.refresh_table()  # coluna Fluxo (só muda as linhas diferentes)
+            except Exception:
+                pass
+        self.after(2000, self._refresh_pool_status)
+
     def _pulse_status(self):
         em_ok, wa_ok = self._channels_ok()
         g1, g2 = "#2ecc71", "#27ae60"
@@ -1578,7 +1534,8 @@ class App(tk.Tk):
     # ===== utilidades UI =====
     def _on_tree_resize(self, event=None):
         w = max(300, self.tree.winfo_width())
-        ratios = {"Nome":0.18, "Hora":0.08, "Dias":0.22, "Arquivo":0.38, "NotificarFalha":0.08, "Timeout":0.06}
+        ratios = {"Nome":0.15, "Hora":0.10, "Dias":0.16, "Arquivo":0.30, "NotificarFalha":0.07, "Timeout":0.06,
+                  "Fluxo":0.16}
         for col, r in ratios.items():
             self.tree.column(col, width=max(60, int(w * r)), stretch=True)
 
@@ -1593,89 +1550,36 @@ class App(tk.Tk):
         messagebox.showinfo("Dicas", tips)
 
     def save(self, silent=False):
-        save_data(self.data)
+        save_data(self.data, wait=not silent)
         self.update_status_indicators()
         if not silent:
             messagebox.showinfo("Salvo", "Configurações salvas.")
 
     def on_close(self):
-        try:
-            self.scheduler.shutdown(wait=False)
-        except Exception:
-            pass
+        self.engine.shutdown(wait=False)
+        flush_data()
+        release_engine_lock()
         self.destroy()
 
-    # ===== agendamento =====
+    # ===== agendamento (delegado ao SchedulerEngine) =====
     def reschedule_all(self):
-        # limpa jobs antigos
-        for job in list(self.scheduler.get_jobs()):
-            self.scheduler.remove_job(job.id)
-        self.jobs.clear()
-
-        for t in self.data.get("tasks", []):
-            stype = (t.get("schedule_type") or "cron").lower()
-
-            if stype == "interval":
-                # a cada N minutos/horas (respeitando dias marcados)
-                try:
-                    val = int(str(t.get("every_value") or 0))
-                except Exception:
-                    val = 0
-                if val <= 0:
-                    continue
-                unit = (t.get("every_unit") or "minutes").lower()
-
-                days = t.get("days", [True] * 7)
-                dows = ["mon","tue","wed","thu","fri","sat","sun"]
-                use_days = [dows[i] for i, v in enumerate(days) if v]
-                if not use_days:
-                    continue
-
-                if unit == "minutes":
-                    trig = CronTrigger(day_of_week=",".join(use_days), minute=f"*/{val}")
-                else:  # hours
-                    trig = CronTrigger(day_of_week=",".join(use_days), hour=f"*/{val}", minute=0)
-            else:
-                # horário(s) fixo(s) nos dias marcados
-                days = t.get("days", [True] * 7)
-                dows = ["mon","tue","wed","thu","fri","sat","sun"]
-                use_days = [dows[i] for i, v in enumerate(days) if v]
-                if not use_days:
-                    continue
-
-                # aceita lista "times" (novo) ou fallback para "time" único
-                times = t.get("times") or [t.get("time", "06:00")]
-                # normaliza por segurança
-                try:
-                    times = parse_times(",".join(times) if isinstance(times, list) else str(times))
-                except Exception:
-                    continue
-
-                # cria vários triggers (um por horário)
-                job_ids = []
-                for idx, hhmm in enumerate(times):
-                    hh, mm = map(int, hhmm.split(":"))
-                    trig = CronTrigger(day_of_week=",".join(use_days), hour=hh, minute=mm)
-                    jid = f"{t['name']}::{idx}"
-                    self.scheduler.add_job(self._job_wrapper, trigger=trig, id=jid, name=t["name"], args=[t])
-                    job_ids.append(jid)
-                self.jobs[t["name"]] = job_ids
-                continue  # já adicionamos todos os triggers; segue p/ próximo task
-
-            # (para o modo intervalo, continua como antes)
-            job = self.scheduler.add_job(self._job_wrapper, trigger=trig, id=t["name"], name=t["name"], args=[t])
-            self.jobs[t["name"]] = [job.id]
-
+        if self.client_mode:
+            # o --daemon relê o config.json salvo e reagenda sozinho
+            return
+        self.engine.reschedule_all()
 
-        if not self.scheduler.running:
-            self.scheduler.start()
+    def _poll_daemon_history(self):
+        """Modo cliente: redesenha o gráfico quando o daemon grava execuções no history.db."""
+        try:
+            last_id = history_store().last_id()
+        except Exception:
+            last_id = None
+        if last_id != self._hist_last_id:
+            self._hist_last_id = last_id
+            self.draw_chart()
+        self.after(5000, self._poll_daemon_history)
 
-    def _job_wrapper(self, task):
-        def progress(_):
-            pass
-        rc, dur, log_path = run_task(task, self.data["settings"], progress_cb=progress)
-        append_history(self.data, task["name"], rc, dur)
-        self._maybe_notify(task, rc, log_path)
+    def _on_job_done(self, task, rc, dur, log_path):
         # GUI pode já ter sido destruída (Ctrl+C / fechamento)
         try:
             if self.winfo_exists():
@@ -1684,17 +1588,7 @@ class App(tk.Tk):
             pass
 
     def _maybe_notify(self, task, rc, log_path):
-        if rc != 0 and task.get("notify_fail", True):
-            subject = f"[{task['name']}] FALHA (RC={rc})"
-            body = f"Tarefa: {task['name']}\nData: {now_str()}\nRC: {rc}\nLog: {log_path}"
-            try:
-                send_email(self.data["settings"], subject, body)
-            except Exception as e:
-                print("Erro e-mail:", e)
-            try:
-                send_whatsapp(self.data["settings"], subject, body)
-            except Exception as e:
-                print("Erro WhatsApp:", e)
+        self.engine._maybe_notify(task, rc, log_path)
 
     # ===== helpers busy/status =====
     def _set_ui_busy(self, busy=True, msg=None):
@@ -1716,7 +1610,11 @@ class App(tk.Tk):
 
     def _hora_dias_text(self, t):
         """Texto das colunas Hora/Dias conforme o tipo de agendamento."""
-        if (t.get("schedule_type") or "cron").lower() == "interval":
+        stype = (t.get("schedule_type") or "cron").lower()
+        if stype == "after":
+            hora = "após " + ", ".join(u + ("" if m == "success" else " (qualquer RC)") for u, m in task_deps(t))
+            return hora, "—"
+        if stype == "interval":
             val = t.get("every_value") or 0
             unit = (t.get("every_unit") or "minutes").lower()
             hora = f"cada {val} " + ("min" if unit == "minutes" else "h")
@@ -1733,83 +1631,222 @@ class App(tk.Tk):
         return hora, dias
 
     # ===== tabela & gráfico =====
-    def refresh_table(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+    def _row_values(self, t):
+        """Valores da linha da tarefa; cache por nome, refeito só se os campos exibidos mudarem."""
+        fp = (
+            t.get("schedule_type"), t.get("every_value"), t.get("every_unit"),
+            tuple(t.get("times") or ()), t.get("time"), tuple(t.get("days") or ()),
+            t["path"], t.get("notify_fail", True), t.get("timeout", "0"), tuple(task_deps(t)),
+        )
+        cached = self._row_cache.get(t["name"])
+        if cached and cached[0] == fp:
+            return cached[1] + (self._flow_text(t["name"]),)
+        hora, dias = self._hora_dias_text(t)
+        vals = (
+            t["name"],
+            hora,
+            dias,
+            t["path"],
+            "Sim" if t.get("notify_fail", True) else "Não",
+            t.get("timeout", "0")
+        )
+        self._row_cache[t["name"]] = (fp, vals)
+        return vals + (self._flow_text(t["name"]),)
+
+    def _flow_text(self, name):
+        """Coluna "Fluxo": estado da etapa / resumo do fluxo (só quando o motor roda aqui)."""
+        engine = getattr(self, "engine", None)
+        if engine is None or getattr(self, "client_mode", False):
+            return ""
+        return engine.dag.describe(name)
 
+    def refresh_table(self):
+        """Atualiza a tabela por diferença: só insere/altera/remove as linhas que mudaram."""
+        rows = {}
         for t in self.data.get("tasks", []):
-            hora, dias = self._hora_dias_text(t)
-            self.tree.insert(
-                "", "end", iid=t["name"], values=(
-                    t["name"],
-                    hora,
-                    dias,
-                    t["path"],
-                    "Sim" if t.get("notify_fail", True) else "Não",
-                    t.get("timeout", "0")
-                )
-            )
+            rows[t["name"]] = self._row_values(t)
+
+        for iid in self.tree.get_children():
+            if iid not in rows:
+                self.tree.delete(iid)
+                self._row_shown.pop(iid, None)
+                self._row_cache.pop(iid, None)
+
+        for idx, (name, vals) in enumerate(rows.items()):
+            if name not in self._row_shown:
+                self.tree.insert("", idx, iid=name, values=vals)
+            elif self._row_shown[name] != vals:
+                self.tree.item(name, values=vals)
+            self._row_shown[name] = vals
+
+        # mantém a ordem da lista de tarefas (só move se algo saiu do lugar)
+        shown = list(self.tree.get_children())
+        for idx, name in enumerate(rows):
+            if shown[idx] != name:
+                self.tree.move(name, "", idx)
+                shown.remove(name)
+                shown.insert(idx, name)
         self.draw_chart()
 
     def draw_chart(self):
-        self.canvas.delete("all")
+        """Pede um redesenho do gráfico; pedidos em rajada viram um só (after_idle)."""
+        if self._chart_pending:
+            return
+        self._chart_pending = True
+        self.after_idle(self._render_chart)
+
+    def _ci(self, key, kind, coords, **opts):
+        """Cria (1ª vez) ou reposiciona/reconfigura o item do canvas identificado por `key`."""
+        item = self._chart_items.get(key)
+        if item is None:
+            item = getattr(self.canvas, "create_" + kind)(*coords, **opts)
+            self._chart_items[key] = item
+        else:
+            self.canvas.coords(item, *coords)
+            self.canvas.itemconfigure(item, state="normal", **opts)
+        self._chart_used.add(key)
+        return item
+
+    def _chart_data(self, name, window):
+        kind, val = CHART_WINDOWS.get(window, ("tail", 30))
+        if kind == "tail":
+            return history_tail(name, val)
+        if kind == "since":
+            return history_columns(name, since=time.time() - val)
+        return history_columns(name)
+
+    def _render_chart(self):
+        self._chart_pending = False
         sel = self.tree.selection()
-        if not sel:
-            self.canvas.create_text(10, 10, anchor="nw", text="Selecione uma tarefa para ver o histórico.")
+        name = sel[0] if sel else None
+        window = self.var_chart_window.get()
+        w = int(self.canvas.winfo_width() or 400)
+        h = int(self.canvas.winfo_height() or 300)
+        try:
+            last_id = history_store().last_id()
+        except Exception:
+            last_id = None
+        key = (name, window, w, h, last_id)
+        if key == self._chart_key:
+            return  # nada mudou (mesma tarefa, janela, tamanho e histórico)
+        self._chart_key = key
+        self._chart_used = set()
+        try:
+            self._draw_chart_items(name, window, w, h)
+        finally:
+            for k, item in self._chart_items.items():
+                if k not in self._chart_used:
+                    self.canvas.itemconfigure(item, state="hidden")
+
+    def _draw_chart_items(self, name, window, w, h):
+        if not name:
+            self._ci("msg", "text", (10, 10), anchor="nw", text="Selecione uma tarefa para ver o histórico.")
             return
-        name = sel[0]
-        hist = self.data.get("history", {}).get(name, [])
-        if not hist:
-            self.canvas.create_text(10, 10, anchor="nw", text="Ainda sem histórico para esta tarefa.")
+        cols = self._chart_data(name, window)
+        if not len(cols):
+            self._ci("msg", "text", (10, 10), anchor="nw", text="Ainda sem histórico para esta tarefa.")
             return
 
-        items = hist[-30:]
-        w = int(self.canvas.winfo_width() or 400)
-        h = int(self.canvas.winfo_height() or 300)
         pad = 28
         H1 = int(h * 0.62)
         chart_w = w - 2 * pad
 
-        # duração (barras)
-        N = len(items)
+        # duração (barras); muitas execuções -> baldes mín/máx (~4px por barra)
+        N = len(cols)
+        buckets = downsample_runs(cols, max(1, chart_w // 4))
+        B = len(buckets)
         chart_h = H1 - pad
-        max_dur = max(1.0, max(i["dur"] for i in items))
-        bar_w = max(2, int(chart_w / max(N, 1) * 0.7))
-        self.canvas.create_text(pad, 8, anchor="nw", text=f"Duração (s) — últimas {N}")
-        self.canvas.create_line(pad, H1 - 10, w - pad, H1 - 10)
+        max_dur = max(1.0, max(b[1] for b in buckets))
+        bar_w = max(2, int(chart_w / max(B, 1) * 0.7))
+        title = f"Duração (s) — {N} execuções" + (f" em {B} barras (mín/máx)" if B < N else "")
+        self._ci("title", "text", (pad, 8), anchor="nw", text=title)
+        self._ci("axis", "line", (pad, H1 - 10, w - pad, H1 - 10))
         for k in (0.25, 0.5, 0.75):
             y = (H1 - 10) - k * chart_h
-            self.canvas.create_line(pad, y, w - pad, y, fill="#e0e0e0")
-        for idx, it in enumerate(items):
-            x_center = pad + (idx + 0.5) * (chart_w / N)
-            bh = (it["dur"] / max_dur) * (chart_h - 6)
-            y0 = (H1 - 10) - bh
-            color = "#3cb371" if it["rc"] == 0 else "#dc143c"
-            self.canvas.create_rectangle(x_center - bar_w / 2, y0,
-                                         x_center + bar_w / 2, H1 - 10,
-                                         fill=color, outline="")
+            self._ci(("grid", k), "line", (pad, y, w - pad, y), fill="#e0e0e0")
+        for idx, (dmin, dmax, fails, count) in enumerate(buckets):
+            x_center = pad + (idx + 0.5) * (chart_w / B)
+            y0 = (H1 - 10) - (dmax / max_dur) * (chart_h - 6)
+            color = "#3cb371" if not fails else ("#dc143c" if fails == count else "#e67e22")
+            self._ci(("bar", idx), "rectangle", (x_center - bar_w / 2, y0, x_center + bar_w / 2, H1 - 10),
+                     fill=color, outline="")
+            if count > 1:
+                y_min = (H1 - 10) - (dmin / max_dur) * (chart_h - 6)
+                self._ci(("min", idx), "line", (x_center - bar_w / 2, y_min, x_center + bar_w / 2, y_min),
+                         fill="#1f4e3d")
+
+        # pico de RAM (linha roxa, máximo por barra), quando medido
+        usage = history_usage(name, cols.ts[0], cols.ts[-1])
+        if usage:
+            rss = [0] * B
+            for ts, u in usage:
+                i = min(N - 1, bisect.bisect_left(cols.ts, ts))
+                b = min(B - 1, i * B // N)
+                rss[b] = max(rss[b], u["rss_peak"] or 0)
+            max_rss = max(rss) or 1
+            pts = []
+            for idx, r in enumerate(rss):
+                if r:
+                    pts += [pad + (idx + 0.5) * (chart_w / B), (H1 - 10) - (r / max_rss) * (chart_h - 6)]
+            if len(pts) >= 4:
+                self._ci("rss_line", "line", pts, fill="#8e44ad", width=2)
+            elif pts:
+                x, y = pts
+                self._ci("rss_dot", "oval", (x - 3, y - 3, x + 3, y + 3), fill="#8e44ad", outline="")
+            self._ci("leg_rss", "rectangle", (w - pad - 200, 13, w - pad - 182, 17), fill="#8e44ad", outline="")
+            self._ci("leg_rss_t", "text", (w - pad - 176, 15), anchor="w",
+                     text=f"RAM (pico {fmt_bytes(max_rss)})")
 
         # legenda
-        self.canvas.create_rectangle(w - pad - 120, 6, w - pad - 102, 24, fill="#3cb371", outline="")
-        self.canvas.create_text(w - pad - 96, 15, text="Ok", anchor="w")
-        self.canvas.create_rectangle(w - pad - 60, 6, w - pad - 42, 24, fill="#dc143c", outline="")
-        self.canvas.create_text(w - pad - 36, 15, text="Falha", anchor="w")
+        self._ci("leg_ok", "rectangle", (w - pad - 120, 6, w - pad - 102, 24), fill="#3cb371", outline="")
+        self._ci("leg_ok_t", "text", (w - pad - 96, 15), text="Ok", anchor="w")
+        self._ci("leg_fail", "rectangle", (w - pad - 60, 6, w - pad - 42, 24), fill="#dc143c", outline="")
+        self._ci("leg_fail_t", "text", (w - pad - 36, 15), text="Falha", anchor="w")
 
         # acumulado OK x Falha
-        ok = sum(1 for i in items if i["rc"] == 0)
+        ok = sum(1 for rc in cols.rc if rc == 0)
         fail = N - ok
         total = max(1, N)
         y_top = H1 + 10
-        self.canvas.create_text(pad, y_top, anchor="nw", text=f"Acertos x Falhas — últimas {N}")
+        sum_title = f"Acertos x Falhas — {N} execuções"
+        if usage:
+            n = len(usage)
+            cpu = sum((u["cpu_user"] or 0) + (u["cpu_sys"] or 0) for _, u in usage) / n
+            io = sum((u["io_read"] or 0) + (u["io_write"] or 0) for _, u in usage) / n
+            sum_title += f"  |  média: CPU {cpu:.1f}s, E/S {fmt_bytes(io)}"
+        self._ci("sum_title", "text", (pad, y_top), anchor="nw", text=sum_title)
         y_bar = y_top + 18
+        # atraso dos disparos agendados e disparos que não viraram execução (mesma janela)
+        disp = history_dispatch(name, cols.ts[0])
+        if disp["runs"] or disp["skipped"] or disp["coalesced"] or disp["missed"]:
+            parts = []
+            if disp["runs"]:
+                parts.append(f"atraso p50 {disp['lag_p50']:.1f}s / p95 {disp['lag_p95']:.1f}s"
+                             f" / máx {disp['lag_max']:.1f}s, fila média {disp['wait_avg']:.1f}s")
+            parts.append(f"pulados {disp['skipped']}, agrupados {disp['coalesced']}, perdidos {disp['missed']}")
+            txt = "Disparos: " + "  |  ".join(parts)
+            lost = disp["skipped"] or disp["missed"]
+            self._ci("disp_t", "text", (pad, y_bar), anchor="nw", text=txt,
+                     fill="#dc143c" if lost else "#555555")
+            y_bar += 18
+        # Pentaho: linhas lidas/gravadas/erros por etapa na última execução
+        steps = history_steps(name)
+        if steps:
+            errs = any(s["errors"] for s in steps[1])
+            self._ci("steps_t", "text", (pad, y_bar), anchor="nw",
+                     text=f"Etapas ({datetime.fromtimestamp(steps[0]):%d/%m %H:%M}): {format_pdi_steps(steps[1])}",
+                     fill="#dc143c" if errs else "#555555")
+            y_bar += 18
         bar_h = max(18, h - y_bar - 14)
         full_w = w - 2 * pad
         ok_w = int(full_w * (ok / total))
         fail_w = full_w - ok_w
-        self.canvas.create_rectangle(pad, y_bar, pad + ok_w, y_bar + bar_h, fill="#3cb371", outline="")
-        self.canvas.create_rectangle(pad + ok_w, y_bar, pad + ok_w + fail_w, y_bar + bar_h, fill="#dc143c", outline="")
-        self.canvas.create_text(pad + 6, y_bar + bar_h / 2, text=f"{ok} OK", anchor="w", fill="white")
-        self.canvas.create_text(pad + ok_w + fail_w - 6, y_bar + bar_h / 2, text=f"{fail} Falhas", anchor="e", fill="white")
+        self._ci("sum_ok", "rectangle", (pad, y_bar, pad + ok_w, y_bar + bar_h), fill="#3cb371", outline="")
+        self._ci("sum_fail", "rectangle", (pad + ok_w, y_bar, pad + ok_w + fail_w, y_bar + bar_h),
+                 fill="#dc143c", outline="")
+        self._ci("sum_ok_t", "text", (pad + 6, y_bar + bar_h / 2), text=f"{ok} OK", anchor="w", fill="white")
+        self._ci("sum_fail_t", "text", (pad + ok_w + fail_w - 6, y_bar + bar_h / 2),
+                 text=f"{fail} Falhas", anchor="e", fill="white")
 
     # ===== ações =====
     def add_task(self):
@@ -1838,8 +1875,13 @@ class App(tk.Tk):
         if not task: return
         dlg = TaskDialog(self, task); self.wait_window(dlg)
         if dlg.result:
+            new_name = dlg.result["name"]
+            if new_name != name and any(t["name"] == new_name for t in self.data["tasks"]):
+                messagebox.showerror("Erro", "Já existe uma tarefa com esse nome."); return
             idx = self.data["tasks"].index(task)
             self.data["tasks"][idx] = dlg.result
+            if new_name != name:
+                self._rename_deps(name, new_name)
             self.save(silent=True); self.refresh_table(); self.reschedule_all()
 
     def remove_task(self):
@@ -1852,20 +1894,23 @@ class App(tk.Tk):
 
     # remove do JSON
      self.data["tasks"] = [t for t in self.data["tasks"] if t["name"] != name]
+     self._rename_deps(name, None)
 
     # remove TODOS os jobs agendados dessa tarefa (um por horário)
-     ids = self.jobs.get(name, [])
-     for jid in ids:
-        try:
-            self.scheduler.remove_job(jid)
-        except Exception:
-            pass
-     self.jobs.pop(name, None)
+     self.engine.remove_task_jobs(name)
 
      self.save(silent=True)
      self.refresh_table()
 
 
+    def _rename_deps(self, old, new):
+        """Atualiza (new) ou retira (None) a tarefa `old` do 'Depois de' das outras."""
+        for i, t in enumerate(self.data["tasks"]):
+            deps = task_deps(t)
+            if any(u == old for u, _ in deps):
+                after = [{"task": new if u == old else u, "on": m} for u, m in deps if u != old or new]
+                self.data["tasks"][i] = {**t, "after": after}
+
     def open_last_log(self):
         sel = self.tree.selection()
         if not sel: return
@@ -1887,18 +1932,51 @@ class App(tk.Tk):
         def worker():
             def progress(line):
                 self.after(0, lambda: self.set_status_line(f"[{task['name']}] {line}"))
-            rc, dur, log_path = run_task(task, self.data["settings"], progress_cb=progress)
-            append_history(self.data, task["name"], rc, dur)
-            self._maybe_notify(task, rc, log_path)
+            usage = {}
+            if not self.client_mode:
+                self.engine.dag.started(task["name"])
+            rc, dur, log_path = run_task(task, self.data["settings"], progress_cb=progress, usage=usage)
+            if rc is not None:
+                append_history(self.data, task["name"], rc, dur, usage=usage,
+                               steps=pdi_steps(task, log_path))
+                if not self.client_mode:
+                    self.engine.dag.finished(task["name"], rc)  # dispara as etapas seguintes
+                self._maybe_notify(task, rc, log_path)
             def finish():
                 self._set_ui_busy(False)
                 self.draw_chart()
+                if rc is None:
+                    st = self.engine.spawns.status().get(task["name"])
+                    pid = f" (PID {st['pid']})" if st and st.get("pid") else ""
+                    messagebox.showinfo("Execução", f"{task['name']}: em segundo plano{pid}.\n\n"
+                                        f"O resultado entra no histórico quando o processo terminar.\nLog:\n{log_path}")
+                    return
                 msg = "SUCESSO" if rc == 0 else f"FALHA (RC={rc})"
-                messagebox.showinfo("Execução", f"{task['name']}: {msg}\n\nDuração: {dur:.1f}s\nLog:\n{log_path}")
+                res = ""
+                if usage:
+                    res = (f"\nCPU: {usage['cpu_user'] + usage['cpu_sys']:.1f}s"
+                           f" | RAM (pico): {fmt_bytes(usage['rss_peak'])}")
+                messagebox.showinfo("Execução", f"{task['name']}: {msg}\n\nDuração: {dur:.1f}s{res}\nLog:\n{log_path}")
             self.after(0, finish)
 
         threading.Thread(target=worker, daemon=True).start()
 
+    def export_history(self):
+        """Exporta o histórico (duração, RC, CPU, RAM, E/S) da tarefa selecionada ou de todas."""
+        sel = self.tree.selection()
+        names = [sel[0]] if sel else [t["name"] for t in self.data["tasks"]]
+        path = filedialog.asksaveasfilename(
+            title="Exportar histórico", defaultextension=".csv",
+            initialfile=f"historico_{sel[0] if sel else 'todas'}.csv",
+            filetypes=[("CSV", "*.csv"), ("Todos", "*.*")])
+        if not path:
+            return
+        try:
+            n = export_history_csv(path, names)
+        except Exception as e:
+            messagebox.showerror("Exportar", f"Falha ao exportar:\n{e}"); return
+        messagebox.showinfo("Exportar", f"{n} execuções exportadas para:\n{path}")
+
     def open_settings(self):
         dlg = SettingsDialog(
     self,
@@ -1983,10 +2061,8 @@ if __name__ == "__main__":
         app.mainloop()
     except KeyboardInterrupt:
         # Encerra de forma amigável se o usuário der Ctrl+C
-        try:
-            app.scheduler.shutdown(wait=False)
-        except Exception:
-            pass
+        app.engine.shutdown(wait=False)
+        release_engine_lock()
         try:
             app.destroy()
         except Exception:
@@ -0,0 +1,3841 @@
+# agendador_core.py
+#
+# Motor de agendamento/execução SEM dependência de Tk/PIL/sv_ttk.
+# Usado pela GUI (agendador.py) e pelo modo headless:
+#   python agendador.py --daemon      (ou: python agendador_core.py)
+
+import os, sys, json, subprocess, traceback, time, smtplib, ssl, threading, shlex, signal, shutil
+import asyncio, codecs, concurrent.futures, sqlite3, atexit, hashlib, struct, itertools, queue, csv, bisect
+from array import array
+from collections import Counter, deque
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape as xml_escape
+import re
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED, EVENT_JOB_MAX_INSTANCES
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+# Para checar processos em execução (opcional, mas recomendado)
+try:
+ import psutil  # pip install psutil
+except Exception:
+    psutil = None
+
+# ======================================================================================
+#  Caminhos / Pastas (resistente a Program Files)
+# ======================================================================================
+
+APP_NAME = "Agendador-Bravo"
+APP_BASENAME = "AgendadorBravo"  # nome de pasta em ProgramData
+
+def resource_path(*parts):
+    """Retorna caminho para recurso empacotado (PyInstaller) ou ao lado do .py.
+    Tolerante quando __file__ não existe (p.ex. durante shutdown)."""
+    try:
+        base = Path(getattr(sys, "_MEIPASS", Path(__file__).parent))
+    except NameError:
+        base = Path.cwd()
+    return base.joinpath(*parts)
+
+def pick_base_dir():
+    """Escolhe uma pasta gravável do usuário/sistema (ProgramData > LocalAppData > AppData > Home)."""
+    for env in ("PROGRAMDATA", "LOCALAPPDATA", "APPDATA"):
+        base = os.environ.get(env)
+        if base:
+            p = Path(base) / APP_BASENAME
+            try:
+                p.mkdir(parents=True, exist_ok=True)
+                return p
+            except Exception:
+                pass
+    p = Path.home() / APP_BASENAME
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+APP_DIR = pick_base_dir()            # ex.: C:\ProgramData\AgendadorBravo
+DATA_FILE = APP_DIR / "config.json"  # config.json gravável
+LOG_DIR  = APP_DIR / "logs"          # logs graváveis
+WA_DIR   = APP_DIR / "wa"            # cache do WhatsApp WebJS (gravável)
+PID_DIR  = APP_DIR / "pids"          # pids para modo spawn/watchdog
+HISTORY_DB = APP_DIR / "history.db"  # histórico de execuções (SQLite, append-only)
+HISTORY_ARCHIVE_DIR = APP_DIR / "history"  # histórico antigo em colunas (ver ColumnArchive)
+OUTBOX_DB = APP_DIR / "outbox.db"  # notificações que ainda não saíram (ver NotificationOutbox)
+
+def ensure_dirs():
+    for d in (APP_DIR, LOG_DIR, WA_DIR, PID_DIR):
+        d.mkdir(parents=True, exist_ok=True)
+
+def _safe_name(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in name)
+
+# ======================================================================================
+#  Utilitários / Persistência
+# ======================================================================================
+
+def now_str():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def format_days_bool(days_list):
+    labels = ["seg","ter","qua","qui","sex","sab","dom"]
+    return ",".join([labels[i] for i,v in enumerate(days_list) if v])
+
+# Pools de execução (nome -> nº de threads) e classe padrão por extensão.
+# Tarefas podem forçar um pool com task["pool"].
+DEFAULT_POOLS = {"default": 10, "pentaho": 2, "light": 20}
+DEFAULT_POOL_CLASSES = {".ktr": "pentaho", ".kjb": "pentaho", ".bat": "light", ".cmd": "light", ".ps1": "light"}
+
+SAVE_DEBOUNCE_SEC = float(os.getenv("AGENDADOR_SAVE_DEBOUNCE_SEC", "1.0"))
+CONFIG_BACKUPS = int(os.getenv("AGENDADOR_CONFIG_BACKUPS", "3"))
+
+def _backup_file(i: int) -> Path:
+    return DATA_FILE.with_name(f"{DATA_FILE.name}.bak{i}")
+
+def load_data():
+    """Carrega config.json (ou o backup mais recente válido); cria defaults se não houver nenhum."""
+    ensure_dirs()
+    for i, p in enumerate([DATA_FILE] + [_backup_file(n) for n in range(1, CONFIG_BACKUPS + 1)]):
+        if not p.exists():
+            continue
+        try:
+            data = json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            print(f"Aviso: {p.name} ilegível/corrompido.")
+            continue
+        if i:
+            print(f"Aviso: config.json inválido; usando backup {p.name}.")
+        if "history" in data:
+            # config.json antigo: histórico vai (uma vez) para o history.db
+            _migrate_history(data)
+            save_data(data)
+        return data
+    if DATA_FILE.exists():
+        # preserva o arquivo ruim para análise em vez de sobrescrevê-lo com os defaults
+        try:
+            os.replace(DATA_FILE, DATA_FILE.with_name(f"{DATA_FILE.name}.corrupt-{datetime.now():%Y%m%d_%H%M%S}"))
+        except Exception:
+            pass
+    return {
+        "settings": {
+            "pdi_home": r"C:\Pentaho\data-integration",
+            "email": {
+                "enabled": False, "smtp_host": "smtp.gmail.com", "smtp_port": 587,
+                "username": "", "password": "", "from_email": "", "to_emails": [],
+                "starttls": True, "digest_sec": 0
+            },
+            "whatsapp": {
+                "enabled": False,
+                "mode": "webjs",
+                "node_path": r"C:\Program Files\nodejs\node.exe",
+                "webjs_script": str(resource_path("wa", "wa_send.js")),
+                "to_targets": [],
+                "my_number": "",
+                "resident": True
+            },
+            "executors": {
+                "pools": dict(DEFAULT_POOLS),
+                "classes": dict(DEFAULT_POOL_CLASSES),
+            },
+            "history": {"retention_days": 0, "hot_days": 7},
+            "stagger": {"enabled": False, "jitter_sec": 0},
+            "alerts": {"mode": "every", "per_task_per_hour": 0, "global_per_hour": 0},
+            "metrics": {"enabled": False, "port": 9464},
+            "warm": {"preload": [], "size": 1},
+            "pentaho": {"batch_sec": 5, "runner": ""}
+        },
+        "tasks": []
+    }
+
+def _dumps_config(data) -> str:
+    # outras threads podem estar mexendo no dict (ex.: fila de updates); tenta de novo
+    for _ in range(5):
+        try:
+            return json.dumps(data, indent=2, ensure_ascii=False)
+        except RuntimeError:
+            time.sleep(0.01)
+    return json.dumps(json.loads(json.dumps(data, default=str)), indent=2, ensure_ascii=False)
+
+def _write_config_atomic(text: str):
+    """temp + fsync + rename; a versão anterior vira .bak1 (.bak1 -> .bak2 ...)."""
+    ensure_dirs()
+    tmp = DATA_FILE.with_name(DATA_FILE.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    if CONFIG_BACKUPS > 0 and DATA_FILE.exists():
+        for i in range(CONFIG_BACKUPS, 1, -1):
+            if _backup_file(i - 1).exists():
+                os.replace(_backup_file(i - 1), _backup_file(i))
+        shutil.copyfile(DATA_FILE, _backup_file(1))
+    for attempt in range(10):
+        try:
+            os.replace(tmp, DATA_FILE)
+            return
+        except PermissionError:
+            # Windows: outro processo (GUI/daemon) lendo o arquivo neste instante
+            if attempt == 9:
+                raise
+            time.sleep(0.1)
+
+
+class ConfigWriter:
+    """
+    Único escritor do config.json. Rajadas de save_data (UI, workers, fila de
+    updates) viram uma gravação por intervalo; cada gravação é atômica.
+    """
+    def __init__(self, interval=SAVE_DEBOUNCE_SEC):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = None
+        self._urgent = False
+        self._requested = 0   # nº do último pedido
+        self._written = 0     # nº do último pedido já no disco
+        self._last_write = 0.0
+        self._thread = None
+
+    def request(self, data, urgent=False) -> int:
+        with self._cond:
+            self._pending = data
+            self._urgent = self._urgent or urgent
+            self._requested += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="config-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._requested
+
+    def wait(self, seq, timeout=30):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._written >= seq, timeout)
+
+    def flush(self, timeout=30):
+        """Grava agora o que estiver pendente e espera terminar."""
+        with self._cond:
+            if self._pending is None:
+                return True
+            self._urgent = True
+            seq = self._requested
+            self._cond.notify_all()
+        return self.wait(seq, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                while not self._urgent:
+                    delay = self._last_write + self.interval - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                data, seq = self._pending, self._requested
+                self._pending, self._urgent = None, False
+            t0 = time.perf_counter()
+            try:
+                _write_config_atomic(_dumps_config(data))
+            except Exception as e:
+                print("Erro ao salvar config.json:", e)
+            metrics().observe("agendador_config_write_seconds", time.perf_counter() - t0)
+            with self._cond:
+                self._last_write = time.time()
+                self._written = seq
+                self._cond.notify_all()
+
+
+_config_writer = ConfigWriter()
+
+def save_data(data, wait=False):
+    """Agenda a gravação do config.json (com debounce); wait=True espera estar no disco."""
+    seq = _config_writer.request(data, urgent=wait)
+    if wait:
+        _config_writer.wait(seq)
+
+def flush_data():
+    _config_writer.flush()
+
+atexit.register(flush_data)
+
+class RunColumns:
+    """Execuções em colunas (array): ~16 bytes por execução em vez de um dict."""
+    __slots__ = ("ts", "rc", "dur")
+
+    def __init__(self, ts=None, rc=None, dur=None):
+        self.ts = ts if ts is not None else array("d")
+        self.rc = rc if rc is not None else array("i")
+        self.dur = dur if dur is not None else array("f")
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, ts, rc, dur):
+        self.ts.append(ts); self.rc.append(int(rc)); self.dur.append(float(dur))
+
+    def extend(self, other):
+        self.ts.extend(other.ts); self.rc.extend(other.rc); self.dur.extend(other.dur)
+
+    def to_dicts(self):
+        return [{"ts": _fmt_ts(t), "rc": r, "dur": d} for t, r, d in zip(self.ts, self.rc, self.dur)]
+
+
+class ColumnArchive:
+    """
+    Histórico antigo, por tarefa, em três arquivos de largura fixa:
+    <tarefa>.ts (float64), <tarefa>.rc (int32) e <tarefa>.dur (float32).
+    Append é O(1) e, como ts é crescente, consultas por janela de tempo fazem
+    busca binária direto no arquivo e só leem o trecho pedido.
+    """
+    _COLS = (("ts", "d"), ("rc", "i"), ("dur", "f"))
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+
+    @staticmethod
+    def stem(task) -> str:
+        digest = hashlib.sha1(task.encode("utf-8")).hexdigest()[:8]
+        return f"{_safe_name(task)}-{digest}"
+
+    def _path(self, stem, col):
+        return self.dir / f"{stem}.{col}"
+
+    def _count(self, stem) -> int:
+        n = None
+        for col, code in self._COLS:
+            p = self._path(stem, col)
+            size = p.stat().st_size if p.exists() else 0
+            c = size // array(code).itemsize
+            n = c if n is None else min(n, c)
+        return n or 0
+
+    def _repair(self, stem, n):
+        # append interrompido no meio: corta as colunas no menor comprimento comum
+        for col, code in self._COLS:
+            p = self._path(stem, col)
+            want = n * array(code).itemsize
+            if p.exists() and p.stat().st_size != want:
+                with open(p, "r+b") as fh:
+                    fh.truncate(want)
+
+    def _bisect(self, fh, n, x, right=False) -> int:
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            fh.seek(mid * 8)
+            v = struct.unpack("d", fh.read(8))[0]
+            if v < x or (right and v == x):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _slice(self, stem, lo, hi) -> RunColumns:
+        out = RunColumns()
+        if hi <= lo:
+            return out
+        for col, _ in self._COLS:
+            arr = getattr(out, col)
+            with open(self._path(stem, col), "rb") as fh:
+                fh.seek(lo * arr.itemsize)
+                arr.frombytes(fh.read((hi - lo) * arr.itemsize))
+        return out
+
+    def count(self, task) -> int:
+        return self._count(self.stem(task))
+
+    def append(self, task, cols: RunColumns):
+        if not len(cols):
+            return
+        stem = self.stem(task)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._repair(stem, self._count(stem))
+        for col, _ in self._COLS:
+            with open(self._path(stem, col), "ab") as fh:
+                fh.write(getattr(cols, col).tobytes())
+
+    def range(self, task, since=None, until=None) -> RunColumns:
+        stem = self.stem(task)
+        n = self._count(stem)
+        if not n:
+            return RunColumns()
+        with open(self._path(stem, "ts"), "rb") as fh:
+            lo = self._bisect(fh, n, since) if since is not None else 0
+            hi = self._bisect(fh, n, until, right=True) if until is not None else n
+        return self._slice(stem, lo, hi)
+
+    def tail(self, task, k) -> RunColumns:
+        stem = self.stem(task)
+        n = self._count(stem)
+        return self._slice(stem, max(0, n - k), n)
+
+    def last_ts(self, task):
+        stem = self.stem(task)
+        n = self._count(stem)
+        return self._slice(stem, n - 1, n).ts[0] if n else None
+
+    def drop_before(self, ts):
+        """Retenção: remove, de todas as tarefas, o prefixo com ts < `ts`."""
+        if not self.dir.exists():
+            return 0
+        dropped = 0
+        for stem in sorted({p.stem for p in self.dir.glob("*.ts")}):
+            n = self._count(stem)
+            if not n:
+                continue
+            with open(self._path(stem, "ts"), "rb") as fh:
+                lo = self._bisect(fh, n, ts)
+            if not lo:
+                continue
+            keep = self._slice(stem, lo, n)
+            for col, _ in self._COLS:
+                p = self._path(stem, col)
+                tmp = p.with_name(p.name + ".tmp")
+                tmp.write_bytes(getattr(keep, col).tobytes())
+                os.replace(tmp, p)
+            dropped += lo
+        return dropped
+
+
+# recursos por execução (árvore de processos inteira); NULL = não medido
+USAGE_FIELDS = ("cpu_user", "cpu_sys", "rss_peak", "io_read", "io_write")
+_USAGE_TYPES = {"cpu_user": "REAL", "cpu_sys": "REAL", "rss_peak": "INTEGER", "io_read": "INTEGER", "io_write": "INTEGER"}
+# disparo agendado: horário previsto, início real e espera na fila do pool; NULL = execução manual
+DISPATCH_FIELDS = ("scheduled", "started", "queue_wait")
+_EXTRA_COLUMNS = {**_USAGE_TYPES, "scheduled": "REAL", "started": "REAL", "queue_wait": "REAL"}
+# disparos que não viraram execução (ver DispatchStats)
+DISPATCH_KINDS = ("skipped", "coalesced", "missed")
+# resumo por etapa do Pentaho ("Finished processing (I=, O=, R=, W=, U=, E=)"), ver parse_pdi_steps
+STEP_FIELDS = ("input", "output", "read", "written", "updated", "errors")
+
+
+class HistoryStore:
+    """
+    Histórico de execuções em SQLite (WAL): cada execução é um INSERT (sem
+    reescrever o config.json), com índice por (tarefa, ts). Seguro entre threads
+    e entre processos (GUI cliente lendo enquanto o daemon grava).
+    Execuções antigas são compactadas para o ColumnArchive (ver `maintain`).
+    """
+    def __init__(self, path, archive_dir=None):
+        self.path = Path(path)
+        self.archive = ColumnArchive(archive_dir or self.path.with_name("history"))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY, task TEXT NOT NULL, ts REAL NOT NULL,"
+            " rc INTEGER NOT NULL, dur REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS runs_task_ts ON runs(task, ts)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dispatch_events ("
+            " id INTEGER PRIMARY KEY, task TEXT NOT NULL, ts REAL NOT NULL, kind TEXT NOT NULL, n INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dispatch_task_ts ON dispatch_events(task, ts)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS step_results ("
+            " id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, task TEXT NOT NULL, ts REAL NOT NULL,"
+            " step TEXT NOT NULL, " + ", ".join(f"{k} INTEGER" for k in STEP_FIELDS) + ")"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS step_results_task_ts ON step_results(task, ts)")
+        have = {r[1] for r in self._conn.execute("PRAGMA table_info(runs)")}
+        for col, kind in _EXTRA_COLUMNS.items():
+            if col not in have:  # banco de versão anterior
+                self._conn.execute(f"ALTER TABLE runs ADD COLUMN {col} {kind}")
+
+    def append(self, task, rc, dur, ts=None, usage=None, dispatch=None, steps=None):
+        usage, dispatch = usage or {}, dispatch or {}
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO runs(task, ts, rc, dur, cpu_user, cpu_sys, rss_peak, io_read, io_write,"
+                " scheduled, started, queue_wait) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                (task, ts, int(rc), float(dur),
+                 *(usage.get(k) for k in USAGE_FIELDS), *(dispatch.get(k) for k in DISPATCH_FIELDS)))
+            if steps:
+                self._conn.executemany(
+                    "INSERT INTO step_results(run_id, task, ts, step, " + ", ".join(STEP_FIELDS) + ")"
+                    " VALUES (?,?,?,?" + ",?" * len(STEP_FIELDS) + ")",
+                    [(cur.lastrowid, task, ts, st["step"], *(st.get(k) for k in STEP_FIELDS)) for st in steps])
+
+    def last_steps(self, task):
+        """(ts, [{"step", *STEP_FIELDS}]) da execução mais recente da tarefa com etapas, ou None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT run_id, ts FROM step_results WHERE task=? ORDER BY ts DESC, id DESC LIMIT 1", (task,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT step, " + ", ".join(STEP_FIELDS) + " FROM step_results WHERE run_id=? ORDER BY id",
+                (row[0],)).fetchall()
+        return row[1], [dict(zip(("step",) + STEP_FIELDS, r)) for r in rows]
+
+    def note_dispatch(self, task, kind, n=1, ts=None):
+        """Registra disparos pulados/agrupados/perdidos (kind em DISPATCH_KINDS)."""
+        with self._lock:
+            self._conn.execute("INSERT INTO dispatch_events(task, ts, kind, n) VALUES (?,?,?,?)",
+                               (task, time.time() if ts is None else ts, kind, int(n)))
+
+    def dispatch_summary(self, task, since=None, until=None) -> dict:
+        """Atraso (previsto -> início) e espera na fila das execuções agendadas + disparos perdidos na janela."""
+        lo = since if since is not None else float("-inf")
+        hi = until if until is not None else float("inf")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT started - scheduled, queue_wait FROM runs"
+                " WHERE task=? AND ts>=? AND ts<=? AND scheduled IS NOT NULL", (task, lo, hi)
+            ).fetchall()
+            counts = dict(self._conn.execute(
+                "SELECT kind, SUM(n) FROM dispatch_events WHERE task=? AND ts>=? AND ts<=? GROUP BY kind",
+                (task, lo, hi)).fetchall())
+        lags = sorted(max(0.0, r[0]) for r in rows)
+        pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] if lags else None
+        out = {"runs": len(lags), "lag_p50": pick(0.5), "lag_p95": pick(0.95),
+               "lag_max": lags[-1] if lags else None,
+               "wait_avg": (sum(r[1] or 0.0 for r in rows) / len(rows)) if rows else None}
+        out.update({k: counts.get(k, 0) or 0 for k in DISPATCH_KINDS})
+        return out
+
+    def append_many(self, rows, meta_key=None):
+        """Insere [(task, ts, rc, dur), ...] numa transação; `meta_key` marca a operação como feita."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT INTO runs(task, ts, rc, dur) VALUES (?,?,?,?)", rows)
+                if meta_key:
+                    self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                                       (meta_key, now_str()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def has_meta(self, key) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key=?", (key,)).fetchone() is not None
+
+    def tail(self, task, limit=50) -> RunColumns:
+        """Últimas `limit` execuções da tarefa, em ordem cronológica, em colunas."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, rc, dur FROM runs WHERE task=? ORDER BY ts DESC, id DESC LIMIT ?",
+                (task, int(limit)),
+            ).fetchall()
+            out = self.archive.tail(task, int(limit) - len(rows)) if len(rows) < limit else RunColumns()
+        for ts, rc, dur in reversed(rows):
+            out.append(ts, rc, dur)
+        return out
+
+    def recent(self, task, limit=50):
+        """Últimas `limit` execuções da tarefa, em ordem cronológica ({"ts","rc","dur"})."""
+        return self.tail(task, limit).to_dicts()
+
+    def columns(self, task, since=None, until=None) -> RunColumns:
+        """Execuções da tarefa na janela [since, until] (epoch), em colunas, arquivo + recentes."""
+        with self._lock:
+            out = self.archive.range(task, since, until)
+            rows = self._conn.execute(
+                "SELECT ts, rc, dur FROM runs WHERE task=? AND ts>=? AND ts<=? ORDER BY ts, id",
+                (task, since if since is not None else float("-inf"),
+                 until if until is not None else float("inf")),
+            ).fetchall()
+        for ts, rc, dur in rows:
+            out.append(ts, rc, dur)
+        return out
+
+    def usage(self, task, since=None, until=None):
+        """[(ts, {cpu_user, cpu_sys, rss_peak, io_read, io_write})] das execuções medidas na janela."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, cpu_user, cpu_sys, rss_peak, io_read, io_write FROM runs"
+                " WHERE task=? AND ts>=? AND ts<=? AND rss_peak IS NOT NULL ORDER BY ts, id",
+                (task, since if since is not None else float("-inf"),
+                 until if until is not None else float("inf")),
+            ).fetchall()
+        return [(r[0], dict(zip(USAGE_FIELDS, r[1:]))) for r in rows]
+
+    def export_rows(self, task, since=None):
+        """(ts, rc, dur, *USAGE_FIELDS, *DISPATCH_FIELDS) da tarefa: arquivo colunar (só ts/rc/dur) + SQLite."""
+        with self._lock:
+            cols = self.archive.range(task, since, None)
+            rows = self._conn.execute(
+                "SELECT ts, rc, dur, cpu_user, cpu_sys, rss_peak, io_read, io_write,"
+                " scheduled, started, queue_wait FROM runs WHERE task=? AND ts>=? ORDER BY ts, id",
+                (task, since if since is not None else float("-inf")),
+            ).fetchall()
+        blank = (None,) * (len(USAGE_FIELDS) + len(DISPATCH_FIELDS))
+        for ts, rc, dur in zip(cols.ts, cols.rc, cols.dur):
+            yield (ts, rc, dur) + blank
+        yield from rows
+
+    def compact(self, before_ts):
+        """Move execuções com ts < before_ts do SQLite para o arquivo colunar."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task, ts, rc, dur FROM runs WHERE ts<? ORDER BY task, ts, id", (before_ts,)
+            ).fetchall()
+            by_task = {}
+            for task, ts, rc, dur in rows:
+                by_task.setdefault(task, RunColumns()).append(ts, rc, dur)
+            for task, cols in by_task.items():
+                last = self.archive.last_ts(task)
+                if last is not None:
+                    # compactação anterior interrompida antes do DELETE: não duplica
+                    keep = RunColumns()
+                    for t, r, d in zip(cols.ts, cols.rc, cols.dur):
+                        if t > last:
+                            keep.append(t, r, d)
+                    cols = keep
+                self.archive.append(task, cols)
+            self._conn.execute("DELETE FROM runs WHERE ts<?", (before_ts,))
+            return len(rows)
+
+    def prune(self, before_ts):
+        """Retenção: apaga execuções com ts < before_ts (SQLite e arquivo colunar)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM runs WHERE ts<?", (before_ts,))
+            self._conn.execute("DELETE FROM dispatch_events WHERE ts<?", (before_ts,))
+            self._conn.execute("DELETE FROM step_results WHERE ts<?", (before_ts,))
+            self.archive.drop_before(before_ts)
+
+    def maintain(self, hot_days=7, retention_days=0):
+        """Compacta o que tem mais de `hot_days` e aplica a retenção (0 = guardar tudo)."""
+        now = time.time()
+        moved = self.compact(now - hot_days * 86400) if hot_days > 0 else 0
+        if retention_days > 0:
+            self.prune(now - retention_days * 86400)
+        return moved
+
+    def last_id(self) -> int:
+        """Muda a cada execução gravada (por qualquer processo): usado para saber se há novidade."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT (SELECT COALESCE(MAX(id), 0) FROM runs) + (SELECT COALESCE(MAX(id), 0) FROM dispatch_events)"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+def history_store() -> HistoryStore:
+    global _history
+    with _history_lock:
+        if _history is None:
+            ensure_dirs()
+            _history = HistoryStore(HISTORY_DB)
+        return _history
+
+def _fmt_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+def _parse_ts(text: str) -> float:
+    try:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp()
+    except Exception:
+        return time.time()
+
+def _migrate_history(data):
+    """Migração única do data["history"] (config.json até esta versão) para o history.db."""
+    old = data.pop("history", None) or {}
+    store = history_store()
+    if not old or store.has_meta("migrated_config_history"):
+        return
+    rows = [
+        (task, _parse_ts(it.get("ts", "")), int(it.get("rc", 0)), float(it.get("dur", 0.0)))
+        for task, items in old.items() for it in (items or [])
+    ]
+    store.append_many(rows, meta_key="migrated_config_history")
+
+def append_history(data, task_name, rc, dur, usage=None, dispatch=None, steps=None):
+    """Grava uma execução no history.db (append-only; não reescreve o config.json)."""
+    history_store().append(task_name, rc, dur, usage=usage, dispatch=dispatch, steps=steps)
+    m = metrics()
+    m.inc("agendador_runs_total", {"task": task_name})
+    if rc != 0:
+        m.inc("agendador_run_failures_total", {"task": task_name})
+    m.observe("agendador_run_duration_seconds", dur, {"task": task_name})
+
+def history_usage(task_name, since=None, until=None):
+    return history_store().usage(task_name, since, until)
+
+def history_dispatch(task_name, since=None, until=None):
+    return history_store().dispatch_summary(task_name, since, until)
+
+def history_steps(task_name):
+    return history_store().last_steps(task_name)
+
+def export_history_csv(path, task_names, since=None):
+    """CSV (;) com todas as execuções das tarefas, incluindo CPU/RAM/E-S quando medidos. Retorna nº de linhas."""
+    n = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(["tarefa", "data", "rc", "duracao_s", "cpu_user_s", "cpu_sys_s",
+                    "ram_pico_bytes", "io_leitura_bytes", "io_escrita_bytes",
+                    "previsto", "inicio", "espera_fila_s"])
+        for name in task_names:
+            for ts, rc, dur, *extra in history_store().export_rows(name, since):
+                usage, (sched, started, wait) = extra[:len(USAGE_FIELDS)], extra[len(USAGE_FIELDS):]
+                w.writerow([name, _fmt_ts(ts), rc, f"{dur:.3f}"] +
+                           ["" if v is None else (f"{v:.3f}" if isinstance(v, float) else v) for v in usage] +
+                           ["" if sched is None else _fmt_ts(sched), "" if started is None else _fmt_ts(started),
+                            "" if wait is None else f"{wait:.3f}"])
+                n += 1
+    return n
+
+def fmt_bytes(n) -> str:
+    n = float(n or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit in ("B", "KB") else f"{n:.1f} {unit}"
+        n /= 1024
+
+def history_recent(task_name, limit=50):
+    return history_store().recent(task_name, limit)
+
+def history_columns(task_name, since=None, until=None) -> RunColumns:
+    return history_store().columns(task_name, since, until)
+
+def history_tail(task_name, limit=50) -> RunColumns:
+    return history_store().tail(task_name, limit)
+
+def downsample_runs(cols: RunColumns, buckets: int):
+    """
+    Agrupa execuções consecutivas em até `buckets` baldes (min/max), para o
+    gráfico desenhar milhares de execuções com poucas barras.
+    Retorna [(dur_min, dur_max, falhas, total), ...] em ordem cronológica.
+    """
+    n = len(cols)
+    buckets = max(1, int(buckets))
+    if n <= buckets:
+        return [(d, d, int(rc != 0), 1) for d, rc in zip(cols.dur, cols.rc)]
+    out = []
+    for b in range(buckets):
+        i0, i1 = b * n // buckets, (b + 1) * n // buckets
+        seg = cols.dur[i0:i1]
+        fails = sum(1 for rc in cols.rc[i0:i1] if rc != 0)
+        out.append((min(seg), max(seg), fails, i1 - i0))
+    return out
+
+def history_settings(settings):
+    """{"retention_days": dias (0 = sempre), "hot_days": dias no SQLite antes de ir para colunas}"""
+    h = (settings or {}).get("history") or {}
+    try:
+        retention = max(0, int(h.get("retention_days", 0)))
+    except Exception:
+        retention = 0
+    try:
+        hot = max(1, int(h.get("hot_days", 7)))
+    except Exception:
+        hot = 7
+    return {"retention_days": retention, "hot_days": hot}
+
+# ======================================================================================
+#  Notificações
+# ======================================================================================
+
+SMTP_IDLE_SEC = int(os.getenv("AGENDADOR_SMTP_IDLE_SEC", "60"))
+
+
+class SmtpSession:
+    """
+    Conexão SMTP autenticada (EHLO + STARTTLS + login uma vez só) reaproveitada entre
+    envios. Fecha sozinha após SMTP_IDLE_SEC sem uso; se o servidor derrubou a
+    conexão, reconecta e tenta de novo uma vez.
+    """
+    def __init__(self, host, port, username="", password="", starttls=True):
+        self.host, self.port = host, int(port)
+        self.username, self.password = username, password
+        self.starttls = starttls
+        self._server = None
+        self._last = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        server = smtplib.SMTP(self.host, self.port, timeout=timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _drop(self):
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+    def sendmail(self, from_addr, to_addrs, text, timeout=30):
+        with self._lock:
+            for attempt in range(2):
+                fresh = self._server is None
+                if fresh:
+                    self._server = self._connect(timeout)
+                try:
+                    self._server.sendmail(from_addr, to_addrs, text)
+                    break
+                except OSError:  # inclui SMTPException (desconectado, 421...)
+                    self._drop()
+                    if fresh or attempt:
+                        raise
+            self._last = time.time()
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(SMTP_IDLE_SEC, self._close_if_idle)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _close_if_idle(self):
+        with self._lock:
+            if time.time() - self._last >= SMTP_IDLE_SEC - 0.5:
+                self._drop()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._drop()
+
+
+_smtp_sessions = {}
+_smtp_lock = threading.Lock()
+
+def smtp_session(cfg) -> SmtpSession:
+    """Uma sessão por (host, porta, usuário, senha, starttls)."""
+    key = (cfg["smtp_host"], int(cfg.get("smtp_port", 587)), cfg.get("username", ""),
+           cfg.get("password", ""), bool(cfg.get("starttls", True)))
+    with _smtp_lock:
+        sess = _smtp_sessions.get(key)
+        if sess is None:
+            sess = _smtp_sessions[key] = SmtpSession(*key)
+        return sess
+
+def close_smtp_sessions():
+    with _smtp_lock:
+        sessions = list(_smtp_sessions.values())
+        _smtp_sessions.clear()
+    for sess in sessions:
+        sess.close()
+
+atexit.register(close_smtp_sessions)
+
+
+def send_email(settings, subject, body, timeout=30):
+    cfg = settings.get("email", {})
+    if not cfg.get("enabled"):
+        return
+    to_emails = cfg.get("to_emails", [])
+    if isinstance(to_emails, str):
+        to_emails = [e.strip() for e in to_emails.split(",") if e.strip()]
+    if not to_emails:
+        return
+
+    msg = MIMEText(body, _charset="utf-8")
+    msg["Subject"] = subject
+    msg["From"] = cfg["from_email"] or cfg["username"]
+    msg["To"] = ", ".join(to_emails)
+    msg["Date"] = formatdate(localtime=True)
+
+    smtp_session(cfg).sendmail(msg["From"], to_emails, msg.as_string(), timeout=timeout)
+
+# tempo para o wa_send.js residente subir o Chromium e restaurar a sessão
+WA_START_TIMEOUT = int(os.getenv("AGENDADOR_WA_START_TIMEOUT", "120"))
+
+
+class WhatsAppSender:
+    """
+    Cliente do `wa_send.js --serve`: um único Node+Chromium logado atende todas as
+    notificações (pedidos em JSON pelo stdin, respostas pelo stdout).
+    Se o processo morrer, é reiniciado no próximo envio.
+    """
+    def __init__(self, node, script, extra_args=()):
+        self.cmd = [node, script, "--serve", *extra_args]
+        self._lock = threading.Lock()    # um envio por vez
+        self._proc = None
+        self._ready = threading.Event()
+        self._eof = threading.Event()    # stdout do processo atual fechou (morreu, talvez ainda sem reap)
+        self._event = ""                 # último evento do processo (qr, auth_failure...)
+        self._pending = {}               # id -> [Event, resposta, processo]
+        self._ids = itertools.count(1)
+
+    def _start(self):
+        ensure_dirs()
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+        with open(WA_DIR / "wa_server.log", "a", encoding="utf-8", errors="ignore") as err:
+            proc = subprocess.Popen(
+                self.cmd, cwd=str(WA_DIR),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err,
+                text=True, encoding="utf-8", errors="ignore", bufsize=1, **kwargs,
+            )
+        self._ready = threading.Event()
+        self._eof = threading.Event()
+        self._event = ""
+        threading.Thread(target=self._reader, args=(proc, self._ready, self._eof), daemon=True,
+                         name="wa-sender").start()
+        self._proc = proc
+        return proc
+
+    def _reader(self, proc, ready, eof):
+        for line in proc.stdout:
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                msg = json.loads(line)
+            except Exception:
+                continue
+            ev = msg.get("event")
+            if ev == "ready":
+                ready.set()
+            elif ev:
+                self._event = ev
+            slot = self._pending.get(msg.get("id"))
+            if slot is not None and slot[2] is proc:
+                slot[1] = msg
+                slot[0].set()
+        # stdout fechou: o processo morreu (poll() pode ainda dar None), acorda quem espera por ele
+        eof.set()
+        for slot in list(self._pending.values()):
+            if slot[2] is proc:
+                slot[0].set()
+
+    def _kill(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            proc.wait(timeout=5)
+        except Exception:
+            kill_process_tree(proc.pid)
+
+    def _reap(self, proc):
+        """Processo que morreu sozinho: recolhe (ou mata o que sobrou) e esquece."""
+        try:
+            proc.wait(timeout=5)
+        except Exception:
+            kill_process_tree(proc.pid)
+        if self._proc is proc:
+            self._proc = None
+
+    def _wait_ready(self, proc, timeout):
+        deadline = time.time() + timeout
+        while not self._ready.wait(0.25):
+            if proc.poll() is not None:
+                return False
+            if self._event in ("qr", "auth_failure"):
+                self._kill()  # libera a sessão para o "Testar WhatsApp"
+                raise RuntimeError("WhatsApp (QR) sem login: use 'Testar WhatsApp' e leia o QR Code.")
+            if time.time() > deadline:
+                self._kill()
+                raise RuntimeError(f"wa_send.js residente não ficou pronto em {timeout}s.")
+        return True
+
+    def send(self, targets, message, timeout=45):
+        with self._lock:
+            for _ in range(2):  # 2ª tentativa = processo reiniciado
+                proc = self._proc
+                if proc is None or proc.poll() is not None:
+                    proc = self._start()
+                if not self._wait_ready(proc, WA_START_TIMEOUT):
+                    self._proc = None
+                    continue
+                eof = self._eof
+                rid = next(self._ids)
+                slot = [threading.Event(), None, proc]
+                self._pending[rid] = slot
+                broken = False
+                try:
+                    proc.stdin.write(json.dumps({"id": rid, "to": ",".join(targets), "message": message},
+                                                ensure_ascii=False) + "\n")
+                    proc.stdin.flush()
+                    slot[0].wait(timeout)
+                except OSError:
+                    broken = True  # pipe quebrado: o processo já morreu
+                finally:
+                    self._pending.pop(rid, None)
+                resp = slot[1]
+                if resp is None:
+                    if broken or eof.is_set() or proc.poll() is not None:
+                        self._reap(proc)
+                        continue  # morreu no meio do envio: reinicia e reenvia
+                    self._kill()
+                    raise RuntimeError(f"wa_send.js residente não respondeu em {timeout}s.")
+                if not resp.get("ok"):
+                    nf = resp.get("not_found") or []
+                    raise RuntimeError(f"{resp.get('error') or 'Falha no envio'}"
+                                       + (f" Não encontrados: {' | '.join(nf)}" if nf else ""))
+                return resp
+            raise RuntimeError("wa_send.js residente encerrou ao iniciar (veja wa/wa_server.log).")
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+
+_wa_sender = None
+_wa_sender_lock = threading.Lock()
+
+def whatsapp_sender(node, script):
+    """Sender residente compartilhado; recriado se o node/script configurado mudar."""
+    global _wa_sender
+    with _wa_sender_lock:
+        if _wa_sender is None or _wa_sender.cmd[:2] != [node, script]:
+            if _wa_sender is not None:
+                _wa_sender.close()
+            _wa_sender = WhatsAppSender(node, script)
+        return _wa_sender
+
+def close_whatsapp_sender():
+    """Encerra o wa_send.js residente (libera a sessão, ex.: antes do teste com QR)."""
+    global _wa_sender
+    with _wa_sender_lock:
+        sender, _wa_sender = _wa_sender, None
+    if sender is not None:
+        sender.close()
+
+atexit.register(close_whatsapp_sender)
+
+
+def send_whatsapp(settings, subject, body, timeout_sec=45):
+    cfg = settings.get("whatsapp", {})
+    if not cfg.get("enabled"):
+        return
+
+    mode = cfg.get("mode", "webjs")
+    if mode == "twilio":
+        try:
+            from twilio.rest import Client
+        except Exception:
+            return
+        try:
+            from twilio.http.http_client import TwilioHttpClient
+            http = TwilioHttpClient(timeout=timeout_sec)
+        except Exception:
+            http = None
+        client = Client(cfg.get("account_sid",""), cfg.get("auth_token",""), http_client=http)
+        to_numbers = cfg.get("to_numbers") or cfg.get("to_targets") or []
+        if isinstance(to_numbers, str):
+            to_numbers = [n.strip() for n in to_numbers.split(",") if n.strip()]
+        text = f"{subject}\n\n{body[:1500]}"
+        for to in to_numbers:
+            client.messages.create(from_=cfg.get("from_number",""), to=to, body=text)
+        return
+
+    # WebJS (QR)
+    node   = cfg.get("node_path", r"C:\Program Files\nodejs\node.exe")
+    script = cfg.get("webjs_script", str(resource_path("wa", "wa_send.js")))
+    tos    = cfg.get("to_targets", [])
+    if isinstance(tos, str):
+        tos = [t.strip() for t in tos.split(",") if t.strip()]
+
+    if not tos or not os.path.exists(node) or not os.path.exists(script):
+        raise RuntimeError("WhatsApp (QR) não configurado corretamente.")
+
+    ensure_dirs()
+    msg = f"{subject}\n\n{body}"
+    if cfg.get("resident", True):
+        whatsapp_sender(node, script).send(tos, msg, timeout=timeout_sec)
+        return
+
+    cmd = [node, script, "--to", ",".join(tos), "--message", msg]
+
+    proc = subprocess.run(
+    cmd,
+    cwd=str(WA_DIR),
+    stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT,
+    text=True,
+    encoding="utf-8",
+    errors="ignore",   # <— evita UnicodeDecodeError
+    timeout=timeout_sec
+)
+
+    out = (proc.stdout or "")[-800:]
+    if proc.returncode != 0:
+        raise RuntimeError(f"wa_send.js RC={proc.returncode}\n{out}")
+
+# ======================================================================================
+#  Despacho de notificações (fila própria, canais em paralelo)
+# ======================================================================================
+
+NOTIFY_TIMEOUTS = {
+    "email": int(os.getenv("AGENDADOR_NOTIFY_TIMEOUT_EMAIL", "30")),
+    "whatsapp": int(os.getenv("AGENDADOR_NOTIFY_TIMEOUT_WHATSAPP", "60")),
+}
+NOTIFY_LOG = LOG_DIR / "notificacoes.log"
+
+# caixa de saída: reenvio a cada N s (com backoff por item), lote por canal e idade máxima
+OUTBOX_RETRY_SEC = int(os.getenv("AGENDADOR_OUTBOX_RETRY_SEC", "60"))
+OUTBOX_MAX_AGE_H = float(os.getenv("AGENDADOR_OUTBOX_MAX_AGE_H", "24"))
+OUTBOX_BATCH = int(os.getenv("AGENDADOR_OUTBOX_BATCH", "20"))
+OUTBOX_BACKOFF_MAX_SEC = 3600
+
+# canal -> função(settings, assunto, corpo, timeout); WhatsApp cobre webjs e twilio
+NOTIFY_CHANNELS = {
+    "email": lambda settings, subject, body, timeout: send_email(settings, subject, body, timeout=timeout),
+    "whatsapp": lambda settings, subject, body, timeout: send_whatsapp(settings, subject, body, timeout_sec=timeout),
+}
+
+
+class NotificationOutbox:
+    """
+    Notificações que não saíram (sem rede, SMTP fora, WhatsApp caído) em SQLite,
+    para sobreviver a reinícios. `claim` marca o lote como "em envio" dentro de
+    uma transação, então GUI e daemon podem drenar a mesma caixa sem duplicar.
+    """
+    LEASE_SEC = 300  # lote pego e não confirmado volta a ficar disponível depois disso
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY, channel TEXT NOT NULL, task TEXT, subject TEXT NOT NULL,"
+            " body TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_try REAL NOT NULL, last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_channel_next ON outbox(channel, next_try)")
+
+    @staticmethod
+    def backoff(attempts):
+        return min(OUTBOX_BACKOFF_MAX_SEC, OUTBOX_RETRY_SEC * 2 ** max(0, attempts - 1))
+
+    def put(self, channel, item, error=None, attempts=0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox(channel, task, subject, body, created, attempts, next_try, last_error)"
+                " VALUES (?,?,?,?,?,?,?,?)",
+                (channel, item.get("task"), item["subject"], item["body"], item.get("ts", time.time()),
+                 attempts, time.time() + (self.backoff(attempts) if attempts else 0),
+                 None if error is None else str(error)[:500]))
+
+    def claim(self, channel, limit, force=False):
+        """Pega até `limit` itens vencidos do canal (todos, com `force`) e os reserva."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, task, subject, body, created, attempts FROM outbox"
+                    " WHERE channel=? AND next_try <= ? ORDER BY id LIMIT ?",
+                    (channel, float("inf") if force else now, int(limit))).fetchall()
+                if rows:
+                    self._conn.executemany("UPDATE outbox SET next_try=? WHERE id=?",
+                                           [(now + self.LEASE_SEC, r[0]) for r in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{"id": r[0], "task": r[1], "subject": r[2], "body": r[3], "ts": r[4], "attempts": r[5]}
+                for r in rows]
+
+    def done(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id=?", [(i,) for i in ids])
+
+    def retry(self, rows, error):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts=?, next_try=?, last_error=? WHERE id=?",
+                [(r["attempts"] + 1, now + self.backoff(r["attempts"] + 1), str(error)[:500], r["id"])
+                 for r in rows])
+
+    def expire(self, before_ts):
+        with self._lock:
+            return self._conn.execute("DELETE FROM outbox WHERE created < ?", (before_ts,)).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def outbox() -> NotificationOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            ensure_dirs()
+            _outbox = NotificationOutbox(OUTBOX_DB)
+        return _outbox
+
+
+class NotificationDispatcher:
+    """
+    Os jobs só enfileiram a notificação e voltam; uma thread própria distribui cada
+    item para os canais ativos, cada canal no seu pool (um WhatsApp lento não
+    segura o e-mail). Resultado de cada envio vai para logs/notificacoes.log.
+    O que falhar (ou chegar com a rede fora) vai para a caixa de saída em disco e
+    é reenviado em lotes: a cada OUTBOX_RETRY_SEC e logo que a rede volta.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._pools = {}
+        self._digests = {}   # canal -> (timer, [itens]) enquanto a janela de resumo está aberta
+        self._settings = None  # settings "vivo" usado para reenviar a caixa de saída
+        self._draining = set()
+        self.online = True
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="notify")
+                self._thread.start()
+
+    def attach(self, settings):
+        """Liga o despachante a um settings (ex.: do motor) para reenviar a caixa de saída."""
+        self._settings = settings
+        self._ensure_thread()
+
+    def submit(self, settings, subject, body, **meta):
+        """Enfileira e retorna na hora. `meta` (task, rc...) segue junto para os logs."""
+        self._settings = settings
+        self._ensure_thread()
+        self._queue.put({"settings": settings, "subject": subject, "body": body, "ts": time.time(), **meta})
+
+    def set_online(self, online, settings=None):
+        """Chamado pelo monitor de rede; ao voltar, drena a caixa de saída sem esperar o backoff."""
+        if settings is not None:
+            self._settings = settings
+        was, self.online = self.online, bool(online)
+        if self.online and not was:
+            self._ensure_thread()
+            self._queue.put({"drain": True, "force": True})
+
+    def _run(self):
+        last_drain = 0.0
+        while True:
+            try:
+                item = self._queue.get(timeout=OUTBOX_RETRY_SEC)
+            except queue.Empty:
+                item = {"drain": True, "force": False}
+            if item is None:
+                return
+            try:
+                if item.get("drain"):
+                    self._drain(item["force"])
+                    last_drain = time.time()
+                else:
+                    self._dispatch(item)
+                    if time.time() - last_drain >= OUTBOX_RETRY_SEC:
+                        self._drain(False)
+                        last_drain = time.time()
+            except Exception as e:
+                print("Erro no despacho de notificação:", e)
+
+    def _drain(self, force):
+        settings = self._settings
+        if not self.online or settings is None:
+            return
+        expired = outbox().expire(time.time() - OUTBOX_MAX_AGE_H * 3600)
+        if expired:
+            self._write_log(f"{'-':<8} EXPI {'':>6} {expired} notificação(ões) pendente(s) com mais de {OUTBOX_MAX_AGE_H:g}h descartada(s)")
+        for channel in NOTIFY_CHANNELS:
+            if not (settings.get(channel) or {}).get("enabled"):
+                continue
+            with self._lock:
+                if channel in self._draining:
+                    continue
+                self._draining.add(channel)
+            self._pool(channel).submit(self._drain_channel, channel, settings, force)
+
+    def _drain_channel(self, channel, settings, force):
+        """Reenvia a caixa de saída do canal em lotes (um lote = uma mensagem) até esvaziar ou falhar."""
+        try:
+            while self.online:
+                rows = outbox().claim(channel, OUTBOX_BATCH, force)
+                if not rows:
+                    return
+                items = [{**r, "settings": settings} for r in rows]
+                if len(items) == 1:
+                    item = {**items[0], "subject": items[0]["subject"] + " (reenvio)"}
+                else:
+                    item = digest_item(items, title=f"{len(items)} notificações pendentes (reenvio)")
+                err = self._send(channel, item)
+                if err is not None:
+                    outbox().retry(rows, err)
+                    return
+                outbox().done([r["id"] for r in rows])
+        except Exception as e:
+            print(f"Erro ao reenviar pendências ({channel}):", e)
+        finally:
+            with self._lock:
+                self._draining.discard(channel)
+
+    def _pool(self, channel):
+        pool = self._pools.get(channel)
+        if pool is None:
+            pool = self._pools[channel] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix=f"notify-{channel}")
+        return pool
+
+    def _dispatch(self, item):
+        settings = item["settings"]
+        for channel in NOTIFY_CHANNELS:
+            cfg = settings.get(channel) or {}
+            if not cfg.get("enabled"):
+                continue
+            try:
+                window = max(0, int(cfg.get("digest_sec") or 0))
+            except Exception:
+                window = 0
+            if window:
+                self._add_to_digest(channel, item, window)
+            else:
+                self._pool(channel).submit(self._deliver, channel, item)
+
+    def _add_to_digest(self, channel, item, window):
+        """A 1ª falha abre uma janela de `window` s; o que chegar até lá vira uma mensagem só."""
+        with self._lock:
+            entry = self._digests.get(channel)
+            if entry is None:
+                timer = threading.Timer(window, self._flush_digest, args=(channel,))
+                timer.daemon = True
+                entry = self._digests[channel] = (timer, [])
+                timer.start()
+            entry[1].append(item)
+
+    def _flush_digest(self, channel):
+        with self._lock:
+            entry = self._digests.pop(channel, None)
+        if not entry:
+            return
+        entry[0].cancel()
+        items = entry[1]
+        self._pool(channel).submit(self._deliver, channel, items[0] if len(items) == 1 else digest_item(items))
+
+    def _deliver(self, channel, item):
+        if not self.online:
+            outbox().put(channel, item)
+            self._write_log(f"{channel:<8} FILA {'':>6} {item['subject']} (sem rede)")
+            return False
+        err = self._send(channel, item)
+        if err is not None:
+            outbox().put(channel, item, err, attempts=1)
+        return err is None
+
+    def _send(self, channel, item):
+        """Envia e registra no log; devolve a exceção (ou None se deu certo)."""
+        t0 = time.perf_counter()
+        try:
+            NOTIFY_CHANNELS[channel](item["settings"], item["subject"], item["body"], NOTIFY_TIMEOUTS[channel])
+            err = None
+        except Exception as e:
+            err = e
+        dur = time.perf_counter() - t0
+        metrics().observe("agendador_notify_seconds", dur,
+                          {"channel": channel, "result": "ok" if err is None else "error"})
+        self._log(channel, item, dur, err)
+        return err
+
+    def _log(self, channel, item, dur, err):
+        status = "OK" if err is None else "ERRO"
+        line = f"{channel:<8} {status:<4} {dur:5.1f}s {item['subject']}"
+        if err is not None:
+            line += f" -> {str(err).strip()[:300]}"
+            print(f"Erro {channel}:", err)
+        self._write_log(line)
+
+    def note_suppressed(self, subject, reason):
+        """Registra no log um alerta que a política de alertas segurou."""
+        self._write_log(f"{'-':<8} SUPR {'':>6} {subject} ({reason})")
+
+    def _write_log(self, line):
+        try:
+            ensure_dirs()
+            with self._log_lock, open(NOTIFY_LOG, "a", encoding="utf-8") as f:
+                f.write(f"{now_str()} " + line.replace("\n", " ") + "\n")
+        except Exception:
+            pass
+
+    def stop(self, timeout=10.0):
+        """Processa o que já está na fila (até `timeout`) e encerra."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+        for channel in list(self._digests):
+            self._flush_digest(channel)  # não espera a janela fechar
+        deadline = time.time() + timeout
+        for pool in list(self._pools.values()):
+            pool.shutdown(wait=False)
+            for t in list(getattr(pool, "_threads", ())):
+                t.join(max(0.0, deadline - time.time()))
+        self._pools.clear()
+
+
+def alert_settings(settings):
+    """{"mode": "every" (toda falha) | "change" (1ª falha + recuperação), limites por hora (0 = sem limite)}"""
+    a = (settings or {}).get("alerts") or {}
+    out = {"mode": a.get("mode") if a.get("mode") in ("every", "change") else "every"}
+    for key in ("per_task_per_hour", "global_per_hour"):
+        try:
+            out[key] = max(0, int(a.get(key, 0)))
+        except Exception:
+            out[key] = 0
+    return out
+
+
+class AlertPolicy:
+    """
+    Decide se o resultado de uma execução vira alerta: modo só-mudança-de-estado
+    (1ª falha e recuperação), limite por tarefa e global por hora. O que for
+    segurado é contado e aparece no próximo alerta enviado da tarefa.
+    """
+    WINDOW_SEC = 3600
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failing = {}     # tarefa -> falhas seguidas
+        self._suppressed = {}  # tarefa -> alertas segurados desde o último enviado
+        self._sent = {}        # tarefa -> deque(horários dos alertas enviados)
+        self._sent_all = deque()
+
+    def decide(self, name, rc, settings, now=None):
+        """
+        None = nada a dizer (sucesso sem incidente aberto);
+        {"kind": "suppressed", "reason": ...} = alerta segurado pela política;
+        {"kind": "fail"|"recovery", "fails": n, "suppressed": n} = enviar.
+        """
+        cfg = alert_settings(settings)
+        now = time.time() if now is None else now
+        with self._lock:
+            fails = self._failing.get(name, 0)
+            if rc == 0:
+                self._failing.pop(name, None)
+                if not fails or cfg["mode"] != "change":
+                    return None
+                # recuperação sempre sai (é rara e encerra o incidente)
+                self._stamp(name, now)
+                return {"kind": "recovery", "fails": fails, "suppressed": self._suppressed.pop(name, 0)}
+
+            self._failing[name] = fails + 1
+            if cfg["mode"] == "change" and fails:
+                reason = "falha repetida"
+            else:
+                reason = self._over_limit(name, cfg, now)
+            if reason:
+                self._suppressed[name] = self._suppressed.get(name, 0) + 1
+                return {"kind": "suppressed", "reason": reason}
+            self._stamp(name, now)
+            return {"kind": "fail", "fails": fails + 1, "suppressed": self._suppressed.pop(name, 0)}
+
+    def _over_limit(self, name, cfg, now):
+        cutoff = now - self.WINDOW_SEC
+        sent = self._sent.setdefault(name, deque())
+        for dq in (sent, self._sent_all):
+            while dq and dq[0] < cutoff:
+                dq.popleft()
+        if cfg["per_task_per_hour"] and len(sent) >= cfg["per_task_per_hour"]:
+            return f"limite de {cfg['per_task_per_hour']}/h da tarefa"
+        if cfg["global_per_hour"] and len(self._sent_all) >= cfg["global_per_hour"]:
+            return f"limite global de {cfg['global_per_hour']}/h"
+        return None
+
+    def _stamp(self, name, now):
+        self._sent.setdefault(name, deque()).append(now)
+        self._sent_all.append(now)
+
+
+# tipo da notificação pelo assunto (as da caixa de saída não guardam o RC): (singular, plural)
+_DIGEST_KINDS = (("FALHA", ("falha", "falhas")), ("RECUPERADA", ("recuperada", "recuperadas")))
+
+def _digest_kind(item):
+    subject = item.get("subject") or ""
+    for marker, words in _DIGEST_KINDS:
+        if marker in subject:
+            return words
+    return ("outra", "outras")  # ex.: teste de e-mail/WhatsApp
+
+def digest_item(items, title=None):
+    """
+    Junta várias notificações (mesmo canal) num resumo só; o assunto conta falhas e
+    recuperações, ou usa `title` (ex.: reenvio da caixa de saída).
+    """
+    names, counts = [], Counter()
+    for it in items:
+        name = it.get("task") or it["subject"]
+        if name not in names:
+            names.append(name)
+        counts[_digest_kind(it)] += 1
+    shown = ", ".join(names[:5]) + (f" e mais {len(names) - 5}" if len(names) > 5 else "")
+    order = [w for _, w in _DIGEST_KINDS] + [("outra", "outras")]
+    kinds = ", ".join(f"{counts[w]} {w[counts[w] != 1]}" for w in order if counts[w])
+    subject = f"[{APP_NAME}] {title or kinds}: {shown}"
+    body = "\n\n----------\n\n".join(f"{it['subject']}\n{it['body']}" for it in items)
+    return {**items[-1], "subject": subject, "body": body, "count": len(items)}
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def notifier() -> NotificationDispatcher:
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = NotificationDispatcher()
+        return _notifier
+
+def stop_notifier(timeout=10.0):
+    if _notifier is not None:
+        _notifier.stop(timeout)
+
+# roda antes de close_whatsapp_sender (atexit é LIFO): o WhatsApp ainda está de pé
+atexit.register(stop_notifier)
+
+# ======================================================================================
+#  Execução de tarefas / logs
+# ======================================================================================
+
+def build_command(task, pdi_home):
+    path = task["path"]
+    args = task.get("args","").strip()
+    arg_list = shlex.split(args, posix=False) if args else []
+    ext = Path(path).suffix.lower()
+
+    if ext == ".exe":
+        return [path] + arg_list
+    if ext in (".bat", ".cmd"):
+        return ["cmd", "/c", path] + arg_list
+    if ext == ".ps1":
+        return ["powershell", "-ExecutionPolicy", "Bypass", "-File", path] + arg_list
+    if ext == ".py":
+        py = sys.executable
+        return [py, path] + arg_list
+    if ext == ".ktr":
+        return [str(Path(pdi_home)/"Pan.bat"), f"/file:{path}"] + arg_list
+    if ext == ".kjb":
+        return [str(Path(pdi_home)/"Kitchen.bat"), f"/file:{path}"] + arg_list
+    return [path] + arg_list
+
+PROC_SNAPSHOT_SEC = float(os.getenv("AGENDADOR_PROC_SNAPSHOT_SEC", "1"))
+
+
+def _linux_boot_time():
+    with open("/proc/stat", encoding="ascii") as f:
+        for line in f:
+            if line.startswith("btime "):
+                return float(line.split()[1])
+    return 0.0
+
+def _linux_create_time(pid, boot=None, hz=None):
+    """Início do processo (epoch) a partir de /proc/<pid>/stat (campo 22, em ticks desde o boot)."""
+    with open(f"/proc/{pid}/stat", "rb") as f:
+        stat = f.read()
+    fields = stat[stat.rindex(b")") + 2:].split()  # o nome (campo 2) pode ter espaços
+    hz = hz or os.sysconf("SC_CLK_TCK")
+    return (boot if boot is not None else _linux_boot_time()) + int(fields[19]) / hz
+
+def _proc_create_time(pid):
+    """Início de um processo específico (epoch) ou None se não der para saber."""
+    if psutil:
+        try:
+            return psutil.Process(pid).create_time()
+        except Exception:
+            return None
+    if sys.platform.startswith("linux"):
+        try:
+            return _linux_create_time(pid)
+        except Exception:
+            return None
+    return None
+
+
+class ProcessTable:
+    """
+    Foto da tabela de processos {pid: início (epoch) | None}, refeita no máximo a cada
+    PROC_SNAPSHOT_SEC e compartilhada por todas as checagens (uma varredura, em vez
+    de um `tasklist` por tarefa). Com o início gravado junto do PID, um PID
+    reaproveitado pelo sistema não passa por "ainda rodando".
+    """
+    def __init__(self, ttl=PROC_SNAPSHOT_SEC):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._procs = {}
+        self._taken = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            if time.monotonic() - self._taken >= self.ttl:
+                try:
+                    self._procs = self._scan()
+                except Exception:
+                    self._procs = {}
+                self._taken = time.monotonic()
+            return self._procs
+
+    def invalidate(self):
+        with self._lock:
+            self._taken = 0.0
+
+    @staticmethod
+    def _scan():
+        if psutil:
+            return {p.info["pid"]: p.info["create_time"]
+                    for p in psutil.process_iter(["pid", "create_time"])}
+        if sys.platform.startswith("linux"):
+            boot, hz, procs = _linux_boot_time(), os.sysconf("SC_CLK_TCK"), {}
+            for name in os.listdir("/proc"):
+                if name.isdigit():
+                    try:
+                        procs[int(name)] = _linux_create_time(name, boot, hz)
+                    except Exception:
+                        pass  # terminou durante a varredura
+            return procs
+        if os.name == "nt":
+            # uma chamada só, lista tudo: "nome","pid",...
+            res = subprocess.run(["tasklist", "/FO", "CSV", "/NH"], capture_output=True, text=True,
+                                 encoding="utf-8", errors="ignore", timeout=15)
+            procs = {}
+            for line in (res.stdout or "").splitlines():
+                cols = [c.strip('"') for c in line.split('","')]
+                if len(cols) > 1 and cols[1].isdigit():
+                    procs[int(cols[1])] = None
+            return procs
+        res = subprocess.run(["ps", "-A", "-o", "pid="], capture_output=True, text=True, timeout=15)
+        return {int(x): None for x in (res.stdout or "").split() if x.isdigit()}
+
+    def alive(self, pid, create_time=None):
+        if pid <= 0:
+            return False
+        procs = self.snapshot()
+        if pid not in procs:
+            return False
+        started = procs[pid]
+        # tolerância: arredondamentos diferentes entre psutil e /proc
+        return create_time is None or started is None or abs(started - create_time) < 1.0
+
+
+_proc_table = ProcessTable()
+
+def process_table() -> ProcessTable:
+    return _proc_table
+
+def _pid_alive(pid: int, create_time=None) -> bool:
+    return _proc_table.alive(pid, create_time)
+
+def _read_pidfile(path):
+    """(pid, início) de um arquivo PID ("pid" ou "pid início"); (0, None) se não der para ler."""
+    try:
+        parts = Path(path).read_text(encoding="utf-8").split()
+        return int(parts[0]), (float(parts[1]) if len(parts) > 1 else None)
+    except Exception:
+        return 0, None
+
+def _write_pidfile(path, pid: int):
+    started = _proc_create_time(pid)
+    Path(path).write_text(f"{pid}" if started is None else f"{pid} {started:.3f}", encoding="utf-8")
+    _proc_table.invalidate()  # o processo novo ainda não está na foto
+
+def _already_running_by_pidfile(task) -> bool:
+    """Usa arquivo PID para verificar se o processo anterior (spawn) ainda vive."""
+    pidfile = PID_DIR / (_safe_name(task["name"]) + ".pid")
+    if not pidfile.exists():
+        return False
+    pid, started = _read_pidfile(pidfile)
+    alive = _pid_alive(pid, started)
+    if not alive:
+        # limpa pid antigo (processo terminou ou o PID foi reaproveitado)
+        try: pidfile.unlink(missing_ok=True)
+        except Exception: pass
+    return alive
+
+def _write_pid(task, pid: int):
+    try:
+        _write_pidfile(PID_DIR / (_safe_name(task["name"]) + ".pid"), pid)
+    except Exception:
+        pass
+
+def kill_process_tree(pid: int):
+    """Mata o processo e todos os descendentes (filhos de `cmd /c`, Pan.bat, powershell...)."""
+    # coleta os descendentes antes de matar o pai (depois disso a árvore se perde)
+    procs = []
+    if psutil:
+        try:
+            parent = psutil.Process(pid)
+            procs = parent.children(recursive=True) + [parent]
+        except Exception:
+            procs = []
+    if os.name == "nt":
+        try:
+            subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"],
+                           capture_output=True, timeout=15)
+        except Exception:
+            pass
+    else:
+        try:
+            os.killpg(pid, signal.SIGKILL)  # grupo criado com start_new_session
+        except Exception:
+            try: os.kill(pid, signal.SIGKILL)
+            except Exception: pass
+    # quem escapou do grupo / do taskkill
+    for p in procs:
+        try:
+            p.kill()
+        except Exception:
+            pass
+    if procs:
+        try:
+            psutil.wait_procs(procs, timeout=5)
+        except Exception:
+            pass
+
+def _new_log_file(name):
+    return LOG_DIR / f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+
+def _child_env():
+    # força UTF-8 no filho Python
+    env = os.environ.copy()
+    env.setdefault("PYTHONIOENCODING", "utf-8")
+    env.setdefault("PYTHONUTF8", "1")
+    return env
+
+RES_SAMPLE_SEC = float(os.getenv("AGENDADOR_RES_SAMPLE_SEC", "1"))
+
+
+class UsageTracker:
+    """CPU, E/S e pico de RAM somados da árvore de processos de uma execução (amostras psutil)."""
+    def __init__(self, pid):
+        self.pid = pid
+        self.cpu = {}   # pid -> (user, system) da última amostra
+        self.io = {}    # pid -> (read_bytes, write_bytes)
+        self.rss_peak = 0
+        self.base = None  # consumo anterior à execução, descontado no result()
+
+    def rebase(self):
+        """Desconta o que o processo já gastou (ex.: worker pré-aquecido importando módulos)."""
+        self.base = self.result()
+
+    def sample(self):
+        try:
+            root = psutil.Process(self.pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return False
+        rss = 0
+        for p in tree:
+            try:
+                with p.oneshot():
+                    ct = p.cpu_times()
+                    self.cpu[p.pid] = (ct.user, ct.system)
+                    rss += p.memory_info().rss
+                    try:
+                        io = p.io_counters()
+                        self.io[p.pid] = (io.read_bytes, io.write_bytes)
+                    except (AttributeError, psutil.Error):
+                        pass  # macOS / sem permissão
+            except psutil.Error:
+                continue  # terminou no meio da amostra
+        self.rss_peak = max(self.rss_peak, rss)
+        return True
+
+    def result(self):
+        out = {
+            "cpu_user": sum(u for u, _ in self.cpu.values()),
+            "cpu_sys": sum(s for _, s in self.cpu.values()),
+            "rss_peak": self.rss_peak,
+            "io_read": sum(r for r, _ in self.io.values()) if self.io else None,
+            "io_write": sum(w for _, w in self.io.values()) if self.io else None,
+        }
+        for k in ("cpu_user", "cpu_sys", "io_read", "io_write"):
+            if self.base and out[k] is not None and self.base.get(k) is not None:
+                out[k] = max(0, out[k] - self.base[k])
+        return out
+
+
+class ResourceSampler:
+    """
+    Uma thread amostra todas as execuções em andamento: logo no início, depois com
+    intervalo dobrando (0.1s, 0.2s...) até RES_SAMPLE_SEC, para pegar também as curtas.
+    Sem psutil, não mede (usage fica vazio).
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._runs = {}   # id(tracker) -> [tracker, próxima amostra (monotonic), passo]
+        self._thread = None
+
+    def start(self, pid):
+        if not psutil:
+            return None
+        tracker = UsageTracker(pid)
+        tracker.sample()
+        with self._cond:
+            self._runs[id(tracker)] = [tracker, time.monotonic() + 0.1, 0.1]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="res-sampler")
+                self._thread.start()
+            self._cond.notify()
+        return tracker
+
+    def stop(self, tracker):
+        """Para de acompanhar e devolve o consumo ({} se não foi medido)."""
+        if tracker is None:
+            return {}
+        with self._cond:
+            self._runs.pop(id(tracker), None)
+        return tracker.result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._runs:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = [e for e in self._runs.values() if e[1] <= now]
+                if not due:
+                    self._cond.wait(min(e[1] for e in self._runs.values()) - now)
+                    continue
+                for e in due:
+                    e[2] = min(RES_SAMPLE_SEC, e[2] * 2)
+                    e[1] = now + e[2]
+            for e in due:
+                e[0].sample()
+
+
+_resource_sampler = ResourceSampler()
+
+def resource_sampler() -> ResourceSampler:
+    return _resource_sampler
+
+# ======================================================================================
+#  Interpretadores pré-aquecidos (tarefas .py com task["warm"])
+# ======================================================================================
+
+WARM_MAX_AGE_SEC = int(os.getenv("AGENDADOR_WARM_MAX_AGE_SEC", "3600"))
+WARM_MAX_SIZE = 8
+WARM_CHECK_SEC = 30
+
+# código do worker: importa o preload, espera UM pedido JSON no stdin e roda o script
+# como `python script.py` faria (argv, cwd, sys.path[0], SystemExit/traceback -> rc)
+WARM_BOOT = """
+import json, os, pkgutil, runpy, sys  # pkgutil: run_path importa na primeira chamada
+if sys.path and sys.path[0] == "":
+    del sys.path[0]
+for _m in sys.argv[1:]:
+    try:
+        __import__(_m)
+    except Exception as _e:
+        print(f"[warm] falha ao pré-carregar {_m}: {_e!r}", file=sys.stderr, flush=True)
+_job = sys.stdin.readline()
+if not _job.strip():
+    sys.exit(0)
+_job = json.loads(_job)
+os.chdir(_job["cwd"])
+sys.argv = [_job["path"]] + _job["args"]
+sys.path.insert(0, os.path.dirname(os.path.abspath(_job["path"])))
+runpy.run_path(_job["path"], run_name="__main__")
+"""
+
+
+def warm_settings(settings) -> dict:
+    """settings["warm"] normalizado: {"preload": [módulos], "size": workers ociosos}."""
+    cfg = (settings or {}).get("warm") or {}
+    preload = cfg.get("preload") or []
+    if isinstance(preload, str):
+        preload = preload.split(",")
+    try:
+        size = min(WARM_MAX_SIZE, max(0, int(cfg.get("size", 1))))
+    except (TypeError, ValueError):
+        size = 1
+    return {"preload": [m.strip() for m in preload if m and m.strip()], "size": size}
+
+def warm_eligible(task) -> bool:
+    """Só .py no modo tradicional: spawn já é de longa duração."""
+    return (bool(task.get("warm")) and not task.get("spawn")
+            and Path(task.get("path", "")).suffix.lower() == ".py")
+
+
+class WarmPool:
+    """
+    Interpretadores Python já iniciados (com settings["warm"]["preload"] importado)
+    esperando uma tarefa. Cada worker roda um único script via runpy e termina, então o
+    isolamento é o de um processo novo; só a subida e os imports pesados saem da execução.
+    Uma thread repõe o estoque em segundo plano e recicla workers com mais de WARM_MAX_AGE_SEC.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._idle = []      # [(Popen, criado_em)]
+        self._preload = ()
+        self._size = 0
+        self._thread = None
+
+    def configure(self, settings, active=True):
+        """Ajusta preload/tamanho; `active=False` (nenhuma tarefa warm) zera o estoque."""
+        cfg = warm_settings(settings)
+        with self._cond:
+            stale = []
+            if tuple(cfg["preload"]) != self._preload:
+                stale, self._idle = self._idle, []
+                self._preload = tuple(cfg["preload"])
+            self._size = cfg["size"] if active else 0
+            stale += self._idle[self._size:]
+            del self._idle[self._size:]
+            if self._size and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, daemon=True, name="warm-pool")
+                self._thread.start()
+            self._cond.notify()
+        for proc, _ in stale:
+            self._discard(proc)
+
+    def launch(self, path, args, cwd, settings):
+        """
+        Entrega o script a um worker e devolve o Popen (stdout = saída do script, texto).
+        Sem worker pronto, inicia um na hora (mesmo custo de um processo novo).
+        """
+        if tuple(warm_settings(settings)["preload"]) != self._preload:
+            self.configure(settings, active=bool(self._size))
+        job = json.dumps({"path": str(path), "args": list(args), "cwd": str(cwd)}) + "\n"
+        for attempt in range(2):
+            proc = self._take() if attempt == 0 else None
+            if proc is None:
+                proc = self._spawn(self._preload)
+            try:
+                proc.stdin.write(job)
+                proc.stdin.close()
+                return proc
+            except OSError:
+                self._discard(proc)  # morreu enquanto esperava: tenta um novo
+        raise RuntimeError("worker pré-aquecido não aceitou a tarefa.")
+
+    def idle_count(self) -> int:
+        with self._cond:
+            return len(self._idle)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size = 0
+            self._cond.notify()
+        for proc, _ in idle:
+            self._discard(proc)
+
+    def _take(self):
+        stale, proc = [], None
+        with self._cond:
+            while self._idle:
+                p, born = self._idle.pop(0)
+                if p.poll() is None and time.time() - born < WARM_MAX_AGE_SEC:
+                    proc = p
+                    break
+                stale.append(p)
+            self._cond.notify()  # repor o que saiu
+        for p in stale:
+            self._discard(p)
+        return proc
+
+    @staticmethod
+    def _spawn(preload):
+        return subprocess.Popen(
+            [sys.executable, "-c", WARM_BOOT, *preload],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding="utf-8", errors="ignore", bufsize=1, env=_child_env(),
+            start_new_session=(os.name != "nt"),
+        )
+
+    @staticmethod
+    def _discard(proc):
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            proc.kill()   # ocioso: não há trabalho a perder
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+        try:
+            proc.stdout.close()
+        except Exception:
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                old = [e for e in self._idle
+                       if e[0].poll() is not None or now - e[1] >= WARM_MAX_AGE_SEC]
+                self._idle = [e for e in self._idle if e not in old]
+                missing = self._size - len(self._idle)
+                preload = self._preload
+                if not old and missing <= 0:
+                    self._cond.wait(WARM_CHECK_SEC)
+                    continue
+            for proc, _ in old:
+                self._discard(proc)
+            if missing <= 0:
+                continue
+            try:
+                proc = self._spawn(preload)
+            except Exception:
+                time.sleep(WARM_CHECK_SEC)  # executável sumiu/sem recursos: tenta depois
+                continue
+            with self._cond:
+                if preload == self._preload and len(self._idle) < self._size:
+                    self._idle.append((proc, time.time()))
+                    proc = None
+            if proc is not None:
+                self._discard(proc)  # configuração mudou enquanto subia
+
+
+_warm_pool = WarmPool()
+
+def warm_pool() -> WarmPool:
+    return _warm_pool
+
+atexit.register(_warm_pool.close)
+
+# ======================================================================================
+#  Pentaho: opções da JVM, resultado por etapa e lotes (uma JVM para várias tarefas)
+# ======================================================================================
+
+PDI_EXTS = (".ktr", ".kjb")
+PDI_BATCH_MAX = int(os.getenv("AGENDADOR_PDI_BATCH_MAX", "20"))
+PDI_BATCH_QUEUE_SEC = int(os.getenv("AGENDADOR_PDI_BATCH_QUEUE_SEC", "3600"))  # lote sem vaga no pool
+PDI_BATCH_POLL_SEC = 5
+PDI_BATCH_JOB = "agendador_lote"  # nome do .kjb gerado (prefixo das linhas dele no log)
+
+# linhas do log do Kettle (nível Basic), ex.:
+#   2024/05/01 06:00:03 - Table input.0 - Finished processing (I=120, O=0, R=0, W=120, U=0, E=0)
+#   2024/05/01 06:00:01 - agendador_lote - Starting entry [carga_vendas]
+#   2024/05/01 06:00:09 - agendador_lote - Finished job entry [carga_vendas] (result=[true])
+_PDI_STEP_RE = re.compile(r" - (.+?)\.(\d+) - Finished processing "
+                          r"\(I=(\d+), O=(\d+), R=(\d+), W=(\d+), U=(\d+), E=(\d+)\)")
+_PDI_ENTRY_START_RE = re.compile(rf" - {PDI_BATCH_JOB} - Starting entry \[(.+)\]\s*$")
+_PDI_ENTRY_DONE_RE = re.compile(rf" - {PDI_BATCH_JOB} - Finished job entry \[(.+)\] \(result=\[(\w+)\]\)")
+
+
+def pdi_settings(settings) -> dict:
+    """settings["pentaho"]: janela do lote em segundos (0 = sem lotes) e executor no lugar do Kitchen."""
+    cfg = (settings or {}).get("pentaho") or {}
+    try:
+        batch_sec = max(0.0, float(cfg.get("batch_sec", 5)))
+    except (TypeError, ValueError):
+        batch_sec = 5.0
+    return {"batch_sec": batch_sec, "runner": str(cfg.get("runner") or "").strip()}
+
+def _task_env(task):
+    env = _child_env()
+    jvm = (task.get("jvm_opts") or "").strip()
+    if jvm and Path(task.get("path", "")).suffix.lower() in PDI_EXTS:
+        env["PENTAHO_DI_JAVA_OPTIONS"] = jvm  # lido pelo Spoon.bat/spoon.sh que o Pan/Kitchen chamam
+    return env
+
+def _pdi_params(args):
+    """{"NOME": "valor"} de args só com /param:NOME=valor; None se houver outra opção (não entra em lote)."""
+    params = {}
+    for tok in (shlex.split(args, posix=False) if args else []):
+        key, sep, rest = tok.partition(":")
+        name, eq, value = rest.partition("=")
+        if not sep or key.lower() not in ("/param", "-param") or not eq or not name:
+            return None
+        params[name.strip('"')] = value.strip('"')
+    return params
+
+def pdi_batch_eligible(task, settings) -> bool:
+    return (bool(task.get("pdi_batch")) and not task.get("spawn")
+            and Path(task.get("path", "")).suffix.lower() in PDI_EXTS
+            and pdi_settings(settings)["batch_sec"] > 0
+            and _pdi_params(task.get("args", "").strip()) is not None)
+
+def parse_pdi_steps(lines):
+    """Soma as linhas "Finished processing" por etapa (todas as cópias), na ordem em que aparecem."""
+    steps = {}
+    for line in lines:
+        if "Finished processing" not in line:
+            continue
+        m = _PDI_STEP_RE.search(line)
+        if not m:
+            continue
+        st = steps.setdefault(m.group(1), {"step": m.group(1), **{k: 0 for k in STEP_FIELDS}})
+        for k, v in zip(STEP_FIELDS, m.groups()[2:]):
+            st[k] += int(v)
+    return list(steps.values())
+
+def pdi_steps(task, log_path):
+    """Etapas da execução (para o histórico) a partir do log; None se não for Pentaho."""
+    if Path(task.get("path", "")).suffix.lower() not in PDI_EXTS or not log_path:
+        return None
+    try:
+        with open(log_path, encoding="utf-8", errors="ignore") as f:
+            return parse_pdi_steps(f)
+    except OSError:
+        return None
+
+def format_pdi_steps(steps, limit=4) -> str:
+    """Resumo curto das etapas (as com erro primeiro), ex.: "Table output: R 0 / W 120 / E 0"."""
+    if not steps:
+        return ""
+    top = sorted(steps, key=lambda s: -(s["errors"] or 0))[:limit]
+    txt = "  |  ".join(f"{s['step']}: R {s['read']} / W {s['written']} / E {s['errors']}" for s in top)
+    return txt + (f"  (+{len(steps) - limit})" if len(steps) > limit else "")
+
+def _pdi_batch_job_xml(tasks):
+    """.kjb com START -> tarefa 1 -> tarefa 2 ... (hops incondicionais: uma falha não para as outras)."""
+    esc = lambda v: xml_escape(str(v))
+    entries = ["<entry><name>START</name><type>SPECIAL</type><start>Y</start><dummy>N</dummy>"
+               "<repeat>N</repeat><schedulerType>0</schedulerType><parallel>N</parallel>"
+               "<draw>Y</draw><nr>0</nr><xloc>20</xloc><yloc>20</yloc></entry>"]
+    hops, prev = [], "START"
+    for i, t in enumerate(tasks, 1):
+        kind = "JOB" if Path(t["path"]).suffix.lower() == ".kjb" else "TRANS"
+        params = "".join(f"<parameter><name>{esc(k)}</name><stream_name/><value>{esc(v)}</value></parameter>"
+                         for k, v in (_pdi_params(t.get("args", "").strip()) or {}).items())
+        entries.append(
+            f"<entry><name>{esc(t['name'])}</name><type>{kind}</type>"
+            f"<specification_method>filename</specification_method><filename>{esc(t['path'])}</filename>"
+            f"<wait_until_finished>Y</wait_until_finished><set_logfile>N</set_logfile>"
+            f"<parameters><pass_all_parameters>Y</pass_all_parameters>{params}</parameters>"
+            f"<parallel>N</parallel><draw>Y</draw><nr>0</nr><xloc>{20 + 120 * i}</xloc><yloc>20</yloc></entry>")
+        hops.append(f"<hop><from>{esc(prev)}</from><to>{esc(t['name'])}</to><from_nr>0</from_nr><to_nr>0</to_nr>"
+                    "<enabled>Y</enabled><evaluation>Y</evaluation><unconditional>Y</unconditional></hop>")
+        prev = t["name"]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f"<job><name>{PDI_BATCH_JOB}</name><directory>/</directory><parameters/>"
+            f"<entries>{''.join(entries)}</entries><hops>{''.join(hops)}</hops></job>\n")
+
+def pdi_batch_command(settings):
+    """Kitchen do PDI Home, ou settings["pentaho"]["runner"] (ex.: kitchen.sh, executor próprio, stub de teste)."""
+    pdi_home = settings.get("pdi_home", r"C:\Pentaho\data-integration")
+    runner = pdi_settings(settings)["runner"] or str(Path(pdi_home) / "Kitchen.bat")
+    return build_command({"path": runner}, pdi_home)
+
+def pdi_batch_timeout(tasks):
+    """
+    Prazo do lote: as entradas rodam em sequência, então os prazos se somam; quem não
+    tem timeout entra com o maior prazo do lote (sem isso, um lote misto ficaria sem
+    watchdog nenhum). None só se nenhuma tarefa do lote tiver timeout.
+    """
+    timeouts = [int(t.get("timeout", "0") or 0) for t in tasks]
+    longest = max(timeouts, default=0)
+    return sum(t or longest for t in timeouts) if longest else None
+
+
+class PdiBatcher:
+    """
+    Junta as tarefas .ktr/.kjb com task["pdi_batch"] que disparam na mesma janela
+    (settings["pentaho"]["batch_sec"]) num único Kitchen: um .kjb gerado chama uma
+    após a outra, então a JVM sobe uma vez só. Tarefas com opções de JVM ou pasta de
+    trabalho diferentes vão em lotes separados (uma JVM tem um heap só).
+    Quem dispara não segura thread esperando: `submit` devolve na hora e o resultado
+    chega em `on_done(rc, dur, log, usage)`. Ao fechar a janela, o lote vai para
+    `launch(fn)` — no motor, um job só no pool da tarefa: um lote = uma vaga, uma JVM.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = {}   # (jvm_opts, pasta) -> lote aberto
+
+    def submit(self, task, settings, on_done, progress_cb=None, on_start=None, launch=None):
+        """Põe a tarefa no lote aberto (ou abre um). Sem `launch`, o lote roda numa thread própria."""
+        jvm = (task.get("jvm_opts") or "").strip()
+        workdir = task.get("working_dir") or str(Path(task["path"]).parent)
+        key = (jvm, workdir)
+        window = pdi_settings(settings)["batch_sec"]
+        item = {"task": task, "progress": progress_cb, "on_start": on_start, "on_done": on_done}
+        with self._lock:
+            batch = self._open.get(key)
+            # a mesma tarefa duas vezes no lote teria duas entradas com o mesmo nome: vai sozinha
+            solo = batch is not None and any(it["task"]["name"] == task["name"] for it in batch["items"])
+            new = batch is None or solo
+            if new:
+                batch = {"items": [], "settings": settings, "jvm": jvm, "workdir": workdir,
+                         "launch": launch, "state": "open",
+                         "deadline": time.time() + window + PDI_BATCH_QUEUE_SEC}
+                if not solo:
+                    self._open[key] = batch
+            batch["items"].append(item)
+            full = len(batch["items"]) >= PDI_BATCH_MAX
+        if solo or full:
+            self._close(key, batch)
+        elif new:
+            timer = threading.Timer(window, self._close, args=(key, batch))
+            timer.daemon = True
+            timer.start()
+        return batch
+
+    def run(self, task, settings, progress_cb=None, usage=None):
+        """Versão bloqueante (run_task/Executar agora): espera o lote e devolve (rc, dur, log)."""
+        done, out = threading.Event(), {}
+        def _on_done(*res):
+            out["res"] = res
+            done.set()
+        batch = self.submit(task, settings, _on_done, progress_cb)
+        while not done.wait(PDI_BATCH_POLL_SEC):
+            if batch["state"] == "done" or time.time() > batch["deadline"]:
+                break  # o lote sumiu sem publicar (ou estourou o prazo): não fica preso aqui
+        rc, dur, log_path, used = out.get("res") or (-1, 0.0, "", {})
+        if usage is not None:
+            usage.update(used)
+        return rc, dur, log_path
+
+    def _close(self, key, batch):
+        with self._lock:
+            if batch["state"] != "open":
+                return  # a janela e o "lote cheio" podem chegar os dois
+            batch["state"] = "queued"
+            if self._open.get(key) is batch:
+                del self._open[key]
+        try:
+            (batch["launch"] or _launch_thread)(lambda: self._execute(batch))
+        except Exception as e:
+            # ex.: agendador já parado; ninguém pode ficar esperando este lote
+            self._publish(batch, [(it, (-1, 0.0, "", {})) for it in batch["items"]])
+            print(f"{now_str()} lote Pentaho não iniciado:", e)
+
+    def _publish(self, batch, results):
+        for it, res in results:
+            try:
+                it["on_done"](*res)
+            except Exception as e:
+                print(f"{now_str()} [{it['task']['name']}] erro ao registrar resultado do lote:", e)
+        batch["state"] = "done"
+
+    def _execute(self, batch):
+        items, settings, jvm = batch["items"], batch["settings"], batch["jvm"]
+        start = time.time()
+        timeout = pdi_batch_timeout([it["task"] for it in items])
+        batch["state"] = "running"
+        batch["deadline"] = start + timeout + PDI_BATCH_QUEUE_SEC if timeout else float("inf")
+        by_name = {it["task"]["name"]: it for it in items}
+        timed_out = threading.Event()
+        proc, measured, error = None, {}, None
+        results = []
+        try:
+            for it in items:
+                if it["on_start"]:
+                    it["on_start"]()
+            ensure_dirs()
+            # lotes de JVMs diferentes podem começar no mesmo segundo: microssegundos no nome
+            batch_log = LOG_DIR / f"_lote_pdi_{datetime.now():%Y%m%d_%H%M%S_%f}.log"
+            kjb = batch_log.with_suffix(".kjb")
+            for it in items:
+                it["log"] = _new_log_file(it["task"]["name"])
+                it["f"] = open(it["log"], "w", encoding="utf-8", errors="ignore")
+            kjb.write_text(_pdi_batch_job_xml([it["task"] for it in items]), encoding="utf-8")
+            cmd = pdi_batch_command(settings) + [f"/file:{kjb}", "/level:Basic"]
+            env = _child_env()
+            if jvm:
+                env["PENTAHO_DI_JAVA_OPTIONS"] = jvm
+            for it in items:
+                it["f"].write(f"# {it['task']['name']} @ {now_str()} (lote Pentaho: {len(items)} tarefa(s))\n"
+                              f"CMD: {' '.join(cmd)}\nLog do lote: {batch_log}\n\n")
+            with open(batch_log, "w", encoding="utf-8", errors="ignore") as f:
+                f.write(f"# lote Pentaho @ {now_str()}: {', '.join(by_name)}\nCMD: {' '.join(cmd)}\n\n")
+                proc = subprocess.Popen(
+                    cmd, cwd=batch["workdir"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    text=True, encoding="utf-8", errors="ignore", bufsize=1, env=env,
+                    start_new_session=(os.name != "nt"),
+                )
+                tracker = resource_sampler().start(proc.pid)
+                watchdog = None
+                if timeout:
+                    def _on_timeout():
+                        timed_out.set()
+                        kill_process_tree(proc.pid)
+                    watchdog = threading.Timer(timeout, _on_timeout)
+                    watchdog.daemon = True
+                    watchdog.start()
+                current = None  # tarefa cuja entrada está rodando: as linhas vão para o log dela
+                try:
+                    while True:
+                        line = proc.stdout.readline()
+                        if not line and proc.poll() is not None:
+                            break
+                        if not line:
+                            continue
+                        f.write(line)
+                        m = _PDI_ENTRY_START_RE.search(line)
+                        if m and m.group(1) in by_name:
+                            current = by_name[m.group(1)]
+                            current["t0"] = time.time()
+                        if current is not None:
+                            current["f"].write(line)
+                            if current["progress"]:
+                                current["progress"](line.strip()[:140])
+                        m = _PDI_ENTRY_DONE_RE.search(line)
+                        if m and m.group(1) in by_name:
+                            it = by_name[m.group(1)]
+                            it["ok"], it["t1"] = m.group(2).lower() == "true", time.time()
+                            current = None
+                    proc.wait()
+                finally:
+                    if watchdog:
+                        watchdog.cancel()
+                    measured = resource_sampler().stop(tracker)
+        except Exception as e:
+            error = e
+            if proc is not None and proc.poll() is None:
+                kill_process_tree(proc.pid)  # ninguém mais lê o stdout dele
+            for it in items:
+                if "f" in it and "ok" not in it:
+                    try:
+                        it["f"].write("\n### ERRO ao iniciar/executar o lote:\n"
+                                      + "".join(traceback.format_exception(e)))
+                    except Exception:
+                        pass
+        finally:
+            # sempre publica: quem disparou (e o DAG/histórico) depende disso
+            try:
+                # cada tarefa fica com o tempo da sua entrada; CPU/E-S do lote divididos na mesma proporção
+                durs = {n: (it["t1"] - it["t0"]) if "t1" in it and "t0" in it else time.time() - start
+                        for n, it in by_name.items()}
+                total = sum(durs.values()) or 1.0
+                for name, it in by_name.items():
+                    if "ok" in it:
+                        rc, note = (0 if it["ok"] else 1), ""
+                    elif timed_out.is_set():
+                        rc, note = -9, f"\n### TIMEOUT do lote atingido ({timeout}s): árvore de processos finalizada.\n"
+                    else:
+                        rc = -1
+                        note = (f"\n### O lote terminou (RC={proc.returncode}) sem concluir esta tarefa.\n"
+                                if proc is not None and error is None else "")
+                    share = durs[name] / total
+                    used = {k: (v * share if k != "rss_peak" and v is not None else v) for k, v in measured.items()}
+                    results.append((it, (rc, durs[name], str(it.get("log") or ""), used)))
+                    if "f" in it:
+                        try:
+                            it["f"].write(note)
+                            it["f"].close()
+                        except Exception:
+                            pass
+            except Exception as e:
+                print(f"{now_str()} erro ao apurar o lote Pentaho:", e)
+            done = {id(it) for it, _ in results}
+            results += [(it, (-1, time.time() - start, str(it.get("log") or ""), {}))
+                        for it in items if id(it) not in done]
+            self._publish(batch, results)
+
+
+def _launch_thread(fn):
+    threading.Thread(target=fn, daemon=True, name="pdi-batch").start()
+
+
+_pdi_batcher = PdiBatcher()
+
+def pdi_batcher() -> PdiBatcher:
+    return _pdi_batcher
+
+
+def run_task(task, settings, progress_cb=None, usage=None):
+    """
+    Executa a tarefa e devolve (rc, duração, log). Em modo spawn devolve rc=None:
+    o processo segue sozinho e o SpawnSupervisor registra o resultado ao terminar.
+    Se `usage` (dict) for passado, recebe CPU/RAM/E-S da execução (ver USAGE_FIELDS).
+    """
+    if pdi_batch_eligible(task, settings):
+        return pdi_batcher().run(task, settings, progress_cb, usage)
+    ensure_dirs()
+    name = task["name"]
+    log_file = _new_log_file(name)
+    pdi_home = settings.get("pdi_home", r"C:\Pentaho\data-integration")
+    cmd = build_command(task, pdi_home)
+    workdir = task.get("working_dir") or str(Path(task["path"]).parent)
+    timeout = int(task.get("timeout", "0") or 0) or None
+    spawn = bool(task.get("spawn", False))
+    env = _task_env(task)
+
+    # se for spawn e já tem processo vivo, só loga e sai
+    if spawn and _already_running_by_pidfile(task):
+        try:
+            with open(log_file, "a", encoding="utf-8", errors="ignore") as f:
+                f.write(f"# {name} @ {now_str()} (spawn)\n")
+                f.write("Processo já está em execução. Nada a fazer.\n")
+        except Exception:
+            pass
+        return None, 0.0, str(log_file)
+
+    start = time.time()
+
+    if spawn:
+        # inicia DETACHED escrevendo direto no log e retorna
+        try:
+            log_fh = open(log_file, "a", encoding="utf-8", errors="ignore")
+            log_fh.write(f"# {name} @ {now_str()} (spawn)\nCMD: {' '.join(cmd)}\n\n")
+
+            popen_kwargs = dict(cwd=workdir, stdout=log_fh, stderr=subprocess.STDOUT, env=env)
+            if os.name == "nt":
+                CREATE_NEW_PROCESS_GROUP = 0x00000200
+                DETACHED_PROCESS = 0x00000008
+                CREATE_NO_WINDOW = 0x08000000
+                popen_kwargs["creationflags"] = (CREATE_NEW_PROCESS_GROUP |
+                                                 DETACHED_PROCESS | CREATE_NO_WINDOW)
+            else:
+                import os as _os
+                popen_kwargs["preexec_fn"] = _os.setpgrp
+
+            proc = subprocess.Popen(cmd, **popen_kwargs)
+            _write_pid(task, proc.pid)
+            try:
+                log_fh.flush(); log_fh.close()
+            except Exception:
+                pass
+            # RC/duração de verdade entram no histórico quando o processo terminar
+            spawn_supervisor().track(task, settings, proc, log_file, start,
+                                     tracker=resource_sampler().start(proc.pid))
+            return None, time.time() - start, str(log_file)
+        except Exception as e:
+            with open(log_file, "a", encoding="utf-8", errors="ignore") as f:
+                f.write("\n### ERRO ao iniciar em modo spawn:\n" + "".join(traceback.format_exception(e)))
+            return -1, time.time() - start, str(log_file)
+
+    # modo tradicional: stream da saída para o log, aguardando terminar
+    warm = warm_eligible(task)
+    with open(log_file, "w", encoding="utf-8", errors="ignore") as f:
+        f.write(f"# {name} @ {now_str()}\nCMD: {' '.join(cmd)}{' (pré-aquecido)' if warm else ''}\n\n")
+        try:
+            if warm:
+                # cmd = [python, script, *args]: o worker já está de pé, só recebe script/args
+                proc = warm_pool().launch(cmd[1], cmd[2:], workdir, settings)
+            else:
+                proc = subprocess.Popen(
+                    cmd, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    text=True, encoding="utf-8", errors="ignore", bufsize=1, env=env,
+                    # fora do Windows, grupo próprio para o watchdog matar a árvore com killpg
+                    start_new_session=(os.name != "nt"),
+                )
+            tracker = resource_sampler().start(proc.pid)
+            if warm and tracker:
+                tracker.rebase()  # a subida/preload do worker não conta para a execução
+            # watchdog: mata a árvore inteira no prazo, mesmo se o filho não imprimir nada
+            timed_out = threading.Event()
+            watchdog = None
+            if timeout:
+                def _on_timeout():
+                    timed_out.set()
+                    kill_process_tree(proc.pid)
+                watchdog = threading.Timer(timeout, _on_timeout)
+                watchdog.daemon = True
+                watchdog.start()
+            try:
+                while True:
+                    line = proc.stdout.readline()
+                    if not line and proc.poll() is not None:
+                        break
+                    if line:
+                        f.write(line)
+                        if progress_cb:
+                            progress_cb(line.strip()[:140])
+                proc.wait()
+            finally:
+                if watchdog:
+                    watchdog.cancel()
+                measured = resource_sampler().stop(tracker)
+                if usage is not None:
+                    usage.update(measured)
+            if timed_out.is_set():
+                rc = -9
+                f.write(f"\n### TIMEOUT atingido ({timeout}s): árvore de processos finalizada.\n")
+            else:
+                rc = proc.returncode
+        except Exception as e:
+            rc = -1
+            f.write("\n### ERRO ao iniciar/executar:\n" + "".join(traceback.format_exception(e)))
+
+    return rc, time.time() - start, str(log_file)
+
+
+# ======================================================================================
+#  Supervisor dos processos em segundo plano (spawn)
+# ======================================================================================
+
+SPAWN_POLL_SEC = float(os.getenv("AGENDADOR_SPAWN_POLL_SEC", "1"))
+SPAWN_RESTART_BASE_SEC = int(os.getenv("AGENDADOR_SPAWN_RESTART_BASE_SEC", "5"))
+SPAWN_RESTART_MAX_SEC = int(os.getenv("AGENDADOR_SPAWN_RESTART_MAX_SEC", "300"))
+SPAWN_STABLE_SEC = 60  # rodou pelo menos isso: o backoff volta ao início
+
+# task["restart"]: quando reiniciar um processo spawn que terminou
+RESTART_POLICIES = ("never", "on_failure", "always")
+
+
+class SpawnSupervisor:
+    """
+    Acompanha os processos iniciados em modo spawn: quando um termina, o RC e o
+    tempo real vão para `on_exit` (histórico/notificação) e, conforme
+    task["restart"], ele é reiniciado com backoff exponencial.
+    `resolve(nome)` devolve (tarefa, settings) atuais, ou None se a tarefa sumiu.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = {}     # nome -> {"proc", "pid", "task", "settings", "log", "start", "tracker"}
+        self._restarts = {}  # nome -> {"count", "next_at", "timer", "last_rc"}
+        self._thread = None
+        self.on_exit = None
+        self.resolve = None
+
+    def track(self, task, settings, proc, log_path, start, tracker=None):
+        name = task["name"]
+        with self._lock:
+            self._procs[name] = {"proc": proc, "pid": proc.pid, "task": task, "settings": settings,
+                                 "log": str(log_path), "start": start, "tracker": tracker}
+            st = self._restarts.get(name)
+            if st and st.get("timer"):
+                st["timer"].cancel()  # subiu por outro caminho (agenda/Executar agora)
+                st["timer"] = st["next_at"] = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="spawn-supervisor")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(SPAWN_POLL_SEC)
+            with self._lock:
+                items = list(self._procs.items())
+            for name, entry in items:
+                rc = entry["proc"].poll()
+                if rc is None:
+                    continue
+                with self._lock:
+                    if self._procs.get(name) is entry:
+                        del self._procs[name]
+                try:
+                    self._exited(name, entry, rc)
+                except Exception as e:
+                    print(f"Erro no supervisor [{name}]:", e)
+
+    def _exited(self, name, entry, rc):
+        dur = time.time() - entry["start"]
+        pidfile = PID_DIR / (_safe_name(name) + ".pid")
+        if _read_pidfile(pidfile)[0] == entry["pid"]:
+            try: pidfile.unlink(missing_ok=True)
+            except Exception: pass
+        try:
+            with open(entry["log"], "a", encoding="utf-8", errors="ignore") as f:
+                f.write(f"\n### Processo terminou @ {now_str()}: RC={rc}, duração {dur:.1f}s\n")
+        except Exception:
+            pass
+        usage = resource_sampler().stop(entry.get("tracker"))
+        if self.on_exit:
+            self.on_exit(entry["task"], rc, dur, entry["log"], usage)
+        self._schedule_restart(name, entry, rc, dur)
+
+    def _current(self, name, entry):
+        if self.resolve:
+            return self.resolve(name)
+        return entry["task"], entry["settings"]
+
+    def _schedule_restart(self, name, entry, rc, dur):
+        cur = self._current(name, entry)
+        task = cur[0] if cur else None
+        policy = (task or {}).get("restart") or "never"
+        if (task is None or not task.get("spawn") or policy not in RESTART_POLICIES or policy == "never"
+                or (policy == "on_failure" and rc == 0)):
+            with self._lock:
+                self._restarts.pop(name, None)
+            return
+        with self._lock:
+            st = self._restarts.setdefault(name, {"count": 0, "next_at": None, "timer": None, "last_rc": None})
+            if dur >= SPAWN_STABLE_SEC:
+                st["count"] = 0
+            delay = min(SPAWN_RESTART_MAX_SEC, SPAWN_RESTART_BASE_SEC * 2 ** st["count"])
+            st["count"] += 1
+            st["last_rc"] = rc
+            st["next_at"] = time.time() + delay
+            st["timer"] = threading.Timer(delay, self._restart, args=(name, entry))
+            st["timer"].daemon = True
+            st["timer"].start()
+
+    def _restart(self, name, entry):
+        with self._lock:
+            st = self._restarts.get(name)
+            if st:
+                st["timer"] = st["next_at"] = None
+        cur = self._current(name, entry)
+        if not cur:
+            return
+        task, settings = cur
+        rc, dur, log_path = run_task(task, settings)  # subiu: volta para track()
+        if rc is not None:
+            # nem chegou a iniciar: registra e tenta de novo (com backoff)
+            if self.on_exit:
+                self.on_exit(task, rc, dur, log_path)
+            self._schedule_restart(name, {**entry, "task": task, "settings": settings}, rc, dur)
+
+    def status(self):
+        """{nome: {"state": "running"|"restarting", pid/uptime ou in/last_rc, "restarts"}}"""
+        now = time.time()
+        out = {}
+        with self._lock:
+            for name, e in self._procs.items():
+                out[name] = {"state": "running", "pid": e["pid"], "uptime": now - e["start"],
+                             "restarts": self._restarts.get(name, {}).get("count", 0)}
+            for name, st in self._restarts.items():
+                if name not in out and st.get("next_at"):
+                    out[name] = {"state": "restarting", "in": max(0.0, st["next_at"] - now),
+                                 "last_rc": st["last_rc"], "restarts": st["count"]}
+        return out
+
+    def shutdown(self):
+        """Cancela reinícios pendentes; os processos continuam rodando (são independentes)."""
+        with self._lock:
+            for st in self._restarts.values():
+                if st.get("timer"):
+                    st["timer"].cancel()
+            self._restarts.clear()
+
+
+_spawn_supervisor = SpawnSupervisor()
+
+def spawn_supervisor() -> SpawnSupervisor:
+    return _spawn_supervisor
+
+def format_spawn_status(status) -> str:
+    """Texto curto para a barra de status: 'spawn 3 rodando · bot reinicia em 20s (RC=1)'."""
+    if not status:
+        return ""
+    running = sum(1 for st in status.values() if st["state"] == "running")
+    parts = [f"spawn {running} rodando"]
+    for name, st in sorted(status.items()):
+        if st["state"] == "restarting":
+            parts.append(f"{name} reinicia em {st['in']:.0f}s (RC={st['last_rc']})")
+    return " · ".join(parts)
+
+
+def parse_times(text: str):
+    """
+    Converte '13:30, 14:16;18:00' -> ['13:30','14:16','18:00'].
+    Aceita separadores: vírgula, ponto e vírgula ou espaços.
+    """
+    parts = [p for p in re.split(r"[,\s;]+", text.strip()) if p]
+    out = []
+    for p in parts:
+        h, m = p.split(":")
+        h = int(h); m = int(m)
+        assert 0 <= h <= 23 and 0 <= m <= 59
+        norm = f"{h:02d}:{m:02d}"
+        if norm not in out:
+            out.append(norm)
+    return out or ["06:00"]
+
+
+# ======================================================================================
+#  Runner assíncrono (um event loop para todos os filhos)
+# ======================================================================================
+
+async def run_task_async(task, settings, usage=None):
+    """
+    Equivalente ao run_task (modo tradicional) em asyncio: sem thread por tarefa.
+    Retorna (rc, dur, log_path). Tarefas spawn continuam no run_task (rc=None, ver SpawnSupervisor),
+    assim como as pré-aquecidas (o worker já é um Popen do WarmPool) e as que vão em lote Pentaho.
+    """
+    if task.get("spawn") or warm_eligible(task) or pdi_batch_eligible(task, settings):
+        return await asyncio.to_thread(run_task, task, settings, None, usage)
+
+    ensure_dirs()
+    name = task["name"]
+    log_file = _new_log_file(name)
+    cmd = build_command(task, settings.get("pdi_home", r"C:\Pentaho\data-integration"))
+    workdir = task.get("working_dir") or str(Path(task["path"]).parent)
+    timeout = int(task.get("timeout", "0") or 0) or None
+
+    start = time.time()
+    deadline = start + timeout if timeout else None  # um prazo só: espera e kill contam contra ele
+    with open(log_file, "w", encoding="utf-8", errors="ignore") as f:
+        f.write(f"# {name} @ {now_str()}\nCMD: {' '.join(cmd)}\n\n")
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, cwd=workdir, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                env=_task_env(task), start_new_session=(os.name != "nt"),
+            )
+        except Exception as e:
+            f.write("\n### ERRO ao iniciar/executar:\n" + "".join(traceback.format_exception(e)))
+            return -1, time.time() - start, str(log_file)
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        tracker = resource_sampler().start(proc.pid)
+
+        async def _pump():
+            while True:
+                chunk = await proc.stdout.read(1 << 16)
+                if not chunk:
+                    break
+                f.write(decoder.decode(chunk))
+            await proc.wait()
+
+        end = None
+        try:
+            await asyncio.wait_for(_pump(), None if deadline is None else max(0.0, deadline - time.time()))
+            rc = proc.returncode
+        except asyncio.TimeoutError:
+            end = time.time()  # o prazo acabou aqui; a limpeza da árvore não entra na duração
+            rc = -9
+            # taskkill/wait_procs podem levar segundos: a árvore morre em segundo plano e
+            # aqui só se espera o processo principal sair (ou desiste após 5s)
+            killer = asyncio.get_running_loop().run_in_executor(None, kill_process_tree, proc.pid)
+            try:
+                await asyncio.wait_for(proc.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+            killer.add_done_callback(lambda fut: fut.exception())  # sem "exception never retrieved"
+            f.write(f"\n### TIMEOUT atingido ({timeout}s): árvore de processos finalizada.\n")
+        except Exception as e:
+            rc = -1
+            f.write("\n### ERRO ao iniciar/executar:\n" + "".join(traceback.format_exception(e)))
+        f.write(decoder.decode(b"", final=True))
+        measured = resource_sampler().stop(tracker)
+        if usage is not None:
+            usage.update(measured)
+
+    return rc, (end or time.time()) - start, str(log_file)
+
+
+class AsyncRunner:
+    """
+    Supervisiona centenas de filhos a partir de um único event loop (thread própria).
+    `submit` devolve um concurrent.futures.Future com (rc, dur, log_path), como o run_task.
+    """
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+        self._sems = {}   # pool -> (limite, asyncio.Semaphore)
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-runner", daemon=True).start()
+            return self._loop
+
+    def _semaphore(self, pool, limit):
+        # só chamado dentro do loop; limite novo -> semáforo novo (quem já segura o antigo termina nele)
+        cur = self._sems.get(pool)
+        if cur is None or cur[0] != limit:
+            cur = (limit, asyncio.Semaphore(limit))
+            self._sems[pool] = cur
+        return cur[1]
+
+    async def _run(self, task, settings, pool, limit, on_start, usage):
+        if pool and limit:
+            async with self._semaphore(pool, limit):
+                if on_start:
+                    on_start()
+                return await run_task_async(task, settings, usage)
+        if on_start:
+            on_start()
+        return await run_task_async(task, settings, usage)
+
+    def submit(self, task, settings, pool=None, limit=None, on_start=None, usage=None):
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(task, settings, pool, limit, on_start, usage), loop)
+
+    def run(self, task, settings):
+        return self.submit(task, settings).result()
+
+    def stop(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+
+def use_async_runner(settings) -> bool:
+    return (settings or {}).get("runner", "thread") == "async"
+
+# ======================================================================================
+#  Pools de execução (concorrência por categoria)
+# ======================================================================================
+
+def executor_settings(settings):
+    """Retorna {"pools": {nome: threads}, "classes": {".ext": pool}} com defaults aplicados."""
+    ex = (settings or {}).get("executors") or {}
+    pools = dict(DEFAULT_POOLS)
+    for name, size in (ex.get("pools") or {}).items():
+        try:
+            pools[str(name).strip()] = max(1, int(size))
+        except Exception:
+            pass
+    classes = dict(DEFAULT_POOL_CLASSES)
+    classes.update({str(k).strip().lower(): str(v).strip() for k, v in (ex.get("classes") or {}).items()})
+    return {"pools": pools, "classes": {k: v for k, v in classes.items() if v in pools}}
+
+def task_pool(task, settings):
+    """Pool em que a tarefa roda: task["pool"] explícito > classe da extensão > "default"."""
+    cfg = executor_settings(settings)
+    pool = (task.get("pool") or "").strip()
+    if pool in cfg["pools"]:
+        return pool
+    return cfg["classes"].get(Path(task.get("path", "")).suffix.lower(), "default")
+
+
+class PoolStats:
+    """Contadores por pool: jobs na fila, rodando e tempo de espera na fila (thread-safe)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queued = {}      # pool -> lista de timestamps de submissão (FIFO, como o pool)
+        self._running = {}
+        self._sizes = {}
+        self._last_wait = {}
+        self._max_wait = {}
+
+    def set_size(self, pool, size):
+        with self._lock:
+            self._sizes[pool] = size
+
+    def enqueue(self, pool):
+        with self._lock:
+            self._queued.setdefault(pool, []).append(time.time())
+
+    def start(self, pool) -> float:
+        """Chamado no início do job; retorna quanto tempo ele esperou na fila."""
+        with self._lock:
+            q = self._queued.get(pool) or []
+            wait = (time.time() - q.pop(0)) if q else 0.0
+            self._running[pool] = self._running.get(pool, 0) + 1
+            self._last_wait[pool] = wait
+            self._max_wait[pool] = max(wait, self._max_wait.get(pool, 0.0))
+            return wait
+
+    def drop(self, pool):
+        """Job saiu da fila sem rodar (perdeu o misfire_grace_time)."""
+        with self._lock:
+            q = self._queued.get(pool) or []
+            if q:
+                q.pop(0)
+
+    def finish(self, pool):
+        with self._lock:
+            self._running[pool] = max(0, self._running.get(pool, 0) - 1)
+
+    def snapshot(self):
+        """{pool: {"size", "queued", "running", "last_wait", "max_wait"}}"""
+        with self._lock:
+            out = {}
+            for pool in sorted(set(self._sizes) | set(self._queued) | set(self._running)):
+                q = self._queued.get(pool) or []
+                out[pool] = {
+                    "size": self._sizes.get(pool, 0),
+                    "queued": len(q),
+                    "running": self._running.get(pool, 0),
+                    # espera do mais antigo ainda na fila, ou do último que começou
+                    "last_wait": (time.time() - q[0]) if q else self._last_wait.get(pool, 0.0),
+                    "max_wait": self._max_wait.get(pool, 0.0),
+                }
+            return out
+
+
+AFTER_JOB_SUFFIX = "::after"  # job de etapa seguinte do fluxo (DagTracker), sem horário previsto
+
+class DispatchStats:
+    """
+    Horário previsto x início real de cada job, e disparos que não viraram execução:
+    pulados (max_instances: a anterior ainda rodava), agrupados (coalesce: vários
+    horários vencidos de uma vez) e perdidos (passaram do misfire_grace_time).
+    O executor chama `submitted`; o job, `start`; os eventos do APScheduler, `on_event`.
+    Jobs "<tarefa>::after" ficam de fora: são disparados pelo fim da etapa anterior,
+    não por um horário, e contariam como atraso/disparo agendado o que é só dependência.
+    """
+    def __init__(self, record=None):
+        self._lock = threading.Lock()
+        self._pending = {}     # job_id -> (horário previsto, submetido) — max_instances=1: um por job
+        self._last_fire = {}   # job_id -> último horário previsto visto (datetime), para contar agrupados
+        self.record = record   # (tarefa, kind, n) -> grava no histórico
+
+    def submitted(self, job_id, run_times):
+        if job_id.endswith(AFTER_JOB_SUFFIX):
+            return
+        with self._lock:
+            self._pending[job_id] = (run_times[-1].timestamp(), time.time())
+
+    def start(self, job_id, pool=None) -> dict:
+        """{"scheduled", "started", "queue_wait"} do disparo que está começando ({} se manual)."""
+        now = time.time()
+        with self._lock:
+            entry = self._pending.pop(job_id, None)
+        if entry is None:
+            return {}
+        scheduled, submitted = entry
+        metrics().observe("agendador_dispatch_lag_seconds", max(0.0, now - scheduled), {"pool": pool or ""})
+        return {"scheduled": scheduled, "started": now, "queue_wait": max(0.0, now - submitted)}
+
+    def skip(self, job_id, task_name):
+        """Runner assíncrono: o disparo chegou com a execução anterior ainda rodando."""
+        with self._lock:
+            self._pending.pop(job_id, None)
+        if job_id and job_id.endswith(AFTER_JOB_SUFFIX):
+            return
+        self._count(task_name, "skipped", 1)
+
+    def forget(self, job_id):
+        with self._lock:
+            self._pending.pop(job_id, None)
+            self._last_fire.pop(job_id, None)
+
+    def on_event(self, event, job, task_name):
+        if event.job_id.endswith(AFTER_JOB_SUFFIX):
+            return
+        if event.code == EVENT_JOB_MISSED:
+            with self._lock:
+                self._pending.pop(event.job_id, None)
+            self._count(task_name, "missed", 1)
+            return
+        fire = event.scheduled_run_times[-1]
+        coalesced = self._coalesced(event.job_id, job.trigger if job else None, fire)
+        if coalesced:
+            self._count(task_name, "coalesced", coalesced)
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            self._count(task_name, "skipped", 1)
+
+    def _coalesced(self, job_id, trigger, fire):
+        """Horários do trigger entre o último disparo visto e este: o APScheduler juntou num só."""
+        with self._lock:
+            prev = self._last_fire.get(job_id)
+            self._last_fire[job_id] = fire
+        if prev is None or trigger is None:
+            return 0
+        n, t = 0, trigger.get_next_fire_time(prev, prev)
+        while t is not None and prev < t < fire and n < 10000:
+            n += 1
+            prev, t = t, trigger.get_next_fire_time(t, t)
+        return n
+
+    def _count(self, task_name, kind, n):
+        metrics().inc("agendador_dispatch_dropped_total", {"task": task_name, "kind": kind}, n)
+        if self.record:
+            try:
+                self.record(task_name, kind, n)
+            except Exception as e:
+                print("Erro ao registrar disparo:", e)
+
+
+class _CountingThreadPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor do APScheduler que registra a submissão no PoolStats/DispatchStats."""
+    def __init__(self, name, size, stats, dispatch=None):
+        super().__init__(max_workers=size)
+        self._pool_name = name
+        self._stats = stats
+        self._dispatch = dispatch
+
+    def _do_submit_job(self, job, run_times):
+        if not job.id.startswith("__"):  # jobs internos (__history__) não passam por PoolStats.start
+            self._stats.enqueue(self._pool_name)
+            if self._dispatch:
+                self._dispatch.submitted(job.id, run_times)
+        super()._do_submit_job(job, run_times)
+
+    def _run_job_success(self, job_id, events):
+        if any(ev.code == EVENT_JOB_MISSED for ev in events):
+            self._stats.drop(self._pool_name)
+        super()._run_job_success(job_id, events)
+
+
+def format_pool_stats(snapshot) -> str:
+    """Texto curto para a barra de status: 'pentaho 2/2 +3 (espera 41s)'."""
+    parts = []
+    for pool, st in snapshot.items():
+        txt = f"{pool} {st['running']}/{st['size']}"
+        if st["queued"]:
+            txt += f" +{st['queued']} (espera {st['last_wait']:.0f}s)"
+        parts.append(txt)
+    return " · ".join(parts)
+
+# ======================================================================================
+#  Métricas (formato texto do Prometheus, opcional)
+# ======================================================================================
+
+METRICS_BIND = os.getenv("AGENDADOR_METRICS_BIND", "127.0.0.1")
+# limites dos baldes (s): de 5 ms (gravação do config) a 6 h (ETL longo)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                   120, 300, 600, 1800, 3600, 10800, 21600)
+METRICS_HELP = {
+    "agendador_runs_total": ("counter", "Execuções registradas no histórico."),
+    "agendador_run_failures_total": ("counter", "Execuções com RC diferente de 0."),
+    "agendador_run_duration_seconds": ("histogram", "Duração das execuções."),
+    "agendador_dispatch_lag_seconds": ("histogram", "Atraso entre o horário previsto e o início do job."),
+    "agendador_dispatch_dropped_total": ("counter", "Disparos que não viraram execução (skipped/coalesced/missed)."),
+    "agendador_notify_seconds": ("histogram", "Tempo de envio das notificações, por canal."),
+    "agendador_config_write_seconds": ("histogram", "Tempo de gravação do config.json."),
+    "agendador_jobs_running": ("gauge", "Jobs rodando agora (pools + spawn)."),
+    "agendador_executor_queue_depth": ("gauge", "Jobs aguardando thread livre, por pool."),
+    "agendador_update_queue_length": ("gauge", "Itens na fila de atualizações da GUI."),
+    "agendador_outbox_pending": ("gauge", "Notificações aguardando reenvio no outbox."),
+}
+
+
+def _metric_labels(labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """
+    Contadores e histogramas em memória. `inc`/`observe` são só um lock e uma soma;
+    o texto (e os gauges, via funções registradas) só é montado quando alguém lê /metrics.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}    # (nome, labels) -> valor
+        self._hists = {}       # (nome, labels) -> [contagem por balde..., +Inf, soma]
+        self._gauges = {}      # nome -> função () -> número | {labels(dict ou tupla): número}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(self.buckets) + 2)
+            h[i] += 1
+            h[-1] += value
+
+    def gauge(self, name, fn):
+        """Registra (ou troca) a função que calcula o gauge na hora da leitura."""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: list(v) for k, v in self._hists.items()}
+            gauges = dict(self._gauges)
+        series = {}
+        for (name, labels), v in counters.items():
+            series.setdefault(name, []).append(f"{name}{_metric_labels(labels)} {v:g}")
+        for (name, labels), h in hists.items():
+            lines = series.setdefault(name, [])
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), h):
+                acc += c
+                lines.append(f"{name}_bucket{_metric_labels(labels + (('le', le),))} {acc}")
+            lines.append(f"{name}_sum{_metric_labels(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{_metric_labels(labels)} {acc}")
+        for name, fn in gauges.items():
+            try:
+                val = fn()
+            except Exception:
+                continue
+            values = val.items() if isinstance(val, dict) else [((), val)]
+            series[name] = [
+                f"{name}{_metric_labels(sorted(lb.items()) if isinstance(lb, dict) else lb)} {v:g}"
+                for lb, v in values
+            ]
+        out = []
+        for name in sorted(series):
+            kind, text = METRICS_HELP.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+
+_metrics = Metrics()
+
+def metrics() -> Metrics:
+    return _metrics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # sem uma linha no console por scrape
+
+
+class MetricsServer:
+    """Endpoint HTTP /metrics numa thread própria; (re)configurado por settings["metrics"]."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._server = None
+        self._port = None
+        self.error = None
+
+    def configure(self, settings):
+        cfg = metrics_settings(settings)
+        port = cfg["port"] if cfg["enabled"] else None
+        with self._lock:
+            if port == self._port and (self._server or port is None):
+                return
+            self._stop_locked()
+            self.error = None
+            if port is None:
+                return
+            try:
+                self._server = ThreadingHTTPServer((METRICS_BIND, port), _MetricsHandler)
+            except OSError as e:
+                # ex.: GUI e daemon na mesma máquina; quem chegou primeiro fica com a porta
+                self.error = f"porta {port}: {e}"
+                print("Métricas desativadas:", self.error)
+                return
+            self._server.daemon_threads = True
+            self._port = port
+            threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+
+    def _stop_locked(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._server = self._port = None
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+
+    @property
+    def address(self):
+        return f"http://{METRICS_BIND}:{self._port}/metrics" if self._server else None
+
+
+def metrics_settings(settings) -> dict:
+    cfg = (settings or {}).get("metrics") or {}
+    try:
+        port = int(cfg.get("port") or 9464)
+    except (TypeError, ValueError):
+        port = 9464
+    return {"enabled": bool(cfg.get("enabled", False)), "port": port}
+
+
+_metrics_server = MetricsServer()
+
+def metrics_server() -> MetricsServer:
+    return _metrics_server
+
+# ======================================================================================
+#  Motor de agendamento (headless)
+# ======================================================================================
+
+# quem hospeda o motor (GUI ou --daemon): um só por máquina, senão cada job roda duas vezes
+ENGINE_PIDFILE = PID_DIR / "engine.pid"
+DAEMON_RELOAD_SEC = int(os.getenv("AGENDADOR_DAEMON_RELOAD_SEC", "5"))
+
+MISFIRE_GRACE_SEC = int(os.getenv("AGENDADOR_MISFIRE_GRACE_SEC", "600"))
+
+DOWS = ["mon","tue","wed","thu","fri","sat","sun"]
+
+# âncora fixa (segunda-feira 00:00, hora local) dos intervalos: o mesmo N gera os mesmos
+# horários a cada reinício, e N que divide a hora/dia cai nos mesmos minutos do cron "*/N"
+INTERVAL_EPOCH = datetime(2024, 1, 1)
+
+
+def stagger_settings(settings):
+    """{"enabled": espalha intervalos por tarefa, "jitter_sec": atraso aleatório extra (0 = nenhum)}"""
+    st = (settings or {}).get("stagger") or {}
+    try:
+        jitter = max(0, int(st.get("jitter_sec", 0)))
+    except Exception:
+        jitter = 0
+    return {"enabled": bool(st.get("enabled", False)), "jitter_sec": jitter}
+
+
+def stagger_offset(name, period_sec):
+    """Deslocamento determinístico (0..período) derivado do nome da tarefa."""
+    h = int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:8], 16)
+    return h % max(1, int(period_sec))
+
+
+class DaysIntervalTrigger(IntervalTrigger):
+    """IntervalTrigger que só dispara nos dias da semana marcados (0 = segunda)."""
+    def __init__(self, weekdays, **kwargs):
+        super().__init__(**kwargs)
+        self.weekdays = frozenset(weekdays)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        # sempre a partir da grade (start_date + k*intervalo): com jitter, somar o
+        # intervalo ao disparo anterior faria o horário andar a cada execução
+        if previous_fire_time is not None:
+            now = previous_fire_time + timedelta(microseconds=1)
+        nxt = super().get_next_fire_time(None, now)
+        for _ in range(8):
+            if nxt is None or nxt.weekday() in self.weekdays:
+                return nxt
+            # pula para o começo do dia seguinte e pega o próximo disparo da grade
+            day = (nxt + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            nxt = super().get_next_fire_time(None, day)
+        return nxt
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["weekdays"] = sorted(self.weekdays)
+        return state
+
+    def __setstate__(self, state):
+        weekdays = state.pop("weekdays", range(7))
+        super().__setstate__(state)
+        self.weekdays = frozenset(weekdays)
+
+    def __str__(self):
+        return f"{super().__str__()} dias={sorted(self.weekdays)}"
+
+
+def schedule_fingerprint(task, pool, stagger=None):
+    """Identidade do agendamento de uma tarefa: se não mudou, os jobs dela ficam como estão."""
+    stype = (task.get("schedule_type") or "cron").lower()
+    return (
+        stype,
+        str(task.get("every_value") or ""),
+        task.get("every_unit") or "minutes",
+        tuple(task.get("times") or [task.get("time", "06:00")]),
+        tuple(bool(v) for v in task.get("days", [True] * 7)),
+        pool,
+        tuple(sorted((stagger or {}).items())) if stype == "interval" else (),
+    )
+
+
+# ======================================================================================
+#  Dependências entre tarefas (fluxos / DAG)
+# ======================================================================================
+
+DEP_MODES = ("success", "completion")
+DAG_STATE_LABELS = {
+    "idle": "—", "waiting": "aguardando", "queued": "na fila", "running": "rodando",
+    "ok": "ok", "failed": "falhou", "blocked": "bloqueada",
+}
+
+
+def task_deps(task):
+    """[(anterior, "success"|"completion")] de task["after"] (aceita também só o nome)."""
+    out = []
+    for d in task.get("after") or []:
+        if isinstance(d, str):
+            d = {"task": d}
+        name = str(d.get("task") or "").strip()
+        if name and name != task.get("name"):
+            out.append((name, d.get("on") if d.get("on") in DEP_MODES else "success"))
+    return out
+
+
+def dependency_cycle(tasks):
+    """Primeiro ciclo de dependências encontrado, na ordem do fluxo (ex.: [a, b, a]), ou None."""
+    ups = {t["name"]: [u for u, _ in task_deps(t)] for t in tasks}
+    state = {}  # 1 = no caminho atual, 2 = já visitado
+    for start in ups:
+        if state.get(start):
+            continue
+        path, its = [start], [iter(ups[start])]
+        state[start] = 1
+        while its:
+            nxt = next(its[-1], None)
+            if nxt is None:
+                state[path.pop()] = 2
+                its.pop()
+            elif nxt in ups and state.get(nxt) == 1:
+                return list(reversed(path[path.index(nxt):] + [nxt]))
+            elif nxt in ups and not state.get(nxt):
+                state[nxt] = 1
+                path.append(nxt)
+                its.append(iter(ups[nxt]))
+    return None
+
+
+class DagTracker:
+    """
+    Encadeamento de tarefas (task["after"]). Quando uma tarefa termina, as seguintes
+    cujas anteriores já terminaram todas (join) disparam na hora, se o resultado
+    exigido foi atendido ("success" = RC 0, "completion" = qualquer RC); senão ficam
+    "bloqueada" nesta rodada, assim como tudo abaixo delas. Ramos independentes
+    disparam juntos e rodam em paralelo até o limite de cada pool.
+    """
+    def __init__(self, trigger=None):
+        self.trigger = trigger  # fn(nome): dispara a tarefa agora
+        self._lock = threading.Lock()
+        self._ups = {}       # nome -> [(anterior, modo)]
+        self._downs = {}     # nome -> [seguintes]
+        self._results = {}   # seguinte -> {anterior: rc (None = bloqueada)} da rodada atual
+        self._state = {}     # nome -> (estado, rc, ts)
+
+    def update(self, tasks):
+        names = {t["name"] for t in tasks}
+        ups = {}
+        for t in tasks:
+            deps = [(u, m) for u, m in task_deps(t) if u in names]
+            if deps:
+                ups[t["name"]] = deps
+        cycle = dependency_cycle(tasks)
+        if cycle:
+            # a GUI não deixa salvar um ciclo; se vier do config.json, ignora as dependências dele
+            print("Dependências em ciclo ignoradas:", " -> ".join(cycle))
+            for n in cycle:
+                ups.pop(n, None)
+        downs = {}
+        for n, deps in ups.items():
+            for u, _ in deps:
+                downs.setdefault(u, []).append(n)
+        with self._lock:
+            self._ups, self._downs = ups, downs
+            self._results = {
+                n: {u: rc for u, rc in got.items() if any(u == x for x, _ in ups[n])}
+                for n, got in self._results.items() if n in ups
+            }
+            self._state = {n: st for n, st in self._state.items() if n in names}
+
+    @property
+    def active(self) -> bool:
+        return bool(self._ups)
+
+    def upstream(self, name):
+        with self._lock:
+            return list(self._ups.get(name, []))
+
+    def _descendants(self, name):
+        seen, stack = set(), list(self._downs.get(name, []))
+        while stack:
+            n = stack.pop()
+            if n not in seen:
+                seen.add(n)
+                stack.extend(self._downs.get(n, []))
+        return seen
+
+    def started(self, name):
+        with self._lock:
+            self._state[name] = ("running", None, time.time())
+            if name not in self._ups:
+                # raiz: começa uma rodada nova para tudo o que depende dela
+                for d in self._descendants(name):
+                    self._state[d] = ("waiting", None, time.time())
+
+    def finished(self, name, rc):
+        """Registra o fim de `name` e dispara as seguintes liberadas; devolve os nomes disparados."""
+        fire = []
+        with self._lock:
+            self._state[name] = ("ok" if rc == 0 else "failed", rc, time.time())
+            self._release(name, rc, fire)
+        for d in fire:
+            try:
+                if self.trigger:
+                    self.trigger(d)
+            except Exception as e:
+                print(f"Erro ao disparar '{d}' após '{name}':", e)
+        return fire
+
+    def _release(self, name, rc, fire):
+        for d in self._downs.get(name, []):
+            got = self._results.setdefault(d, {})
+            got[name] = rc
+            deps = self._ups.get(d, [])
+            if any(u not in got for u, _ in deps):
+                continue  # join: ainda falta alguma anterior
+            del self._results[d]
+            if all(got[u] is not None and (mode == "completion" or got[u] == 0) for u, mode in deps):
+                self._state[d] = ("queued", None, time.time())
+                fire.append(d)
+            else:
+                self._state[d] = ("blocked", None, time.time())
+                self._release(d, None, fire)
+
+    def describe(self, name) -> str:
+        """Texto da coluna "Fluxo": estado da etapa ou, na raiz, o resumo do fluxo inteiro."""
+        with self._lock:
+            if name in self._ups:
+                st, rc, _ = self._state.get(name, ("idle", None, 0))
+                label = DAG_STATE_LABELS[st]
+                return f"{label} (RC={rc})" if st == "failed" and rc is not None else label
+            if name not in self._downs:
+                return ""
+            nodes = [name] + list(self._descendants(name))
+            counts = Counter(self._state.get(n, ("idle",))[0] for n in nodes)
+        parts = [f"{counts[k]} {DAG_STATE_LABELS[k]}"
+                 for k in ("ok", "running", "queued", "waiting", "failed", "blocked") if counts[k]]
+        return f"fluxo {len(nodes)} etapas" + (": " + " · ".join(parts) if parts else "")
+
+
+class SchedulerEngine:
+    """
+    Agenda e executa as tarefas de `data["tasks"]` (mesmo dicionário do config.json).
+    Não depende de Tk: a GUI só registra `on_run_done` para redesenhar o gráfico.
+    """
+    def __init__(self, data, on_run_done=None):
+        self.data = data
+        self.on_run_done = on_run_done
+        # Deixa explícito (1 instância por job, coalesce). A tolerância de atraso
+        # cobre o tempo na fila do pool: sem ela, jobs que esperam > 1s são descartados.
+        self.scheduler = BackgroundScheduler(job_defaults={
+            "max_instances": 1, "coalesce": True, "misfire_grace_time": MISFIRE_GRACE_SEC,
+        })
+        self.jobs = {}
+        self._fingerprints = {}  # nome -> schedule_fingerprint() do que está agendado
+        self.alerts = AlertPolicy()
+        self.spawns = spawn_supervisor()
+        self.spawns.on_exit = self._finish_run
+        self.spawns.resolve = self._current_task
+        self.pool_stats = PoolStats()
+        self.dag = DagTracker(trigger=self._run_downstream)
+        self.dispatch = DispatchStats(record=lambda task, kind, n: history_store().note_dispatch(task, kind, n))
+        self.scheduler.add_listener(self._on_scheduler_event,
+                                    EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+        self._pool_sizes = {}
+        # runner asyncio (settings["runner"] == "async"): o job do APScheduler só
+        # submete e retorna; o pós-processamento (histórico/notificação) roda aqui
+        self.async_runner = AsyncRunner()
+        self._async_running = set()
+        self._async_lock = threading.Lock()
+        self._batch_ids = itertools.count(1)
+        self._finishers = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="finish")
+        m = metrics()
+        m.gauge("agendador_jobs_running", lambda: sum(
+            st["running"] for st in self.pool_stats.snapshot().values()) + sum(
+            1 for st in self.spawns.status().values() if st["state"] == "running"))
+        m.gauge("agendador_executor_queue_depth", lambda: {
+            (("pool", p),): st["queued"] for p, st in self.pool_stats.snapshot().items()})
+        m.gauge("agendador_update_queue_length", lambda: len(self.data.get("update_queue") or []))
+        m.gauge("agendador_outbox_pending", lambda: outbox().count())
+
+    def _sync_executors(self):
+        """Cria/redimensiona um executor do APScheduler por pool configurado."""
+        pools = executor_settings(self.data.get("settings", {}))["pools"]
+        for name in list(self._pool_sizes):
+            if name not in pools:
+                self.scheduler.remove_executor(name, shutdown=False)
+                del self._pool_sizes[name]
+        for name, size in pools.items():
+            if self._pool_sizes.get(name) == size:
+                continue
+            if name in self._pool_sizes:
+                # jobs em andamento terminam no pool antigo
+                self.scheduler.remove_executor(name, shutdown=False)
+            self.scheduler.add_executor(_CountingThreadPool(name, size, self.pool_stats, self.dispatch), alias=name)
+            self._pool_sizes[name] = size
+            self.pool_stats.set_size(name, size)
+
+    def _task_triggers(self, t, stagger):
+        """Lista [(job_id, trigger)] de uma tarefa; vazia se ela não tem agendamento válido."""
+        stype = (t.get("schedule_type") or "cron").lower()
+        if stype == "after":
+            return []  # só roda quando as anteriores terminam (DagTracker)
+
+        days = t.get("days", [True] * 7)
+        use_days = [DOWS[i] for i, v in enumerate(days) if v]
+        if not use_days:
+            return []
+
+        if stype == "interval":
+            # a cada N minutos/horas (respeitando dias marcados)
+            try:
+                val = int(str(t.get("every_value") or 0))
+            except Exception:
+                val = 0
+            if val <= 0:
+                return []
+            unit = (t.get("every_unit") or "minutes").lower()
+            minutes = unit == "minutes"
+            aligned = (60 % val == 0) if minutes else (24 % val == 0)
+
+            if aligned and not stagger["enabled"] and not stagger["jitter_sec"]:
+                # N divide a hora/dia: cron "*/N" (todas disparam juntas em :00, :15...)
+                if minutes:
+                    trig = CronTrigger(day_of_week=",".join(use_days), minute=f"*/{val}")
+                else:  # hours
+                    trig = CronTrigger(day_of_week=",".join(use_days), hour=f"*/{val}", minute=0)
+                return [(t["name"], trig)]
+
+            # intervalo de verdade (ex.: 7 ou 45 min, 5 h), opcionalmente deslocado por tarefa
+            period = val * (60 if minutes else 3600)
+            offset = stagger_offset(t["name"], period) if stagger["enabled"] else 0
+            # o jitter só atrasa: até meio período, para nunca empurrar um disparo além do seguinte
+            jitter = min(stagger["jitter_sec"], period // 2) or None
+            start = INTERVAL_EPOCH + timedelta(seconds=offset)
+            weekdays = [i for i, v in enumerate(days) if v]
+            trig = DaysIntervalTrigger(weekdays, seconds=period, start_date=start, jitter=jitter)
+            return [(t["name"], trig)]
+
+        # horário(s) fixo(s) nos dias marcados
+        # aceita lista "times" (novo) ou fallback para "time" único
+        times = t.get("times") or [t.get("time", "06:00")]
+        # normaliza por segurança
+        try:
+            times = parse_times(",".join(times) if isinstance(times, list) else str(times))
+        except Exception:
+            return []
+
+        # um trigger por horário
+        out = []
+        for idx, hhmm in enumerate(times):
+            hh, mm = map(int, hhmm.split(":"))
+            out.append((f"{t['name']}::{idx}", CronTrigger(day_of_week=",".join(use_days), hour=hh, minute=mm)))
+        return out
+
+    def reschedule_all(self):
+        """
+        Reconcilia os jobs do APScheduler com `data["tasks"]`.
+        Só mexe no que mudou: tarefa nova → add; agendamento/pool diferente → recria
+        os jobs dela; só a configuração mudou (args, timeout...) → `modify_job` com a
+        tarefa nova, mantendo o próximo disparo; tarefa sumiu → remove.
+        """
+        self._sync_executors()
+        notifier().attach(self.data["settings"])
+        metrics_server().configure(self.data["settings"])
+        warm_pool().configure(self.data["settings"],
+                              active=any(warm_eligible(t) for t in self.data.get("tasks", [])))
+        if not self.scheduler.get_job("__history__"):
+            self.scheduler.add_job(self._history_maintenance, IntervalTrigger(hours=1),
+                                   id="__history__", name="manutenção do histórico",
+                                   next_run_time=datetime.now())
+        settings = self.data.get("settings", {})
+        stagger = stagger_settings(settings)
+        self.dag.update(self.data.get("tasks", []))
+
+        seen = set()
+        for t in self.data.get("tasks", []):
+            name = t["name"]
+            seen.add(name)
+            pool = task_pool(t, settings)
+            fp = schedule_fingerprint(t, pool, stagger)
+            if self._fingerprints.get(name) == fp:
+                for jid in self.jobs.get(name, []):
+                    job = self.scheduler.get_job(jid)
+                    if job is not None and job.args[0] != t:
+                        self.scheduler.modify_job(jid, args=[t])
+                continue
+
+            self.remove_task_jobs(name)
+            job_ids = []
+            for jid, trig in self._task_triggers(t, stagger):
+                self.scheduler.add_job(self._job_wrapper, trigger=trig, id=jid, name=name,
+                                       args=[t], kwargs={"job_id": jid}, executor=pool)
+                job_ids.append(jid)
+            if job_ids:
+                self.jobs[name] = job_ids
+            self._fingerprints[name] = fp
+
+        for name in set(self.jobs) | set(self._fingerprints):
+            if name not in seen:
+                self.remove_task_jobs(name)
+
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def _history_maintenance(self):
+        cfg = history_settings(self.data.get("settings", {}))
+        try:
+            history_store().maintain(cfg["hot_days"], cfg["retention_days"])
+        except Exception as e:
+            print("Erro na manutenção do histórico:", e)
+
+    def remove_task_jobs(self, name):
+        """Remove TODOS os jobs agendados de uma tarefa (um por horário)."""
+        for jid in self.jobs.get(name, []):
+            try:
+                self.scheduler.remove_job(jid)
+            except Exception:
+                pass
+            self.dispatch.forget(jid)
+        self.jobs.pop(name, None)
+        self._fingerprints.pop(name, None)
+
+    def _on_scheduler_event(self, event):
+        if event.job_id.startswith("__"):
+            return
+        job = self.scheduler.get_job(event.job_id)
+        name = job.name if job else re.sub(r"::(\d+|after)$", "", event.job_id)
+        self.dispatch.on_event(event, job, name)
+
+    def _job_wrapper(self, task, job_id=None):
+        settings = self.data["settings"]
+        pool = task_pool(task, settings)
+        self.dag.started(task["name"])
+        if pdi_batch_eligible(task, settings):
+            self._submit_batch(task, pool, job_id)
+            return
+        if use_async_runner(settings) and not task.get("spawn"):
+            self._submit_async(task, pool, job_id)
+            return
+        dispatch = self.dispatch.start(job_id, pool)
+        self.pool_stats.start(pool)
+        usage = {}
+        try:
+            rc, dur, log_path = run_task(task, settings, usage=usage)
+        finally:
+            self.pool_stats.finish(pool)
+        self._finish_run(task, rc, dur, log_path, usage, dispatch)
+
+    def _submit_async(self, task, pool, job_id=None):
+        name = task["name"]
+        with self._async_lock:
+            if name in self._async_running:
+                # mesma regra do max_instances=1: a execução anterior ainda não terminou
+                self.pool_stats.drop(pool)
+                self.dispatch.skip(job_id, name)
+                print(f"{now_str()} [{name}] ainda em execução; disparo ignorado.")
+                return
+            self._async_running.add(name)
+        settings = self.data["settings"]
+        started = threading.Event()
+        usage, dispatch = {}, {}
+
+        def _on_start():
+            started.set()
+            dispatch.update(self.dispatch.start(job_id, pool))
+            self.pool_stats.start(pool)
+
+        def _done(fut):
+            if started.is_set():
+                self.pool_stats.finish(pool)
+            else:
+                self.pool_stats.drop(pool)
+            with self._async_lock:
+                self._async_running.discard(name)
+            try:
+                rc, dur, log_path = fut.result()
+            except Exception as e:
+                print(f"Erro no runner assíncrono [{name}]:", e)
+                rc, dur, log_path = -1, 0.0, ""
+            self._finish_run(task, rc, dur, log_path, usage, dispatch)
+
+        limit = executor_settings(settings)["pools"].get(pool)
+        fut = self.async_runner.submit(task, settings, pool=pool, limit=limit, on_start=_on_start, usage=usage)
+        fut.add_done_callback(lambda f: self._finishers.submit(_done, f))
+
+    def _submit_batch(self, task, pool, job_id=None):
+        """Lote Pentaho: o disparo entra no lote e já libera a thread; quem ocupa o pool é o lote."""
+        name = task["name"]
+        with self._async_lock:
+            if name in self._async_running:
+                self.pool_stats.drop(pool)
+                self.dispatch.skip(job_id, name)
+                print(f"{now_str()} [{name}] ainda em execução; disparo ignorado.")
+                return
+            self._async_running.add(name)
+        self.pool_stats.drop(pool)  # este job sai da fila sem ocupar thread
+        dispatch = {}
+
+        def _on_start():
+            dispatch.update(self.dispatch.start(job_id, pool))
+
+        def _done(rc, dur, log_path, usage):
+            with self._async_lock:
+                self._async_running.discard(name)
+            self._finishers.submit(self._finish_run, task, rc, dur, log_path, usage, dispatch)
+
+        pdi_batcher().submit(task, self.data["settings"], _done, on_start=_on_start,
+                             launch=lambda fn: self._launch_batch(pool, fn))
+
+    def _launch_batch(self, pool, fn):
+        """Um lote = um job no pool (uma vaga, uma JVM), com fila/espera contadas como as outras."""
+        self.pool_stats.enqueue(pool)
+
+        def _job():
+            self.pool_stats.start(pool)
+            try:
+                fn()
+            finally:
+                self.pool_stats.finish(pool)
+        self.scheduler.add_job(_job, id=f"__pdi_batch_{next(self._batch_ids)}", name="lote Pentaho",
+                               executor=pool, misfire_grace_time=None)
+
+    def _run_downstream(self, name):
+        """Dispara agora uma etapa seguinte do fluxo, no pool dela (respeita o limite de threads)."""
+        cur = self._current_task(name)
+        if not cur:
+            return
+        task, settings = cur
+        jid = name + AFTER_JOB_SUFFIX
+        self.scheduler.add_job(self._job_wrapper, id=jid, name=name, args=[task], kwargs={"job_id": jid},
+                               executor=task_pool(task, settings), replace_existing=True)
+
+    def _current_task(self, name):
+        t = next((t for t in self.data.get("tasks", []) if t["name"] == name), None)
+        return (t, self.data["settings"]) if t else None
+
+    def _finish_run(self, task, rc, dur, log_path, usage=None, dispatch=None):
+        if rc is None:
+            return  # spawn: o supervisor chama de novo quando o processo terminar
+        append_history(self.data, task["name"], rc, dur, usage=usage, dispatch=dispatch,
+                       steps=pdi_steps(task, log_path))
+        self.dag.finished(task["name"], rc)  # libera as etapas seguintes antes de notificar
+        self._maybe_notify(task, rc, log_path)
+        if self.on_run_done:
+            try:
+                self.on_run_done(task, rc, dur, log_path)
+            except Exception:
+                pass
+
+    def _maybe_notify(self, task, rc, log_path):
+        if not task.get("notify_fail", True):
+            return
+        name = task["name"]
+        alert = self.alerts.decide(name, rc, self.data["settings"])
+        if alert is None:
+            return
+        if alert["kind"] == "suppressed":
+            notifier().note_suppressed(f"[{name}] FALHA (RC={rc})", alert["reason"])
+            return
+        if alert["kind"] == "recovery":
+            subject = f"[{name}] RECUPERADA"
+            body = (f"Tarefa: {name}\nData: {now_str()}\n"
+                    f"Voltou a rodar com sucesso após {alert['fails']} falha(s) seguida(s).\nLog: {log_path}")
+        else:
+            subject = f"[{name}] FALHA (RC={rc})"
+            body = f"Tarefa: {name}\nData: {now_str()}\nRC: {rc}\nLog: {log_path}"
+            if alert["fails"] > 1:
+                body += f"\nFalhas seguidas: {alert['fails']}"
+        if alert["suppressed"]:
+            body += f"\n(+{alert['suppressed']} alerta(s) suprimido(s) desde o último aviso)"
+        # não segura o worker do agendador: e-mail/WhatsApp saem pelo despachante
+        notifier().submit(self.data["settings"], subject, body, task=name, rc=rc)
+
+    def shutdown(self, wait=False):
+        try:
+            self.scheduler.shutdown(wait=wait)
+        except Exception:
+            pass
+        self.async_runner.stop()
+        self.spawns.shutdown()
+        metrics_server().stop()
+        warm_pool().close()
+        self._finishers.shutdown(wait=wait)
+
+
+def engine_host():
+    """(pid, "gui"|"daemon") de outro processo vivo que hospeda o motor, ou None."""
+    try:
+        parts = ENGINE_PIDFILE.read_text(encoding="utf-8").split()
+        pid, started = int(parts[0]), (float(parts[1]) if len(parts) > 1 and parts[1] != "-" else None)
+        kind = parts[2] if len(parts) > 2 else "daemon"
+    except Exception:
+        return None
+    if pid == os.getpid() or not _pid_alive(pid, started):
+        return None
+    return pid, kind
+
+def acquire_engine_lock(kind) -> bool:
+    """
+    Reserva o motor para este processo (`kind` = "gui" ou "daemon"). False se outro
+    processo vivo já o hospeda: a GUI vira cliente, o daemon não sobe.
+    """
+    ensure_dirs()
+    for _ in range(2):
+        try:
+            fd = os.open(str(ENGINE_PIDFILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            _proc_table.invalidate()  # decide com a tabela de agora, não com a foto em cache
+            if engine_host() is not None:
+                return False
+            try:
+                ENGINE_PIDFILE.unlink()  # dono morreu (ou PID reaproveitado): arquivo velho
+            except FileNotFoundError:
+                pass
+            continue
+        started = _proc_create_time(os.getpid())
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{os.getpid()} {'-' if started is None else f'{started:.3f}'} {kind}")
+        atexit.register(release_engine_lock)
+        return True
+    return False
+
+def release_engine_lock():
+    try:
+        pid = int(ENGINE_PIDFILE.read_text(encoding="utf-8").split()[0])
+    except Exception:
+        return
+    if pid == os.getpid():
+        try:
+            ENGINE_PIDFILE.unlink()
+        except OSError:
+            pass
+
+def daemon_running() -> bool:
+    """True se há um `--daemon` vivo (a GUI passa a ser só cliente do config.json)."""
+    host = engine_host()
+    return bool(host and host[1] == "daemon")
+
+
+def _data_mtime():
+    try:
+        return DATA_FILE.stat().st_mtime
+    except Exception:
+        return None
+
+
+def run_daemon():
+    """
+    Modo headless: carrega o config.json, agenda as tarefas e fica rodando até
+    SIGINT/SIGTERM. Se a GUI (modo cliente) alterar tarefas/configurações, o
+    arquivo é relido e os jobs reagendados. O histórico vai para o history.db.
+    """
+    ensure_dirs()
+    if not acquire_engine_lock("daemon"):
+        pid, kind = engine_host() or (0, "?")
+        where = "a interface (GUI)" if kind == "gui" else "outro daemon"
+        print(f"Já existe um agendador rodando ({where}, PID {pid}); feche-o antes de iniciar o daemon.")
+        return 1
+
+    data = load_data()
+    engine = SchedulerEngine(
+        data,
+        on_run_done=lambda t, rc, dur, log: print(f"{now_str()} [{t['name']}] RC={rc} {dur:.1f}s -> {log}"),
+    )
+    engine.reschedule_all()
+    print(f"{now_str()} Agendador em modo daemon: {len(engine.jobs)} tarefa(s) agendada(s). Config: {DATA_FILE}")
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            signal.signal(sig, lambda *_: stop.set())
+        except Exception:
+            pass
+
+    last_mtime = _data_mtime()
+    try:
+        while not stop.wait(DAEMON_RELOAD_SEC):
+            mtime = _data_mtime()
+            if mtime is None or mtime == last_mtime:
+                continue
+            fresh = load_data()
+            last_mtime = mtime
+            if fresh.get("tasks") == data.get("tasks") and fresh.get("settings") == data.get("settings"):
+                continue  # só mudou a fila de updates da GUI, por exemplo
+            data["settings"] = fresh.get("settings", data.get("settings", {}))
+            data["tasks"] = fresh.get("tasks", [])
+            engine.reschedule_all()
+            print(f"{now_str()} config.json alterado: {len(engine.jobs)} tarefa(s) reagendada(s).")
+    finally:
+        engine.shutdown(wait=False)
+        flush_data()
+        release_engine_lock()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_daemon())
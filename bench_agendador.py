@@ -0,0 +1,378 @@
+# bench_agendador.py
+#
+# Benchmarks do motor (agendamento, execução, persistência) e da GUI, sem tocar
+# nos dados reais: tudo roda numa pasta temporária (PROGRAMDATA apontado para ela).
+#
+#   python bench_agendador.py                      # tudo, saída JSON no stdout
+#   python bench_agendador.py --out v1.json        # grava o resultado
+#   python bench_agendador.py --compare v1.json    # compara com uma versão anterior
+#   python bench_agendador.py --only reschedule,history --tasks 2000
+#   xvfb-run python bench_agendador.py --only gui  # Linux sem tela
+#
+# Seções: reschedule, dispatch, run_task, history, save_data, gui.
+
+import os, sys, json, time, tempfile, argparse, platform, subprocess, shutil
+import asyncio, concurrent.futures, threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SECTIONS = ("reschedule", "dispatch", "run_task", "history", "save_data", "gui")
+
+QUIET_CHILD = "import sys\n"
+CHATTY_CHILD = (
+    "import sys\n"
+    "n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000\n"
+    "for i in range(n):\n"
+    "    print(f'linha {i} ' + 'x' * 60)\n"
+)
+SLEEP_CHILD = "import sys, time\ntime.sleep(float(sys.argv[1]) if len(sys.argv) > 1 else 0.05)\n"
+
+
+def _timeit(fn, repeat=1):
+    """Menor tempo (s) de `repeat` chamadas."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+
+def _synthetic_tasks(n, script, args=""):
+    """N tarefas com agendamentos variados (horários fixos, intervalos alinhados e 'tortos')."""
+    tasks = []
+    for i in range(n):
+        t = {"name": f"bench_{i:05d}", "path": str(script), "args": args, "working_dir": "",
+             "days": [True] * 7, "timeout": "0", "notify_fail": False}
+        kind = i % 3
+        if kind == 0:
+            t.update(schedule_type="cron", times=[f"{(i // 60) % 24:02d}:{i % 60:02d}", "23:59"])
+        elif kind == 1:
+            t.update(schedule_type="interval", every_value=15, every_unit="minutes")
+        else:
+            t.update(schedule_type="interval", every_value=7 + i % 40, every_unit="minutes")
+        tasks.append(t)
+    return tasks
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ======================================================================================
+#  Seções
+# ======================================================================================
+
+def bench_reschedule(core, work, n_tasks):
+    data = core.load_data()
+    data["tasks"] = _synthetic_tasks(n_tasks, work / "quiet.py")
+    engine = core.SchedulerEngine(data)
+    try:
+        first = _timeit(engine.reschedule_all)
+        noop = _timeit(engine.reschedule_all, repeat=3)
+        data["tasks"][0] = {**data["tasks"][0], "timeout": "60"}
+        args_only = _timeit(engine.reschedule_all)
+        t = data["tasks"][1]
+        data["tasks"][1] = {**t, "schedule_type": "interval", "every_value": 5, "every_unit": "minutes"}
+        one_schedule = _timeit(engine.reschedule_all)
+        data["settings"] = {**data["settings"], "stagger": {"enabled": True, "jitter_sec": 0}}
+        stagger_all = _timeit(engine.reschedule_all)
+        jobs = len(engine.scheduler.get_jobs())
+    finally:
+        engine.shutdown()
+    return {"tasks": n_tasks, "jobs": jobs, "first_s": first, "noop_s": noop,
+            "change_args_s": args_only, "change_one_schedule_s": one_schedule,
+            "enable_stagger_s": stagger_all}
+
+
+def bench_dispatch(core, work, n_jobs, runner):
+    """N jobs vencendo no mesmo instante; mede horário previsto -> início do _job_wrapper."""
+    starts = {}
+    done = threading.Event()
+    finished = []
+
+    class _Engine(core.SchedulerEngine):
+        def _job_wrapper(self, task, **kw):
+            starts.setdefault(task["name"], time.time())
+            super()._job_wrapper(task, **kw)
+
+    def _on_done(task, rc, dur, log):
+        finished.append(time.time())
+        if len(finished) >= n_jobs:
+            done.set()
+
+    data = core.load_data()
+    data["settings"]["runner"] = runner
+    data["tasks"] = [dict(t, schedule_type="interval", every_value=1, every_unit="hours")
+                     for t in _synthetic_tasks(n_jobs, work / "sleep.py", "0.05")]
+    engine = _Engine(data, on_run_done=_on_done)
+    try:
+        engine.reschedule_all()
+        fire_at = datetime.now() + timedelta(seconds=1)
+        for names in engine.jobs.values():
+            for jid in names:
+                engine.scheduler.modify_job(jid, next_run_time=fire_at)
+        completed = done.wait(max(60, n_jobs))
+    finally:
+        engine.shutdown()
+    lags = [ts - fire_at.timestamp() for ts in starts.values()]
+    return {"runner": runner, "jobs": n_jobs, "completed": len(finished), "timed_out": not completed,
+            "pools": core.executor_settings(data["settings"])["pools"],
+            "lag_p50_s": _pct(lags, 50), "lag_p95_s": _pct(lags, 95), "lag_max_s": max(lags, default=None),
+            "wall_s": (max(finished) - fire_at.timestamp()) if finished else None}
+
+
+def bench_run_task(core, work, runs, workers, chatty_lines):
+    settings = core.load_data()["settings"]
+    out = {}
+    for label, script, args in (("quiet", work / "quiet.py", ""),
+                                ("chatty", work / "chatty.py", str(chatty_lines))):
+        task = {"name": f"bench_{label}", "path": str(script), "args": args, "timeout": "0"}
+
+        def _sync():
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+                rcs = list(ex.map(lambda _: core.run_task(task, settings)[0], range(runs)))
+            assert all(rc == 0 for rc in rcs), rcs
+
+        async def _gather():
+            sem = asyncio.Semaphore(workers)
+
+            async def one():
+                async with sem:
+                    return (await core.run_task_async(task, settings))[0]
+            rcs = await asyncio.gather(*(one() for _ in range(runs)))
+            assert all(rc == 0 for rc in rcs), rcs
+
+        sync_s = _timeit(_sync)
+        async_s = _timeit(lambda: asyncio.run(_gather()))
+        out[label] = {"runs": runs, "workers": workers, "lines": chatty_lines if label == "chatty" else 0,
+                      "thread_s": sync_s, "thread_runs_per_s": runs / sync_s,
+                      "async_s": async_s, "async_runs_per_s": runs / async_s}
+    return out
+
+
+def bench_history(core, sizes, ops):
+    """Custo de append_history/leituras conforme o histórico de uma tarefa cresce."""
+    store = core.history_store()
+    name = "bench_hist"
+    out = []
+    have = 0
+    now = time.time()
+    for size in sizes:
+        if size > have:
+            rows = ((name, now - (size - i), i % 5 == 0, 1.0 + i % 17) for i in range(have, size))
+            store.append_many(rows)
+            have = size
+        t0 = time.perf_counter()
+        for i in range(ops):
+            core.append_history(None, name, 0, 1.5, usage={"rss_peak": 1 << 20, "cpu_user": 0.1})
+        append_us = (time.perf_counter() - t0) / ops * 1e6
+        have += ops
+        out.append({
+            "rows": have,
+            "append_us": append_us,
+            "tail_30_ms": _timeit(lambda: core.history_tail(name, 30), repeat=3) * 1e3,
+            "last_24h_ms": _timeit(lambda: core.history_columns(name, since=time.time() - 86400), repeat=3) * 1e3,
+            "all_ms": _timeit(lambda: core.history_columns(name), repeat=3) * 1e3,
+        })
+    return out
+
+
+def bench_save_data(core, work, task_counts):
+    """Gravação do config.json (serialização + escrita atômica) e o custo do save_data para quem chama."""
+    out = []
+    for n in task_counts:
+        data = core.load_data()
+        data["tasks"] = _synthetic_tasks(n, work / "quiet.py")
+        data["update_queue"] = [{"op": "check", "info": {}, "ts": core.now_str()}] * 50
+        text = core._dumps_config(data)
+        out.append({
+            "tasks": n,
+            "bytes": len(text.encode("utf-8")),
+            "dumps_ms": _timeit(lambda: core._dumps_config(data), repeat=3) * 1e3,
+            "write_ms": _timeit(lambda: core._write_config_atomic(text), repeat=3) * 1e3,
+            # o chamador só enfileira; a gravação fica com a thread do ConfigWriter
+            "save_call_us": _timeit(lambda: core.save_data(data), repeat=5) * 1e6,
+            "save_wait_ms": _timeit(lambda: core.save_data(data, wait=True), repeat=3) * 1e3,
+        })
+    core.flush_data()
+    return out
+
+
+def bench_gui(core, n_tasks, history_runs):
+    """refresh_table/_draw_chart_items da GUI num Tk de verdade (precisa de display; no Linux, xvfb-run)."""
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+    except Exception as e:
+        return {"skipped": f"Tk indisponível ({e}); rode com xvfb-run"}
+    import agendador as gui
+
+    class _Shim:
+        """Só o que refresh_table/_draw_chart_items usam da App."""
+        def draw_chart(self):
+            pass
+
+    for meth in ("refresh_table", "_row_values", "_flow_text", "_hora_dias_text", "_draw_chart_items", "_ci",
+                 "_chart_data"):
+        setattr(_Shim, meth, getattr(gui.App, meth))
+
+    try:
+        shim = _Shim()
+        shim.data = {"tasks": _synthetic_tasks(n_tasks, "quiet.py")}
+        shim.tree = ttk.Treeview(root, columns=("nome", "hora", "dias", "arquivo", "notificar", "timeout", "fluxo"),
+                                 show="headings")
+        shim.canvas = tk.Canvas(root, width=800, height=400)
+        shim._row_shown, shim._row_cache = {}, {}
+        shim._chart_items, shim._chart_used = {}, set()
+
+        def _upd():
+            root.update_idletasks()
+
+        first = _timeit(lambda: (shim.refresh_table(), _upd()))
+        noop = _timeit(lambda: (shim.refresh_table(), _upd()), repeat=3)
+        shim.data["tasks"][n_tasks // 2] = {**shim.data["tasks"][n_tasks // 2], "timeout": "99"}
+        one = _timeit(lambda: (shim.refresh_table(), _upd()))
+
+        name = "bench_chart"
+        now = time.time()
+        core.history_store().append_many((name, now - (history_runs - i), i % 9 == 0, 1.0 + i % 23)
+                                         for i in range(history_runs))
+        chart = {}
+        for window in ("Últimas 30", "Últimas 500", "Tudo"):
+            def _draw():
+                shim._chart_used = set()
+                shim._draw_chart_items(name, window, 800, 400)
+                _upd()
+            chart[window] = {"first_ms": _timeit(_draw) * 1e3, "redraw_ms": _timeit(_draw, repeat=3) * 1e3}
+    finally:
+        root.destroy()
+    return {"tasks": n_tasks, "refresh_first_s": first, "refresh_noop_s": noop, "refresh_one_change_s": one,
+            "chart_runs": history_runs, "chart": chart}
+
+
+# ======================================================================================
+#  Comparação / main
+# ======================================================================================
+
+def _flatten(obj, prefix=""):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from _flatten(v, f"{prefix}.{k}" if prefix else str(k))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            yield from _flatten(v, f"{prefix}[{i}]")
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix, obj
+
+
+def compare(base, cur):
+    """Linhas 'métrica  antes  agora  variação' para os tempos (chaves *_s, *_ms, *_us)."""
+    old = dict(_flatten(base.get("results", {})))
+    lines = []
+    for key, val in _flatten(cur.get("results", {})):
+        if not key.endswith(("_s", "_ms", "_us")) or key not in old or not old[key]:
+            continue
+        delta = (val - old[key]) / old[key] * 100
+        flag = "  <-- mais lento" if delta > 10 else ""
+        lines.append(f"{key:<60} {old[key]:>12.4g} {val:>12.4g} {delta:>+8.1f}%{flag}")
+    return lines
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks do Agendador-Bravo (saída em JSON).")
+    ap.add_argument("--only", default=",".join(SECTIONS), help=f"seções separadas por vírgula ({', '.join(SECTIONS)})")
+    ap.add_argument("--tasks", type=int, default=1000, help="tarefas sintéticas (reschedule/gui)")
+    ap.add_argument("--dispatch-jobs", type=int, default=200, help="jobs disparando ao mesmo tempo")
+    ap.add_argument("--runs", type=int, default=40, help="execuções por variante em run_task")
+    ap.add_argument("--workers", type=int, default=8, help="execuções simultâneas em run_task")
+    ap.add_argument("--chatty-lines", type=int, default=20000, help="linhas impressas pelo filho 'chatty'")
+    ap.add_argument("--history-sizes", default="0,10000,100000", help="tamanhos do histórico a medir")
+    ap.add_argument("--history-ops", type=int, default=500, help="append_history por tamanho")
+    ap.add_argument("--save-tasks", default="10,100,1000", help="nº de tarefas no config.json")
+    ap.add_argument("--chart-runs", type=int, default=50000, help="execuções no histórico do gráfico")
+    ap.add_argument("--out", help="grava o JSON neste arquivo")
+    ap.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    ap.add_argument("--keep", action="store_true", help="não apaga a pasta temporária")
+    args = ap.parse_args(argv)
+
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(only) - set(SECTIONS)
+    if unknown:
+        ap.error(f"seção desconhecida: {', '.join(sorted(unknown))}")
+
+    # antes de importar o core: APP_DIR é escolhido na importação
+    work = Path(tempfile.mkdtemp(prefix="agendador-bench-"))
+    os.environ["PROGRAMDATA"] = str(work / "programdata")
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import agendador_core as core
+    core.ensure_dirs()
+    (work / "quiet.py").write_text(QUIET_CHILD, encoding="utf-8")
+    (work / "chatty.py").write_text(CHATTY_CHILD, encoding="utf-8")
+    (work / "sleep.py").write_text(SLEEP_CHILD, encoding="utf-8")
+
+    results = {}
+    try:
+        for section in only:
+            print(f"# {section}...", file=sys.stderr)
+            t0 = time.perf_counter()
+            if section == "reschedule":
+                results[section] = bench_reschedule(core, work, args.tasks)
+            elif section == "dispatch":
+                results[section] = {r: bench_dispatch(core, work, args.dispatch_jobs, r) for r in ("thread", "async")}
+            elif section == "run_task":
+                results[section] = bench_run_task(core, work, args.runs, args.workers, args.chatty_lines)
+            elif section == "history":
+                sizes = sorted(int(x) for x in args.history_sizes.split(",") if x.strip())
+                results[section] = bench_history(core, sizes, args.history_ops)
+            elif section == "save_data":
+                counts = [int(x) for x in args.save_tasks.split(",") if x.strip()]
+                results[section] = bench_save_data(core, work, counts)
+            elif section == "gui":
+                results[section] = bench_gui(core, args.tasks, args.chart_runs)
+            print(f"#   {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    finally:
+        core.flush_data()
+        core.history_store().close()
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "psutil": bool(core.psutil),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"\n{'métrica':<60} {'antes':>12} {'agora':>12} {'var.':>9}", file=sys.stderr)
+        for line in compare(base, report):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# Isola os testes: config/histórico/logs numa pasta temporária (APP_DIR é resolvido no import)
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_base = tempfile.mkdtemp(prefix="agendador-tests-")
+for _env in ("PROGRAMDATA", "LOCALAPPDATA", "APPDATA"):
+    os.environ[_env] = _base
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
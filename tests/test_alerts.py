@@ -0,0 +1,39 @@
+import agendador_core as core
+
+
+def test_change_mode_sends_first_failure_and_recovery_only():
+    policy = core.AlertPolicy()
+    s = {"alerts": {"mode": "change"}}
+    assert policy.decide("carga", 0, s, now=0) is None
+    assert policy.decide("carga", 1, s, now=1) == {"kind": "fail", "fails": 1, "suppressed": 0}
+    assert policy.decide("carga", 1, s, now=2) == {"kind": "suppressed", "reason": "falha repetida"}
+    assert policy.decide("carga", 2, s, now=3)["kind"] == "suppressed"
+    assert policy.decide("carga", 0, s, now=4) == {"kind": "recovery", "fails": 3, "suppressed": 2}
+    assert policy.decide("carga", 0, s, now=5) is None
+
+
+def test_hourly_limits_hold_alerts_and_report_them_later():
+    policy = core.AlertPolicy()
+    s = {"alerts": {"mode": "every", "per_task_per_hour": 2, "global_per_hour": 3}}
+    assert policy.decide("a", 1, s, now=0)["kind"] == "fail"
+    assert policy.decide("a", 1, s, now=10)["kind"] == "fail"
+    assert policy.decide("a", 1, s, now=20) == {"kind": "suppressed", "reason": "limite de 2/h da tarefa"}
+    assert policy.decide("b", 1, s, now=30)["kind"] == "fail"
+    assert policy.decide("c", 1, s, now=40) == {"kind": "suppressed", "reason": "limite global de 3/h"}
+    # passada a janela, o próximo alerta sai e conta os que foram segurados
+    assert policy.decide("a", 1, s, now=3700) == {"kind": "fail", "fails": 4, "suppressed": 1}
+
+
+def test_every_mode_does_not_announce_recovery_and_bad_settings_fall_back():
+    policy = core.AlertPolicy()
+    assert core.alert_settings({"alerts": {"mode": "x", "per_task_per_hour": "abc"}}) == \
+        {"mode": "every", "per_task_per_hour": 0, "global_per_hour": 0}
+    assert policy.decide("a", 1, {}, now=0)["kind"] == "fail"
+    assert policy.decide("a", 0, {}, now=1) is None
+
+
+def test_digest_subject_counts_failures_and_recoveries_apart():
+    items = [{"task": "a", "subject": "[x] FALHA a", "body": ""},
+             {"task": "b", "subject": "[x] RECUPERADA b", "body": ""},
+             {"task": "a", "subject": "[x] FALHA a", "body": ""}]
+    assert core.digest_item(items)["subject"] == f"[{core.APP_NAME}] 2 falhas, 1 recuperada: a, b"
@@ -0,0 +1,20 @@
+import asyncio, time
+
+import agendador_core as core
+
+
+def test_timeout_is_one_deadline_even_with_slow_kill(tmp_path, monkeypatch):
+    script = tmp_path / "dorme.py"
+    script.write_text("import time\ntime.sleep(30)\n", encoding="utf-8")
+    real_kill = core.kill_process_tree
+
+    def slow_kill(pid):
+        time.sleep(2)  # ex.: taskkill /T demorando numa árvore grande
+        real_kill(pid)
+
+    monkeypatch.setattr(core, "kill_process_tree", slow_kill)
+    task = {"name": "dorme", "path": str(script), "timeout": "1"}
+    rc, dur, log = asyncio.run(core.run_task_async(task, {}))
+    assert rc == -9
+    assert 1.0 <= dur < 1.5
+    assert "TIMEOUT atingido (1s)" in open(log, encoding="utf-8").read()
@@ -0,0 +1,64 @@
+import agendador_core as core
+
+# extrai -> (limpa_a, limpa_b) -> carrega (join); relatorio roda mesmo se carrega falhar
+TASKS = [
+    {"name": "extrai"},
+    {"name": "limpa_a", "after": ["extrai"]},
+    {"name": "limpa_b", "after": [{"task": "extrai"}]},
+    {"name": "carrega", "after": ["limpa_a", "limpa_b"]},
+    {"name": "relatorio", "after": [{"task": "carrega", "on": "completion"}]},
+]
+
+
+def _dag():
+    fired = []
+    dag = core.DagTracker(trigger=fired.append)
+    dag.update(TASKS)
+    return dag, fired
+
+
+def _state(dag, name):
+    return dag._state[name][0]
+
+
+def test_branches_fire_together_and_join_waits_for_all():
+    dag, fired = _dag()
+    dag.started("extrai")
+    assert _state(dag, "carrega") == "waiting"
+    assert dag.finished("extrai", 0) == ["limpa_a", "limpa_b"]
+    assert dag.finished("limpa_a", 0) == []  # join: falta limpa_b
+    assert dag.finished("limpa_b", 0) == ["carrega"]
+    assert dag.finished("carrega", 3) == ["relatorio"]  # "completion": qualquer RC
+    assert fired == ["limpa_a", "limpa_b", "carrega", "relatorio"]
+
+
+def test_failure_blocks_everything_below_for_the_round():
+    dag, fired = _dag()
+    dag.started("extrai")
+    dag.finished("extrai", 0)
+    dag.finished("limpa_a", 1)
+    assert dag.finished("limpa_b", 0) == []
+    # o bloqueio desce a cadeia: nem o "completion" roda sem a anterior ter rodado
+    assert _state(dag, "carrega") == "blocked"
+    assert _state(dag, "relatorio") == "blocked"
+    assert dag.describe("carrega") == core.DAG_STATE_LABELS["blocked"]
+    assert dag.describe("limpa_a") == f"{core.DAG_STATE_LABELS['failed']} (RC=1)"
+    assert fired == ["limpa_a", "limpa_b"]
+
+
+def test_new_round_resets_states_and_trigger_errors_do_not_stop_others():
+    dag = core.DagTracker(trigger=lambda name: 1 / (name != "limpa_a"))
+    dag.update(TASKS)
+    dag.started("extrai")
+    assert dag.finished("extrai", 0) == ["limpa_a", "limpa_b"]
+    dag.started("extrai")
+    assert {_state(dag, n) for n in ("limpa_a", "limpa_b", "carrega")} == {"waiting"}
+
+
+def test_cycle_from_config_is_ignored():
+    tasks = [{"name": "a", "after": ["b"]}, {"name": "b", "after": ["a"]}, {"name": "c", "after": ["a"]}]
+    dag, fired = core.DagTracker(), []
+    dag.trigger = fired.append
+    dag.update(tasks)
+    assert dag.upstream("a") == [] and dag.upstream("b") == []
+    assert dag.finished("a", 0) == ["c"]
@@ -0,0 +1,25 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import agendador_core as core
+
+
+def _event(code, job_id):
+    return SimpleNamespace(code=code, job_id=job_id, scheduled_run_times=[datetime.now()])
+
+
+def test_after_jobs_are_not_scheduled_dispatches():
+    counted = []
+    stats = core.DispatchStats(record=lambda task, kind, n: counted.append((task, kind, n)))
+    now = [datetime.now()]
+
+    stats.submitted("carga::after", now)
+    assert stats.start("carga::after", "default") == {}
+    stats.on_event(_event(core.EVENT_JOB_MAX_INSTANCES, "carga::after"), None, "carga")
+    stats.skip("carga::after", "carga")
+    assert counted == []
+
+    stats.submitted("carga::0", now)
+    assert set(stats.start("carga::0", "default")) == {"scheduled", "started", "queue_wait"}
+    stats.on_event(_event(core.EVENT_JOB_MAX_INSTANCES, "carga::0"), None, "carga")
+    assert counted == [("carga", "skipped", 1)]
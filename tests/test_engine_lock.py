@@ -0,0 +1,34 @@
+import subprocess, sys, textwrap
+
+import agendador_core as core
+
+HOLDER = textwrap.dedent("""
+    import sys, time
+    sys.path.insert(0, sys.argv[1])
+    import agendador_core as core
+    assert core.acquire_engine_lock("gui")
+    print("ok", flush=True)
+    time.sleep(60)
+""")
+
+
+def test_second_engine_is_refused_while_gui_holds_lock(tmp_path):
+    root = str(core.Path(core.__file__).parent)
+    holder = subprocess.Popen([sys.executable, "-c", HOLDER, root], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "ok"
+        assert core.engine_host() == (holder.pid, "gui")
+        assert not core.acquire_engine_lock("daemon")
+        assert not core.daemon_running()
+        assert core.run_daemon() == 1
+    finally:
+        holder.kill()
+        holder.wait()
+    # dono morto: o arquivo velho é assumido
+    assert core.acquire_engine_lock("daemon")
+    try:
+        assert core.ENGINE_PIDFILE.read_text().split()[0] == str(core.os.getpid())
+        assert core.engine_host() is None
+    finally:
+        core.release_engine_lock()
+    assert not core.ENGINE_PIDFILE.exists()
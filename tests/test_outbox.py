@@ -0,0 +1,61 @@
+import time
+
+import agendador_core as core
+
+
+def _item(task, subject, rc=1):
+    return {"task": task, "subject": subject, "body": f"RC={rc}", "rc": rc}
+
+
+def test_claim_leases_rows_so_two_processes_do_not_duplicate(tmp_path):
+    gui = core.NotificationOutbox(tmp_path / "outbox.db")
+    daemon = core.NotificationOutbox(tmp_path / "outbox.db")  # mesma caixa, outra conexão
+    for i in range(3):
+        gui.put("email", _item(f"t{i}", f"Falha t{i}"))
+    first = gui.claim("email", 2)
+    second = daemon.claim("email", 10)
+    assert [r["task"] for r in first] == ["t0", "t1"]
+    assert [r["task"] for r in second] == ["t2"]
+    assert daemon.claim("email", 10) == []
+    assert [r["task"] for r in daemon.claim("email", 10, force=True)] == ["t0", "t1", "t2"]
+
+
+def test_failed_retry_backs_off_and_done_removes(tmp_path):
+    box = core.NotificationOutbox(tmp_path / "outbox.db")
+    box.put("whatsapp", _item("carga", "Falha carga"), error="sem rede", attempts=1)
+    assert box.claim("whatsapp", 10) == []  # já nasce com backoff
+    [row] = box.claim("whatsapp", 10, force=True)
+    box.retry([row], RuntimeError("SMTP fora"))
+    [row] = box.claim("whatsapp", 10, force=True)
+    assert row["attempts"] == 2
+    assert core.NotificationOutbox.backoff(2) == 2 * core.OUTBOX_RETRY_SEC
+    assert core.NotificationOutbox.backoff(50) == core.OUTBOX_BACKOFF_MAX_SEC
+    box.done([row["id"]])
+    assert box.count() == 0
+
+
+def test_expire_drops_only_old_rows(tmp_path):
+    box = core.NotificationOutbox(tmp_path / "outbox.db")
+    box.put("email", {**_item("velha", "Falha velha"), "ts": time.time() - 10 * 86400})
+    box.put("email", _item("nova", "Falha nova"))
+    assert box.expire(time.time() - 86400) == 1
+    assert [r["task"] for r in box.claim("email", 10)] == ["nova"]
+
+
+def test_drain_sends_batch_with_neutral_subject_and_requeues_on_error(tmp_path, monkeypatch):
+    box = core.NotificationOutbox(tmp_path / "outbox.db")
+    monkeypatch.setattr(core, "_outbox", box)
+    box.put("email", _item("a", "Falha a"))
+    box.put("email", _item("b", "Recuperada b", rc=0))
+    sent, fail = [], ["SMTP fora"]
+    disp = core.NotificationDispatcher()
+    monkeypatch.setattr(disp, "_send", lambda channel, item: sent.append(item) or (fail.pop() if fail else None))
+
+    disp._drain_channel("email", {}, force=True)
+    assert box.count() == 2  # falhou: volta para a caixa com backoff
+    assert sent[0]["subject"] == f"[{core.APP_NAME}] 2 notificações pendentes (reenvio): a, b"
+
+    disp._drain_channel("email", {}, force=True)
+    assert box.count() == 0
+    assert len(sent) == 2
+    assert box.claim("email", 10, force=True) == []
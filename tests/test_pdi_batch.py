@@ -0,0 +1,82 @@
+import threading, time
+
+import agendador_core as core
+
+STUB = "import time\nprint('Kitchen stub', flush=True)\ntime.sleep(60)\n"
+
+# Kitchen de mentira: roda as entradas do lote; a tarefa "b" falha
+KITCHEN = """
+for name in ("a", "b"):
+    print(f"2024/01/01 00:00:00 - agendador_lote - Starting entry [{name}]", flush=True)
+    print(f"2024/01/01 00:00:00 - Tabela {name}.0 - Finished processing (I=0, O=0, R=5, W=5, U=0, E=0)")
+    ok = "false" if name == "b" else "true"
+    print(f"2024/01/01 00:00:01 - agendador_lote - Finished job entry [{name}] (result=[{ok}])", flush=True)
+"""
+
+
+def _collect(batcher, tasks, settings):
+    results, done = {}, threading.Event()
+
+    def on_done(name):
+        def _cb(rc, dur, log, usage):
+            results[name] = (rc, log)
+            if len(results) == len(tasks):
+                done.set()
+        return _cb
+
+    for t in tasks:
+        batcher.submit(t, settings, on_done(t["name"]))
+    assert done.wait(20), "lote não publicou resultado"
+    return results
+
+
+def test_batch_splits_results_and_logs_per_task(tmp_path):
+    runner = tmp_path / "kitchen_ok.py"
+    runner.write_text(KITCHEN, encoding="utf-8")
+    settings = {"pentaho": {"batch_sec": 0.2, "runner": str(runner)}}
+    tasks = [{"name": n, "path": str(tmp_path / f"{n}.ktr"), "pdi_batch": True} for n in ("a", "b")]
+    assert all(core.pdi_batch_eligible(t, settings) for t in tasks)
+    results = _collect(core.PdiBatcher(), tasks, settings)
+    assert results["a"][0] == 0 and results["b"][0] == 1
+    assert core.pdi_steps(tasks[0], results["a"][1]) == [
+        {"step": "Tabela a", "input": 0, "output": 0, "read": 5, "written": 5, "updated": 0, "errors": 0}]
+    assert "Tabela b" not in open(results["a"][1], encoding="utf-8").read()
+
+
+def test_batch_that_cannot_start_still_publishes(tmp_path):
+    settings = {"pentaho": {"batch_sec": 0.1, "runner": str(tmp_path / "nao_existe.exe")}}
+    tasks = [{"name": n, "path": str(tmp_path / f"{n}.kjb"), "pdi_batch": True} for n in ("a", "b")]
+    start = time.time()
+    results = _collect(core.PdiBatcher(), tasks, settings)
+    assert {n: rc for n, (rc, _) in results.items()} == {"a": -1, "b": -1}
+    assert time.time() - start < 10
+    assert "ERRO ao iniciar/executar o lote" in open(results["a"][1], encoding="utf-8").read()
+
+
+def test_batch_timeout_covers_tasks_without_timeout():
+    assert core.pdi_batch_timeout([{"timeout": "2"}, {"timeout": ""}, {}]) == 6
+    assert core.pdi_batch_timeout([{"timeout": "2"}, {"timeout": "3"}]) == 5
+    assert core.pdi_batch_timeout([{}, {"timeout": "0"}]) is None
+
+
+def test_mixed_batch_is_killed_by_watchdog(tmp_path):
+    runner = tmp_path / "kitchen_stub.py"
+    runner.write_text(STUB, encoding="utf-8")
+    settings = {"pentaho": {"batch_sec": 0.2, "runner": str(runner)}}
+    tasks = [{"name": "com_prazo", "path": str(tmp_path / "a.kjb"), "pdi_batch": True, "timeout": "1"},
+             {"name": "sem_prazo", "path": str(tmp_path / "b.kjb"), "pdi_batch": True}]
+    results, done = {}, threading.Event()
+
+    def on_done(name):
+        def _cb(rc, dur, log, usage):
+            results[name] = rc
+            if len(results) == len(tasks):
+                done.set()
+        return _cb
+
+    batcher, start = core.PdiBatcher(), time.time()
+    for t in tasks:
+        batcher.submit(t, settings, on_done(t["name"]))
+    assert done.wait(20), "lote misto ficou sem watchdog"
+    assert time.time() - start < 15
+    assert results == {"com_prazo": -9, "sem_prazo": -9}
@@ -0,0 +1,57 @@
+import pickle
+from datetime import datetime, timedelta
+
+import pytz
+
+import agendador_core as core
+
+TZ = pytz.utc
+
+
+def _engine():
+    return core.SchedulerEngine({"tasks": [], "settings": {}})
+
+
+def test_days_interval_trigger_skips_unmarked_days():
+    # segunda e quarta; a grade começa numa segunda
+    start = datetime(2024, 1, 1, 0, 0)
+    trig = core.DaysIntervalTrigger([0, 2], hours=5, start_date=start, timezone=TZ)
+    t = trig.get_next_fire_time(None, datetime(2024, 1, 1, 23, 0, tzinfo=TZ))
+    assert t.weekday() == 2  # terça inteira pulada
+    seen = set()
+    for _ in range(30):
+        seen.add(t.weekday())
+        t = trig.get_next_fire_time(t, t)
+    assert seen == {0, 2}
+
+
+def test_days_interval_trigger_keeps_grid_with_jitter_and_pickles():
+    start = datetime(2024, 1, 1, 0, 3)
+    trig = core.DaysIntervalTrigger(range(7), minutes=7, start_date=start, timezone=TZ, jitter=60)
+    prev = trig.get_next_fire_time(None, datetime(2024, 1, 2, 12, 0, tzinfo=TZ))
+    for _ in range(50):
+        nxt = trig.get_next_fire_time(prev, prev)
+        # jitter só atrasa a partir da grade: o disparo não "anda" a cada execução
+        base = (nxt - trig.start_date).total_seconds() % 420
+        assert base <= 60
+        prev = nxt
+    clone = pickle.loads(pickle.dumps(trig))
+    assert clone.weekdays == trig.weekdays
+
+
+def test_stagger_offset_is_stable_and_inside_period():
+    assert core.stagger_offset("carga_vendas", 420) == core.stagger_offset("carga_vendas", 420)
+    assert all(0 <= core.stagger_offset(f"t{i}", 420) < 420 for i in range(200))
+    assert len({core.stagger_offset(f"t{i}", 420) for i in range(50)}) > 10
+
+
+def test_interval_jitter_is_capped_at_half_period():
+    task = {"name": "a", "schedule_type": "interval", "every_value": "7", "every_unit": "minutes"}
+    [(_, trig)] = _engine()._task_triggers(task, {"enabled": True, "jitter_sec": 3600})
+    assert trig.jitter == 210
+    assert trig.start_date.replace(tzinfo=None) - core.INTERVAL_EPOCH == timedelta(seconds=core.stagger_offset("a", 420))
+
+
+def test_no_marked_day_means_no_trigger():
+    task = {"name": "a", "schedule_type": "interval", "every_value": "7", "days": [False] * 7}
+    assert _engine()._task_triggers(task, {"enabled": False, "jitter_sec": 0}) == []
@@ -0,0 +1,45 @@
+import sys
+import textwrap
+
+import pytest
+
+import agendador_core as core
+
+# imita o `wa_send.js --serve`; na 1ª vida morre ao receber o 1º pedido
+FAKE_SERVER = textwrap.dedent("""
+    import json, os, sys
+    marker = sys.argv[-1]  # argv: --serve <marker>
+    first = not os.path.exists(marker)
+    open(marker, "a").write("start\\n")
+    print(json.dumps({"event": "ready"}), flush=True)
+    for line in sys.stdin:
+        req = json.loads(line)
+        if first:
+            os._exit(1)
+        print(json.dumps({"id": req["id"], "ok": True, "sent": 1, "not_found": []}), flush=True)
+""")
+
+
+def test_resident_dies_mid_send_is_restarted_and_resent(tmp_path):
+    script = tmp_path / "fake_wa.py"
+    script.write_text(FAKE_SERVER, encoding="utf-8")
+    marker = tmp_path / "starts.txt"
+    sender = core.WhatsAppSender(sys.executable, str(script), extra_args=(str(marker),))
+    try:
+        resp = sender.send(["number:+5511999999999"], "oi", timeout=20)
+    finally:
+        sender.close()
+    assert resp["ok"]
+    assert marker.read_text().count("start") == 2
+
+
+def test_resident_that_never_answers_times_out(tmp_path):
+    script = tmp_path / "mute_wa.py"
+    script.write_text('import json, sys\nprint(json.dumps({"event": "ready"}), flush=True)\n'
+                      'for _ in sys.stdin:\n    pass\n', encoding="utf-8")
+    sender = core.WhatsAppSender(sys.executable, str(script))
+    try:
+        with pytest.raises(RuntimeError, match="não respondeu em 1s"):
+            sender.send(["number:+5511999999999"], "oi", timeout=1)
+    finally:
+        sender.close()
@@ -3,117 +3,220 @@
 // Uso:
 //   node wa_send.js --to "group:MDW Bravo | BI, number:+5511999999999" --message "Olá!"
 //   node wa_send.js --list-chats   (lista grupos/contatos visíveis)
+//   node wa_send.js --serve        (residente: fica logado e lê pedidos JSON do stdin)
+//   node wa_send.js --serve --stub (residente sem WhatsApp, só confirma os pedidos; para testes)
+//
+// Protocolo do modo --serve (uma linha JSON por mensagem):
+//   stdin : {"id": 1, "to": "group:X, number:+55...", "message": "texto"}
+//           {"id": 2, "cmd": "ping"}   |   {"cmd": "quit"}
+//   stdout: {"event": "ready"} / {"event": "qr"} / {"event": "auth_failure"} / {"event": "disconnected"}
+//           {"id": 1, "ok": true, "sent": 2, "not_found": []}
+//           {"id": 1, "ok": false, "error": "..."}
+//   Logs e o QR vão para o stderr, para não misturar com o protocolo.
 
 const minimist = require('minimist');
-const qrcode = require('qrcode-terminal');
 const path = require('path');
 const fs = require('fs');
-const { Client, LocalAuth } = require('whatsapp-web.js');
+const readline = require('readline');
 
 const args = minimist(process.argv.slice(2));
 const wantList = !!args['list-chats'];
+const serve = !!args.serve;
+const stub = !!args.stub || process.env.WA_STUB === '1';
 const toArg = (args.to || '').toString();
 const message = (args.message || '').toString();
 
-if (!wantList && (!toArg || !message)) {
+if (!serve && !wantList && (!toArg || !message)) {
   console.error('Uso: node wa_send.js --to "<destinos>" --message "<texto>"');
   console.error('      Destinos: group:<nome do grupo>, number:+5511999999999 (separados por vírgula)');
   console.error('      Ou: node wa_send.js --list-chats');
+  console.error('      Ou: node wa_send.js --serve   (residente, pedidos JSON pelo stdin)');
   process.exit(2);
 }
 
-// Persistência do login (QR) em pasta compartilhada do sistema
-const dataDir =
-  process.env.WA_DATA_DIR ||
-  path.join(process.env.ALLUSERSPROFILE || 'C:\\ProgramData', 'AgendadorBravo', 'wa-data');
+// no modo residente o stdout é só do protocolo
+const log = serve ? (...a) => console.error(...a) : (...a) => console.log(...a);
+const reply = (obj) => process.stdout.write(JSON.stringify(obj) + '\n');
 
-fs.mkdirSync(dataDir, { recursive: true });
-
-const client = new Client({
-  authStrategy: new LocalAuth({ dataPath: dataDir }),
-  puppeteer: {
-    headless: true,
-    args: ['--no-sandbox', '--disable-setuid-sandbox'],
-  },
-});
-
-client.on('qr', (qr) => {
-  console.log('Escaneie o QR com o WhatsApp deste remetente:');
-  qrcode.generate(qr, { small: true });
-});
-
-client.on('auth_failure', (msg) => console.error('Falha na autenticação:', msg));
-client.on('disconnected', (reason) => console.log('Desconectado:', reason));
-
-client.on('ready', async () => {
-  console.log('Client READY');
-
-  const chats = await client.getChats();
+function parseTargets(to) {
+  return to.split(',').map((s) => s.trim()).filter(Boolean);
+}
 
-  if (wantList) {
-    console.log('--- GRUPOS ---');
-    chats.filter((c) => c.isGroup).forEach((c, i) => console.log(`${i + 1}. ${c.name}`));
-    console.log('--- CONTATOS ---');
-    chats
-      .filter((c) => !c.isGroup)
-      .forEach((c, i) => console.log(`${i + 1}. ${c.name} (${c.id.user || ''})`));
-    await client.destroy();
-    process.exit(0);
+function resolveChatId(chats, t) {
+  const lower = t.toLowerCase();
+  if (lower.startsWith('group:')) {
+    const name = t.slice('group:'.length).trim().toLowerCase();
+    const g = chats.find((c) => c.isGroup && c.name && c.name.toLowerCase().includes(name));
+    return g ? g.id._serialized : null;
   }
-
-  const targets = toArg.split(',').map((s) => s.trim()).filter(Boolean);
-  if (!targets.length) {
-    console.error('Nenhum destino válido informado em --to.');
-    await client.destroy();
-    process.exit(3);
+  if (lower.startsWith('number:')) {
+    const raw = t.slice('number:'.length).trim().replace(/[^\d+]/g, '');
+    const e164 = raw.startsWith('+') ? raw : '+' + raw;
+    return e164.replace('+', '') + '@c.us';
   }
+  const name = t.trim().toLowerCase();
+  const found = chats.find((c) => c.name && c.name.toLowerCase().includes(name));
+  return found ? found.id._serialized : null;
+}
 
-  let sent = 0,
-    notFound = [];
+async function sendToTargets(client, targets, text) {
+  const chats = await client.getChats();
+  let sent = 0;
+  const notFound = [];
   for (const t of targets) {
     try {
-      const lower = t.toLowerCase();
-      let chatId = null;
-
-      if (lower.startsWith('group:')) {
-        const name = t.slice('group:'.length).trim().toLowerCase();
-        const g = chats.find((c) => c.isGroup && c.name && c.name.toLowerCase().includes(name));
-        if (g) chatId = g.id._serialized;
-      } else if (lower.startsWith('number:')) {
-        const raw = t.slice('number:'.length).trim().replace(/[^\d+]/g, '');
-        const e164 = raw.startsWith('+') ? raw : '+' + raw;
-        chatId = e164.replace('+', '') + '@c.us';
-      } else {
-        const name = t.trim().toLowerCase();
-        const found = chats.find((c) => c.name && c.name.toLowerCase().includes(name));
-        if (found) chatId = found.id._serialized;
-      }
-
+      const chatId = resolveChatId(chats, t);
       if (!chatId) {
-        console.warn(`Destino não encontrado: ${t}`);
+        log(`Destino não encontrado: ${t}`);
         notFound.push(t);
         continue;
       }
-
-      await client.sendMessage(chatId, message);
-      console.log(`OK -> ${t}`);
+      await client.sendMessage(chatId, text);
+      log(`OK -> ${t}`);
       sent++;
     } catch (e) {
       console.error(`Falhou -> ${t}:`, e && e.message ? e.message : e);
     }
   }
+  return { sent, notFound };
+}
 
-  console.log(`Resumo: enviados=${sent}, não encontrados=${notFound.length}`);
-  if (notFound.length) console.log('Não encontrados:', notFound.join(' | '));
+// ------------------------------------------------------------------
+//  Modo residente: um único Chromium logado atende todos os pedidos
+// ------------------------------------------------------------------
+function runServer(client) {
+  let queue = Promise.resolve(); // um envio por vez, na ordem de chegada
+
+  const handle = async (req) => {
+    if (req.cmd === 'ping') return reply({ id: req.id, ok: true });
+    const targets = parseTargets((req.to || '').toString());
+    const text = (req.message || '').toString();
+    if (!targets.length || !text) {
+      return reply({ id: req.id, ok: false, error: 'Pedido sem destino ou sem mensagem.' });
+    }
+    if (stub) {
+      log(`[stub] ${targets.join(' | ')}: ${text.split('\n')[0]}`);
+      return reply({ id: req.id, ok: true, sent: targets.length, not_found: [] });
+    }
+    const { sent, notFound } = await sendToTargets(client, targets, text);
+    reply({
+      id: req.id,
+      ok: sent > 0,
+      sent,
+      not_found: notFound,
+      error: sent > 0 ? undefined : 'Nenhum destino recebeu a mensagem.',
+    });
+  };
+
+  const rl = readline.createInterface({ input: process.stdin });
+  rl.on('line', (line) => {
+    line = line.trim();
+    if (!line) return;
+    let req;
+    try {
+      req = JSON.parse(line);
+    } catch (e) {
+      return reply({ ok: false, error: 'JSON inválido.' });
+    }
+    if (req.cmd === 'quit') {
+      rl.close();
+      return;
+    }
+    queue = queue.then(() => handle(req)).catch((e) =>
+      reply({ id: req.id, ok: false, error: e && e.message ? e.message : String(e) })
+    );
+  });
+  // stdin fechado = o Agendador saiu: encerra junto
+  rl.on('close', async () => {
+    await queue;
+    if (client) await client.destroy().catch(() => {});
+    process.exit(0);
+  });
+}
 
-  await new Promise((r) => setTimeout(r, 500));
-  await client.destroy();
-  process.exit(sent > 0 ? 0 : 4);
-});
+if (serve && stub) {
+  reply({ event: 'ready' });
+  runServer(null);
+} else {
+  const qrcode = require('qrcode-terminal');
+  const { Client, LocalAuth } = require('whatsapp-web.js');
+
+  // Persistência do login (QR) em pasta compartilhada do sistema
+  const dataDir =
+    process.env.WA_DATA_DIR ||
+    path.join(process.env.ALLUSERSPROFILE || 'C:\\ProgramData', 'AgendadorBravo', 'wa-data');
+
+  fs.mkdirSync(dataDir, { recursive: true });
+
+  const client = new Client({
+    authStrategy: new LocalAuth({ dataPath: dataDir }),
+    puppeteer: {
+      headless: true,
+      args: ['--no-sandbox', '--disable-setuid-sandbox'],
+    },
+  });
+
+  client.on('qr', (qr) => {
+    if (serve) reply({ event: 'qr' });
+    log('Escaneie o QR com o WhatsApp deste remetente:');
+    qrcode.generate(qr, { small: true }, (s) => log(s));
+  });
+
+  client.on('auth_failure', (msg) => {
+    if (serve) reply({ event: 'auth_failure' });
+    console.error('Falha na autenticação:', msg);
+  });
+  client.on('disconnected', (reason) => {
+    log('Desconectado:', reason);
+    if (serve) {
+      // o lado Python reinicia o processo quando ele morre
+      reply({ event: 'disconnected' });
+      process.exit(6);
+    }
+  });
+
+  client.on('ready', async () => {
+    log('Client READY');
+
+    if (serve) {
+      reply({ event: 'ready' });
+      runServer(client);
+      return;
+    }
+
+    if (wantList) {
+      const chats = await client.getChats();
+      console.log('--- GRUPOS ---');
+      chats.filter((c) => c.isGroup).forEach((c, i) => console.log(`${i + 1}. ${c.name}`));
+      console.log('--- CONTATOS ---');
+      chats
+        .filter((c) => !c.isGroup)
+        .forEach((c, i) => console.log(`${i + 1}. ${c.name} (${c.id.user || ''})`));
+      await client.destroy();
+      process.exit(0);
+    }
+
+    const targets = parseTargets(toArg);
+    if (!targets.length) {
+      console.error('Nenhum destino válido informado em --to.');
+      await client.destroy();
+      process.exit(3);
+    }
+
+    const { sent, notFound } = await sendToTargets(client, targets, message);
+
+    console.log(`Resumo: enviados=${sent}, não encontrados=${notFound.length}`);
+    if (notFound.length) console.log('Não encontrados:', notFound.join(' | '));
+
+    await new Promise((r) => setTimeout(r, 500));
+    await client.destroy();
+    process.exit(sent > 0 ? 0 : 4);
+  });
+
+  client.initialize();
+}
 
 process.on('unhandledRejection', (err) => {
   console.error('UnhandledRejection:', err && err.stack ? err.stack : err);
   process.exit(5);
 });
-
-client.initialize();